@@ -2,6 +2,7 @@
 Django settings for Tienda project.
 """
 
+import json
 import os
 from pathlib import Path
 
@@ -25,11 +26,31 @@ def _get_bool(name: str, *, default: bool = False) -> bool:
     return value.strip().lower() in {"1", "true", "yes", "on"}
 
 
+def _get_int(name: str, *, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError as exc:
+        raise ImproperlyConfigured(f"Environment variable {name} must be an integer.") from exc
+
+
 def _get_list(name: str, *, default: str = "") -> list[str]:
     raw_value = os.environ.get(name, default)
     return [item.strip() for item in raw_value.split(",") if item.strip()]
 
 
+def _get_json(name: str, *, default):
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return json.loads(value)
+    except ValueError as exc:
+        raise ImproperlyConfigured(f"Environment variable {name} must be valid JSON.") from exc
+
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = _get_env("SECRET_KEY", required=True)
 
@@ -55,6 +76,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tienda_app.metricas.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +106,30 @@ TEMPLATES = [
 WSGI_APPLICATION = 'Tienda.wsgi.application'
 
 
+# Conexiones: sin pool, DB_CONN_MAX_AGE > 0 reutiliza la conexion de cada hilo entre
+# requests (0 abre y cierra una por request). DB_POOL usa el pool nativo de psycopg 3,
+# uno por worker; el pool ya reutiliza las conexiones, asi que exige DB_CONN_MAX_AGE=0.
+# Bajo ASGI cada request corre en un hilo propio: ahi solo el pool evita reconectar.
+# DB_CONN_HEALTH_CHECKS: sin pool, Django verifica la conexion persistente al inicio de
+# cada request. Con pool esa verificacion no corre; Django la convierte en
+# check=ConnectionPool.check_connection al crear el pool, que prueba cada conexion al
+# prestarla. Por eso "check" no va en OPTIONS["pool"]: el argumento quedaria duplicado.
+DB_POOL = _get_bool("DB_POOL", default=False)
+DB_CONN_MAX_AGE = _get_int("DB_CONN_MAX_AGE", default=0)
+if DB_POOL and DB_CONN_MAX_AGE:
+    raise ImproperlyConfigured("DB_POOL requires DB_CONN_MAX_AGE=0: the pool already reuses connections.")
+
+_db_options = {"connect_timeout": _get_int("DB_CONNECT_TIMEOUT", default=10)}
+if DB_POOL:
+    _db_options["pool"] = {
+        "min_size": _get_int("DB_POOL_MIN_SIZE", default=2),
+        "max_size": _get_int("DB_POOL_MAX_SIZE", default=10),
+        # Segundos que un request espera una conexion libre antes de fallar.
+        "timeout": _get_int("DB_POOL_TIMEOUT", default=10),
+        "max_idle": _get_int("DB_POOL_MAX_IDLE", default=300),
+        "max_lifetime": _get_int("DB_POOL_MAX_LIFETIME", default=3600),
+    }
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -92,10 +138,28 @@ DATABASES = {
         'PASSWORD': _get_env("DB_PASSWORD", required=True),
         'HOST': _get_env("DB_HOST", required=True),
         'PORT': _get_env("DB_PORT", default="5432", required=True),
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': _get_bool("DB_CONN_HEALTH_CHECKS", default=False),
+        'OPTIONS': _db_options,
     }
 }
 
 
+CACHES = {
+    'default': {
+        'BACKEND': _get_env("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': _get_env("CACHE_LOCATION", default="tienda-catalogo"),
+    }
+}
+
+# Cache del catalogo: vida maxima de cada entrada y retraso tolerado para el stock.
+CATALOGO_CACHE_TIMEOUT = _get_int("CATALOGO_CACHE_TIMEOUT", default=300)
+CATALOGO_STOCK_STALENESS = _get_int("CATALOGO_STOCK_STALENESS", default=5)
+
+# Tamano de pagina por defecto de /api/v1/productos/ (el maximo por request es 500).
+PRODUCTOS_PAGINA_TAMANO = _get_int("PRODUCTOS_PAGINA_TAMANO", default=100)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -136,6 +200,39 @@ SECURE_SSL_REDIRECT = _get_bool("SECURE_SSL_REDIRECT", default=False)
 SESSION_COOKIE_SECURE = _get_bool("SESSION_COOKIE_SECURE", default=False)
 CSRF_COOKIE_SECURE = _get_bool("CSRF_COOKIE_SECURE", default=False)
 
+# Estrategia de reserva de stock para CompraRapidaService:
+# "pesimista" (select_for_update durante la reserva) u "optimista" (UPDATE condicional).
+COMPRA_RAPIDA_ESTRATEGIA = _get_env("COMPRA_RAPIDA_ESTRATEGIA", default="pesimista")
+
+# Con True, las compras rapidas (fbv, cbv y service) solo reservan el stock y encolan
+# la compra (HTTP 202); `manage.py procesar_compras` cobra y crea las ordenes en lotes.
+COMPRA_RAPIDA_ENCOLADA = _get_bool("COMPRA_RAPIDA_ENCOLADA", default=False)
+# Segundos tras los que una compra tomada por un worker que no termino vuelve a la cola.
+COLA_COMPRAS_REINTENTO_SEGUNDOS = _get_int("COLA_COMPRAS_REINTENTO_SEGUNDOS", default=300)
+
+# Tiempo maximo que una orden PENDIENTE retiene stock mientras se cobra.
+# Pasado este tiempo, `manage.py liberar_reservas` devuelve las unidades.
+RESERVA_ORDEN_TTL_SEGUNDOS = _get_int("RESERVA_ORDEN_TTL_SEGUNDOS", default=600)
+
+# Tope de `?wait=` en GET /api/v1/ordenes/<id>/ (long-poll del estado de la orden).
+ORDENES_ESPERA_MAXIMA_SEGUNDOS = _get_int("ORDENES_ESPERA_MAXIMA_SEGUNDOS", default=30)
+
+# Horas que se conserva la primera respuesta de cada Idempotency-Key.
+IDEMPOTENCIA_TTL_HORAS = _get_int("IDEMPOTENCIA_TTL_HORAS", default=24)
+# Segundos que una Idempotency-Key en proceso bloquea los reintentos. Si el
+# request murio sin responder, pasado este tiempo otro puede reclamarla. Debe
+# superar el timeout de Gunicorn (30 s).
+IDEMPOTENCIA_RESERVA_SEGUNDOS = _get_int("IDEMPOTENCIA_RESERVA_SEGUNDOS", default=60)
+
+# Antiguedad minima (segundos) de una orden para consolidarla en VentaDiaria.
+REPORTES_VENTAS_MARGEN_SEGUNDOS = _get_int("REPORTES_VENTAS_MARGEN_SEGUNDOS", default=60)
+
+# Reglas de IVA por categoria de libro y region, p. ej.
+# [{"categoria": "ebook", "tasa": "0.05"}, {"categoria": "texto", "region": "norte", "tasa": "0"}].
+# Sin reglas se aplica la tasa unica de CalculadorImpuestos.IVA.
+IMPUESTOS_REGLAS = _get_json("IMPUESTOS_REGLAS", default=[])
+IMPUESTOS_REGION = _get_env("IMPUESTOS_REGION", default="")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,15 @@
+"""
+Configuracion de Gunicorn para el contenedor `web`.
+
+Por defecto sirve `Tienda.asgi` con workers de Uvicorn: las vistas async
+(catalogo-async, api/v1/async/...) esperan la pasarela de pagos sin retener un
+hilo, y las vistas sync corren en el pool de hilos del worker (ASGI_THREADS).
+`GUNICORN_WORKER_CLASS=sync` vuelve a `Tienda.wsgi` con workers sync.
+"""
+
+import os
+
+bind = "0.0.0.0:8000"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn_worker.UvicornWorker")
+wsgi_app = "Tienda.wsgi:application" if worker_class == "sync" else "Tienda.asgi:application"
@@ -1,29 +1,58 @@
+import threading
+from collections import OrderedDict
+
 from flask import Flask, jsonify, request
 
 app = Flask(__name__)
 app.url_map.strict_slashes = False
 
+# Respuestas ya enviadas por Idempotency-Key, en memoria del proceso: el
+# contenedor corre un solo worker de gunicorn. Las claves mas viejas se
+# descartan al superar MAX_CLAVES_IDEMPOTENCIA.
+MAX_CLAVES_IDEMPOTENCIA = 10000
+_respuestas_por_clave = OrderedDict()
+_respuestas_lock = threading.Lock()
 
-@app.post("/api/v2/comprar")
-def realizar_compra():
-    data = request.get_json(silent=True) or {}
+
+def _procesar_compra(data):
     producto_id = data.get("producto_id")
     cantidad = data.get("cantidad", 1)
 
-    if not producto_id:
-        return jsonify({"error": "Falta el ID del producto"}), 400
-
-    return (
-        jsonify(
-            {
-                "mensaje": "Compra procesada exitosamente por el Microservicio Flask",
-                "producto_id": producto_id,
-                "cantidad": cantidad,
-                "status": "Aprobado",
-            }
-        ),
-        200,
-    )
+    # Un carrito con varios productos se cobra solo por su monto.
+    if not producto_id and not data.get("monto"):
+        return {"error": "Falta el ID del producto"}, 400
+
+    cuerpo = {
+        "mensaje": "Compra procesada exitosamente por el Microservicio Flask",
+        "status": "Aprobado",
+    }
+    if producto_id:
+        cuerpo.update(producto_id=producto_id, cantidad=cantidad)
+    else:
+        cuerpo["monto"] = data["monto"]
+    return cuerpo, 200
+
+
+@app.post("/api/v2/comprar")
+def realizar_compra():
+    clave = request.headers.get("Idempotency-Key")
+    if clave:
+        with _respuestas_lock:
+            guardada = _respuestas_por_clave.get(clave)
+        if guardada is not None:
+            cuerpo, status = guardada
+            response = jsonify(cuerpo)
+            response.status_code = status
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+    cuerpo, status = _procesar_compra(request.get_json(silent=True) or {})
+    if clave:
+        with _respuestas_lock:
+            _respuestas_por_clave[clave] = (cuerpo, status)
+            if len(_respuestas_por_clave) > MAX_CLAVES_IDEMPOTENCIA:
+                _respuestas_por_clave.popitem(last=False)
+    return jsonify(cuerpo), status
 
 
 if __name__ == "__main__":
@@ -36,6 +36,24 @@ class FlaskCompraAPITestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.get_json(), {"error": "Falta el ID del producto"})
 
+    def test_post_compra_sin_producto_se_cobra_por_monto(self):
+        response = self.client.post("/api/v2/comprar", json={"monto": "30.00"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["monto"], "30.00")
+        self.assertNotIn("producto_id", response.get_json())
+
+    def test_post_compra_repetida_con_la_misma_llave_repite_la_respuesta(self):
+        headers = {"Idempotency-Key": "pago-1"}
+        primera = self.client.post("/api/v2/comprar", json={"producto_id": 4}, headers=headers)
+        repetida = self.client.post("/api/v2/comprar", json={"producto_id": 4}, headers=headers)
+        otra = self.client.post("/api/v2/comprar", json={"producto_id": 4}, headers={"Idempotency-Key": "pago-2"})
+
+        self.assertNotIn("Idempotent-Replayed", primera.headers)
+        self.assertEqual(repetida.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(repetida.get_json(), primera.get_json())
+        self.assertNotIn("Idempotent-Replayed", otra.headers)
+
     def test_post_compra_acepta_ruta_con_slash_final(self):
         response = self.client.post("/api/v2/comprar/", json={"producto_id": 5})
 
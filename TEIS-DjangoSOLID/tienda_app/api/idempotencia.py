@@ -0,0 +1,218 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from tienda_app.models import SolicitudIdempotente
+
+
+class CacheLRU:
+    """Cache en memoria del proceso para las respuestas ya completadas."""
+
+    def __init__(self, tamano_maximo=1024):
+        self.tamano_maximo = tamano_maximo
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            valor = self._datos.get(clave)
+            if valor is not None:
+                self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.tamano_maximo:
+                self._datos.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+respuestas_recientes = CacheLRU()
+
+
+def _huella(request):
+    return hashlib.sha256(request.path.encode() + b"\n" + request.body).hexdigest()
+
+
+def _cliente(request):
+    """
+    Quien envia la clave: el usuario autenticado o, si es anonimo, su IP. Detras
+    de nginx la IP real es el ultimo valor de X-Forwarded-For, que agrega nginx.
+    """
+    usuario = getattr(request, "user", None)
+    if getattr(usuario, "is_authenticated", False):
+        return f"usuario:{usuario.pk}"
+    reenviada = request.META.get("HTTP_X_FORWARDED_FOR", "")
+    ip = reenviada.rsplit(",", 1)[-1].strip() if reenviada else request.META.get("REMOTE_ADDR", "")
+    return f"ip:{ip}"[:150]
+
+
+def _vencimiento():
+    return timezone.now() - timedelta(hours=settings.IDEMPOTENCIA_TTL_HORAS)
+
+
+def _reserva_vencida(solicitud):
+    # Una solicitud EN_PROCESO mas vieja que la reserva murio sin responder.
+    if solicitud.estado == SolicitudIdempotente.Estado.COMPLETADA:
+        return solicitud.creada < _vencimiento()
+    return solicitud.creada < timezone.now() - timedelta(seconds=settings.IDEMPOTENCIA_RESERVA_SEGUNDOS)
+
+
+def respuesta_json(cuerpo, status=200, headers=None):
+    """
+    JsonResponse para las vistas async, que no pasan por el APIView de DRF.
+    Expone `data` como `Response` para que la idempotencia guarde el cuerpo.
+    """
+    response = JsonResponse(cuerpo, status=status, headers=headers, safe=False)
+    response.data = cuerpo
+    return response
+
+
+def _repetir(guardada, huella, responder):
+    huella_original, status_code, cuerpo, creada = guardada
+    if huella_original != huella:
+        return responder(
+            {"error": "La Idempotency-Key ya se uso con un payload distinto."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return responder(cuerpo, status=status_code, headers={"Idempotent-Replayed": "true"})
+
+
+def _reservar_clave(alcance, huella):
+    """
+    Crea la fila EN_PROCESO. Si la clave ya existe retorna la fila existente;
+    las completadas vencidas y las en proceso cuya reserva vencio se descartan
+    y la clave se vuelve a usar.
+    """
+    cliente, ruta, clave = alcance
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                solicitud = SolicitudIdempotente.objects.create(cliente=cliente, ruta=ruta, clave=clave, huella=huella)
+                return solicitud, True
+        except IntegrityError:
+            existente = SolicitudIdempotente.objects.filter(cliente=cliente, ruta=ruta, clave=clave).first()
+            if existente is None:
+                continue
+            if not _reserva_vencida(existente):
+                return existente, False
+            SolicitudIdempotente.objects.filter(
+                pk=existente.pk,
+                estado=existente.estado,
+                creada=existente.creada,
+            ).delete()
+    raise IntegrityError(f"No fue posible reservar la Idempotency-Key {clave}.")
+
+
+def _reclamar(request, responder):
+    """
+    Paso previo comun a `con_idempotencia` y `acon_idempotencia`. Retorna
+    `(respuesta, None)` si la solicitud ya tiene respuesta (clave invalida,
+    repeticion o conflicto) y `(None, reclamo)` si hay que procesarla; el
+    reclamo es None cuando el request no trae Idempotency-Key.
+    """
+    clave = request.headers.get("Idempotency-Key")
+    if not clave:
+        return None, None
+    if len(clave) > 255:
+        return responder(
+            {"error": "Idempotency-Key no puede superar 255 caracteres."},
+            status=status.HTTP_400_BAD_REQUEST,
+        ), None
+
+    alcance = (_cliente(request), request.path, clave)
+    huella = _huella(request)
+    guardada = respuestas_recientes.obtener(alcance)
+    if guardada is not None and guardada[3] >= _vencimiento():
+        return _repetir(guardada, huella, responder), None
+
+    solicitud, creada = _reservar_clave(alcance, huella)
+    if not creada:
+        if solicitud.estado != SolicitudIdempotente.Estado.COMPLETADA:
+            return responder(
+                {"error": "Ya hay una solicitud en curso con esta Idempotency-Key."},
+                status=status.HTTP_409_CONFLICT,
+            ), None
+        guardada = (solicitud.huella, solicitud.status_code, solicitud.respuesta, solicitud.creada)
+        respuestas_recientes.guardar(alcance, guardada)
+        return _repetir(guardada, huella, responder), None
+
+    return None, (alcance, huella, solicitud)
+
+
+def _descartar(reclamo):
+    _, _, solicitud = reclamo
+    solicitud.delete()
+
+
+def _guardar(reclamo, response):
+    alcance, huella, solicitud = reclamo
+    if response.status_code >= 500:
+        solicitud.delete()
+        return
+
+    SolicitudIdempotente.objects.filter(pk=solicitud.pk).update(
+        estado=SolicitudIdempotente.Estado.COMPLETADA,
+        status_code=response.status_code,
+        respuesta=response.data,
+    )
+    respuestas_recientes.guardar(alcance, (huella, response.status_code, response.data, solicitud.creada))
+
+
+def con_idempotencia(request, procesar):
+    """
+    Ejecuta `procesar()` una sola vez por `Idempotency-Key`. Los reintentos con
+    la misma clave reciben la primera respuesta sin volver a tocar inventario.
+    Las respuestas 5xx no se guardan para que el cliente pueda reintentar.
+    """
+    respuesta, reclamo = _reclamar(request, Response)
+    if respuesta is not None:
+        return respuesta
+    if reclamo is None:
+        return procesar()
+
+    try:
+        response = procesar()
+    except Exception:
+        _descartar(reclamo)
+        raise
+
+    _guardar(reclamo, response)
+    return response
+
+
+async def acon_idempotencia(request, aprocesar):
+    """Version async de `con_idempotencia`; `aprocesar()` retorna un `respuesta_json`."""
+    respuesta, reclamo = await sync_to_async(_reclamar)(request, respuesta_json)
+    if respuesta is not None:
+        return respuesta
+    if reclamo is None:
+        return await aprocesar()
+
+    try:
+        response = await aprocesar()
+    except Exception:
+        await sync_to_async(_descartar)(reclamo)
+        raise
+
+    await sync_to_async(_guardar)(reclamo, response)
+    return response
+
+
+def purgar_solicitudes_vencidas():
+    borradas, _ = SolicitudIdempotente.objects.filter(creada__lt=_vencimiento()).delete()
+    return borradas
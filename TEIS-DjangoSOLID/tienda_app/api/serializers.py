@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
-from tienda_app.models import Libro
+from tienda_app.models import CompraEncolada, Libro, Orden, OrdenItem
+from tienda_app.reportes import FUENTE_RESUMEN, FUENTE_VIVO
 
 
 class LibroSerializer(serializers.ModelSerializer):
@@ -8,14 +9,64 @@ class LibroSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Libro
-        fields = ["id", "titulo", "precio", "stock_actual"]
+        fields = ["id", "titulo", "precio", "categoria", "stock_actual"]
 
     def get_stock_actual(self, obj):
+        # Con `fragmentos.con_stock()` el total incluye los fragmentos del libro.
+        if getattr(obj, "stock_total", None) is not None:
+            return obj.stock_total
         if hasattr(obj, "inventario"):
             return obj.inventario.cantidad
         return 0
 
 
+class OrdenItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrdenItem
+        fields = ["libro", "cantidad", "precio_unitario", "tasa_iva"]
+
+
+class OrdenSerializer(serializers.ModelSerializer):
+    """Estado de una orden con sus items; sin usuario ni direccion de envio."""
+
+    items = OrdenItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Orden
+        fields = ["id", "estado", "total", "fecha_creacion", "reservada_hasta", "items"]
+
+
+class OrdenQuerySerializer(serializers.Serializer):
+    """
+    Parametros de GET /api/v1/ordenes/<id>/.
+    `wait` (segundos) espera a que el estado deje de ser `estado` (por defecto, el actual).
+    """
+
+    wait = serializers.FloatField(min_value=0, required=False, default=0)
+    estado = serializers.ChoiceField(choices=Orden.Estado.choices, required=False)
+
+
+class CompraEncoladaSerializer(serializers.ModelSerializer):
+    """Estado de una compra rapida encolada; `orden` se llena al confirmarse."""
+
+    class Meta:
+        model = CompraEncolada
+        fields = ["token", "estado", "libro", "total", "orden", "error", "creada", "actualizada"]
+
+
+class ProductosQuerySerializer(serializers.Serializer):
+    """
+    Parametros de consulta de GET /api/v1/productos/.
+    `cursor` es el ultimo `id` recibido en la pagina anterior.
+    """
+
+    cursor = serializers.IntegerField(min_value=0, required=False)
+    limite = serializers.IntegerField(min_value=1, max_value=500, required=False)
+    en_stock = serializers.BooleanField(required=False, allow_null=True, default=None)
+    precio_min = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    precio_max = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+
 class OrdenInputSerializer(serializers.Serializer):
     """
     Serializer para validar la entrada de datos.
@@ -24,3 +75,49 @@ class OrdenInputSerializer(serializers.Serializer):
 
     libro_id = serializers.IntegerField(min_value=1)
     direccion_envio = serializers.CharField(max_length=200)
+
+
+class LineaCompraSerializer(serializers.Serializer):
+    libro_id = serializers.IntegerField(min_value=1)
+    cantidad = serializers.IntegerField(min_value=1, max_value=100, default=1)
+
+
+class CompraLoteInputSerializer(serializers.Serializer):
+    """
+    DTO para compras de varios libros en una sola orden.
+    Las lineas repetidas de un mismo libro se acumulan.
+    """
+
+    lineas = LineaCompraSerializer(many=True, allow_empty=False, max_length=200)
+    direccion_envio = serializers.CharField(max_length=200)
+
+
+class RangoFechasSerializer(serializers.Serializer):
+    """Rango `desde`/`hasta` inclusivo compartido por reportes y exportaciones."""
+
+    desde = serializers.DateField(required=False)
+    hasta = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        if attrs.get("desde") and attrs.get("hasta") and attrs["desde"] > attrs["hasta"]:
+            raise serializers.ValidationError("`desde` no puede ser posterior a `hasta`.")
+        return attrs
+
+
+class ReporteVentasQuerySerializer(RangoFechasSerializer):
+    """
+    Parametros de GET /api/v1/reportes/ventas/.
+    """
+
+    libro_id = serializers.IntegerField(min_value=1, required=False)
+    fuente = serializers.ChoiceField(choices=[FUENTE_RESUMEN, FUENTE_VIVO], default=FUENTE_RESUMEN)
+
+
+class ExportacionOrdenesQuerySerializer(RangoFechasSerializer):
+    """
+    Parametros de GET /api/v1/exportaciones/ordenes/.
+    `desde_id` activa el modo incremental: ordenes con id mayor al ultimo exportado.
+    """
+
+    formato = serializers.ChoiceField(choices=["csv", "ndjson"], default="csv")
+    desde_id = serializers.IntegerField(min_value=0, required=False)
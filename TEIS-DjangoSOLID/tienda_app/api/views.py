@@ -1,24 +1,184 @@
+import asyncio
+import json
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from rest_framework import status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from tienda_app.catalogo import aobtener_pagina_productos, obtener_pagina_productos
+from tienda_app.exportacion import FORMATOS, FORMATOS_ASYNC, aordenes_para_exportar, ordenes_para_exportar
 from tienda_app.infra.factories import PaymentFactory
-from tienda_app.models import Libro
+from tienda_app.models import CompraEncolada, Libro, Orden
+from tienda_app.reportes import reporte_ventas
 from tienda_app.services import CompraService
 
-from .serializers import LibroSerializer, OrdenInputSerializer
+from .idempotencia import acon_idempotencia, con_idempotencia, respuesta_json
+from .serializers import (
+    CompraEncoladaSerializer,
+    CompraLoteInputSerializer,
+    ExportacionOrdenesQuerySerializer,
+    OrdenInputSerializer,
+    OrdenQuerySerializer,
+    OrdenSerializer,
+    ProductosQuerySerializer,
+    ReporteVentasQuerySerializer,
+)
+
+
+def _nombre_usuario(usuario):
+    if getattr(usuario, "is_authenticated", False):
+        return usuario.get_username()
+    return "Invitado API"
+
+
+def _usuario_api(request):
+    return _nombre_usuario(request.user)
+
+
+def _respuesta_compra(request, servicio, mensaje, responder=Response):
+    orden_id = servicio.ultima_orden.id
+    orden_url = request.build_absolute_uri(reverse("api_orden", args=[orden_id]))
+    return responder(
+        {
+            "estado": "exito",
+            "mensaje": mensaje,
+            "orden_id": orden_id,
+            "orden_url": orden_url,
+        },
+        status=status.HTTP_201_CREATED,
+        headers={"Location": orden_url},
+    )
+
+
+def _etag_coincide(request, etag):
+    candidatos = request.headers.get("If-None-Match", "")
+    for candidato in candidatos.split(","):
+        candidato = candidato.strip()
+        if candidato == "*" or candidato.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _link_siguiente(request, pagina):
+    query = request.GET.copy()
+    query["cursor"] = pagina["siguiente"]
+    siguiente_url = request.build_absolute_uri(f"{request.path}?{query.urlencode()}")
+    return f'<{siguiente_url}>; rel="next"'
+
+
+# Intervalos (segundos) entre lecturas del estado durante el long-poll de ordenes.
+_ESPERA_INTERVALO_INICIAL = 0.1
+_ESPERA_INTERVALO_MAXIMO = 1.0
+
+
+async def _estado_orden(orden_id):
+    return await Orden.objects.filter(pk=orden_id).values_list("estado", flat=True).afirst()
+
+
+@require_GET
+async def orden_api_view(request, orden_id):
+    """
+    Orden con sus items: una consulta para la orden y otra (prefetch_related) para los items.
+    GET /api/v1/ordenes/<id>/?wait=20&estado=pendiente
+    Con `wait` la respuesta espera hasta que el estado cambie o se acabe el tiempo
+    (tope ORDENES_ESPERA_MAXIMA_SEGUNDOS). La espera es un `asyncio.sleep`: bajo
+    ASGI no retiene ningun hilo, solo una lectura liviana del estado por intervalo.
+    """
+    parametros = OrdenQuerySerializer(data=request.GET)
+    if not parametros.is_valid():
+        return JsonResponse(parametros.errors, status=400)
+
+    espera = min(parametros.validated_data["wait"], settings.ORDENES_ESPERA_MAXIMA_SEGUNDOS)
+    if espera:
+        estado_conocido = parametros.validated_data.get("estado") or await _estado_orden(orden_id)
+        limite = time.monotonic() + espera
+        intervalo = _ESPERA_INTERVALO_INICIAL
+        estado = estado_conocido
+        while estado == estado_conocido and estado is not None:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            await asyncio.sleep(min(intervalo, restante))
+            intervalo = min(intervalo * 2, _ESPERA_INTERVALO_MAXIMO)
+            estado = await _estado_orden(orden_id)
+
+    try:
+        orden = await Orden.objects.prefetch_related("items").aget(pk=orden_id)
+    except Orden.DoesNotExist:
+        return JsonResponse({"error": "Orden no encontrada."}, status=404)
+    return JsonResponse(OrdenSerializer(orden).data, headers={"Cache-Control": "no-store"})
 
 
 class ProductosAPIView(APIView):
     """
     Endpoint para listar productos disponibles en el monolito.
-    GET /api/v1/productos/
+    GET /api/v1/productos/?cursor=<id>&limite=100&en_stock=true&precio_min=10&precio_max=90
+    La siguiente pagina se anuncia en el header `Link` (rel="next").
     """
 
     def get(self, request):
-        libros = Libro.objects.select_related("inventario").order_by("id")
-        serializer = LibroSerializer(libros, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        serializer = ProductosQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        parametros = serializer.validated_data
+        pagina = obtener_pagina_productos(
+            cursor=parametros.get("cursor"),
+            limite=parametros.get("limite", settings.PRODUCTOS_PAGINA_TAMANO),
+            en_stock=parametros.get("en_stock"),
+            precio_min=parametros.get("precio_min"),
+            precio_max=parametros.get("precio_max"),
+        )
+
+        headers = {"ETag": pagina["etag"], "Cache-Control": "no-cache"}
+        if _etag_coincide(request, pagina["etag"]):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if pagina["siguiente"] is not None:
+            headers["Link"] = _link_siguiente(request, pagina)
+
+        return Response(pagina["productos"], status=status.HTTP_200_OK, headers=headers)
+
+
+@require_GET
+async def productos_async_view(request):
+    """
+    Version async de ProductosAPIView: mismos parametros, cache, ETag y header Link.
+    GET /api/v1/async/productos/?cursor=<id>&limite=100&en_stock=true&precio_min=10&precio_max=90
+    """
+    serializer = ProductosQuerySerializer(data=request.GET)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+
+    parametros = serializer.validated_data
+    pagina = await aobtener_pagina_productos(
+        cursor=parametros.get("cursor"),
+        limite=parametros.get("limite", settings.PRODUCTOS_PAGINA_TAMANO),
+        en_stock=parametros.get("en_stock"),
+        precio_min=parametros.get("precio_min"),
+        precio_max=parametros.get("precio_max"),
+    )
+
+    headers = {"ETag": pagina["etag"], "Cache-Control": "no-cache"}
+    if _etag_coincide(request, pagina["etag"]):
+        return HttpResponseNotModified(headers=headers)
+
+    if pagina["siguiente"] is not None:
+        headers["Link"] = _link_siguiente(request, pagina)
+
+    return JsonResponse(pagina["productos"], safe=False, headers=headers)
 
 
 class CompraAPIView(APIView):
@@ -26,9 +186,13 @@ class CompraAPIView(APIView):
     Endpoint para procesar compras via JSON.
     POST /api/v1/comprar/
     Payload: { "libro_id": 1, "direccion_envio": "Calle 123" }
+    Header opcional: Idempotency-Key para reintentos seguros.
     """
 
     def post(self, request):
+        return con_idempotencia(request, lambda: self._procesar(request))
+
+    def _procesar(self, request):
         serializer = OrdenInputSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -43,26 +207,195 @@ class CompraAPIView(APIView):
         try:
             gateway = PaymentFactory.get_processor()
             servicio = CompraService(procesador_pago=gateway)
-            usuario = (
-                request.user.get_username()
-                if getattr(request.user, "is_authenticated", False)
-                else "Invitado API"
-            )
-
             resultado = servicio.ejecutar_proceso_compra(
-                usuario=usuario,
+                usuario=_usuario_api(request),
                 lista_productos=[libro],
                 direccion=datos["direccion_envio"],
             )
 
+            return _respuesta_compra(request, servicio, resultado)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        except Exception:
+            return Response({"error": "Error interno"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _datos_del_cuerpo(request):
+    # Equivalente minimo a `request.data` de DRF: JSON o formulario.
+    if request.content_type != "application/json":
+        return request.POST
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+
+
+async def _aprocesar_compra(request, usuario):
+    datos = _datos_del_cuerpo(request)
+    if datos is None:
+        return respuesta_json({"detail": "JSON invalido."}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = OrdenInputSerializer(data=datos)
+    if not serializer.is_valid():
+        return respuesta_json(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    datos = serializer.validated_data
+
+    try:
+        libro = await Libro.objects.aget(id=datos["libro_id"])
+    except Libro.DoesNotExist:
+        return respuesta_json({"error": "Libro no encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        gateway = PaymentFactory.get_processor()
+        servicio = CompraService(procesador_pago=gateway)
+        resultado = await servicio.aejecutar_proceso_compra(
+            usuario=_nombre_usuario(usuario),
+            lista_productos=[libro],
+            direccion=datos["direccion_envio"],
+        )
+
+        return _respuesta_compra(request, servicio, resultado, respuesta_json)
+    except ValueError as exc:
+        return respuesta_json({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+    except Exception:
+        return respuesta_json({"error": "Error interno"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@require_POST
+async def compra_async_view(request):
+    """
+    Version async de CompraAPIView: el cobro se espera con `ProcesadorPago.apagar`,
+    asi que bajo ASGI una pasarela lenta no retiene un hilo por compra.
+    POST /api/v1/async/comprar/
+    Payload: { "libro_id": 1, "direccion_envio": "Calle 123" }
+    Header opcional: Idempotency-Key para reintentos seguros.
+    """
+    usuario = await request.auser()
+    if usuario.is_authenticated:
+        # Igual que SessionAuthentication de DRF: CSRF solo se exige con sesion iniciada.
+        try:
+            SessionAuthentication().enforce_csrf(request)
+        except PermissionDenied as exc:
+            return JsonResponse({"detail": exc.detail}, status=status.HTTP_403_FORBIDDEN)
+
+    return await acon_idempotencia(request, lambda: _aprocesar_compra(request, usuario))
+
+
+class CompraLoteAPIView(APIView):
+    """
+    Endpoint para comprar varios libros en una sola orden y un solo pago.
+    POST /api/v1/comprar/lote/
+    Payload: {
+        "lineas": [{"libro_id": 1, "cantidad": 2}, {"libro_id": 3, "cantidad": 1}],
+        "direccion_envio": "Calle 123"
+    }
+    Header opcional: Idempotency-Key para reintentos seguros.
+    """
+
+    def post(self, request):
+        return con_idempotencia(request, lambda: self._procesar(request))
+
+    def _procesar(self, request):
+        serializer = CompraLoteInputSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        datos = serializer.validated_data
+        cantidades = Counter()
+        for linea in datos["lineas"]:
+            cantidades[linea["libro_id"]] += linea["cantidad"]
+
+        # Una sola consulta para todos los libros del carrito.
+        libros_por_id = Libro.objects.in_bulk(cantidades.keys())
+        faltantes = sorted(set(cantidades) - set(libros_por_id))
+        if faltantes:
             return Response(
-                {
-                    "estado": "exito",
-                    "mensaje": resultado,
-                },
-                status=status.HTTP_201_CREATED,
+                {"error": "Libro no encontrado.", "libro_ids": faltantes},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        lista_productos = [
+            libros_por_id[libro_id]
+            for libro_id, cantidad in cantidades.items()
+            for _ in range(cantidad)
+        ]
+
+        try:
+            gateway = PaymentFactory.get_processor()
+            servicio = CompraService(procesador_pago=gateway)
+            resultado = servicio.ejecutar_proceso_compra(
+                usuario=_usuario_api(request),
+                lista_productos=lista_productos,
+                direccion=datos["direccion_envio"],
             )
+
+            return _respuesta_compra(request, servicio, resultado)
         except ValueError as exc:
             return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
         except Exception:
             return Response({"error": "Error interno"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class CompraEncoladaAPIView(APIView):
+    """
+    Estado de una compra rapida aceptada con 202 (COMPRA_RAPIDA_ENCOLADA).
+    GET /api/v1/compras/<token>/
+    Mientras siga pendiente o procesando, `Retry-After` sugiere cuando volver a consultar.
+    """
+
+    def get(self, request, token):
+        compra = get_object_or_404(CompraEncolada, token=token)
+        headers = {"Cache-Control": "no-store"}
+        if compra.estado in (CompraEncolada.Estado.PENDIENTE, CompraEncolada.Estado.PROCESANDO):
+            headers["Retry-After"] = "1"
+        return Response(CompraEncoladaSerializer(compra).data, status=status.HTTP_200_OK, headers=headers)
+
+
+class ReporteVentasAPIView(APIView):
+    """
+    Unidades e ingresos de ordenes confirmadas, por libro y por dia.
+    GET /api/v1/reportes/ventas/?desde=2026-01-01&hasta=2026-01-31&libro_id=1&fuente=resumen|vivo
+    Solo para usuarios staff.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        serializer = ReporteVentasQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(reporte_ventas(**serializer.validated_data), status=status.HTTP_200_OK)
+
+
+class ExportacionOrdenesAPIView(APIView):
+    """
+    Volcado de ordenes con sus items, escrito a medida que se lee el cursor.
+    GET /api/v1/exportaciones/ordenes/?formato=csv|ndjson&desde=2026-01-01&hasta=2026-01-31&desde_id=0
+    Solo para usuarios staff. Bajo ASGI el cuerpo se arma con el cursor async
+    para no juntar todo el volcado en memoria antes de enviarlo.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        serializer = ExportacionOrdenesQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        parametros = serializer.validated_data
+        filtros = {
+            "desde": parametros.get("desde"),
+            "hasta": parametros.get("hasta"),
+            "desde_id": parametros.get("desde_id"),
+        }
+        generar_lineas, content_type = FORMATOS[parametros["formato"]]
+        if isinstance(request._request, ASGIRequest):
+            lineas = FORMATOS_ASYNC[parametros["formato"]](aordenes_para_exportar(**filtros))
+        else:
+            lineas = generar_lineas(ordenes_para_exportar(**filtros))
+        response = StreamingHttpResponse(lineas, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="ordenes.{parametros["formato"]}"'
+        return response
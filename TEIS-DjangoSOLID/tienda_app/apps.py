@@ -4,3 +4,18 @@ from django.apps import AppConfig
 class TiendaAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tienda_app'
+
+    def ready(self):
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from .domain.logic import motor_impuestos
+        from .metricas import instalar_medicion
+
+        connection_created.connect(instalar_medicion, dispatch_uid="tienda_app_medicion_sql")
+        try:
+            motor_impuestos.cargar(settings.IMPUESTOS_REGLAS, region=settings.IMPUESTOS_REGION)
+        except ValueError as error:
+            raise ImproperlyConfigured(f"IMPUESTOS_REGLAS invalido: {error}") from error
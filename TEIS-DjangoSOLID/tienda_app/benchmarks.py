@@ -0,0 +1,290 @@
+"""
+Escenarios de benchmark para las rutas de compra y de catalogo.
+
+Cada escenario prepara sus datos y retorna la operacion a medir. `medir()`
+corre todo dentro de una transaccion que se revierte al final, asi que el
+benchmark puede ejecutarse contra cualquier base de datos local.
+"""
+
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+from pathlib import Path
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from .api.serializers import LibroSerializer
+from .catalogo import invalidar_catalogo
+from .domain.logic import CalculadorImpuestos, MotorImpuestos
+from .fragmentos import rebalancear
+from .importacion import importar_lote
+from .models import CompraEncolada, Inventario, Libro
+from .services import CompraRapidaService, CompraService, encolar_compra_rapida, procesar_compras_encoladas
+
+RUTA_LINEA_BASE = Path(__file__).resolve().parent.parent / "benchmarks" / "linea_base.json"
+# Los tiempos dependen de la maquina: se graban y comparan solo en local (no se versionan).
+RUTA_TIEMPOS_LOCALES = Path(__file__).resolve().parent.parent / "benchmarks" / "tiempos_locales.json"
+
+ESCENARIOS = {}
+
+
+class Escenario:
+    def __init__(self, nombre, tamanos, preparar):
+        self.nombre = nombre
+        self.tamanos = tamanos
+        self.preparar = preparar
+
+
+def escenario(nombre, tamanos):
+    def registrar(preparar):
+        ESCENARIOS[nombre] = Escenario(nombre, tamanos, preparar)
+        return preparar
+    return registrar
+
+
+class _ProcesadorInstantaneo:
+    def pagar(self, monto, productos=None, referencia=None):
+        return True
+
+
+def _crear_catalogo(tamano, stock=1_000_000):
+    libros = Libro.objects.bulk_create(
+        [Libro(titulo=f"Benchmark {indice}", precio=Decimal(10 + indice % 90)) for indice in range(tamano)]
+    )
+    Inventario.objects.bulk_create([Inventario(libro=libro, cantidad=stock) for libro in libros])
+    return libros
+
+
+@escenario("compra_service", tamanos=(1, 10, 50))
+def _compra_service(tamano):
+    libros = _crear_catalogo(tamano)
+    servicio = CompraService(procesador_pago=_ProcesadorInstantaneo())
+    return lambda: servicio.ejecutar_proceso_compra("Benchmark", libros, "Benchmark")
+
+
+@escenario("compra_rapida_pesimista", tamanos=(1,))
+def _compra_rapida_pesimista(tamano):
+    libro = _crear_catalogo(1)[0]
+    servicio = CompraRapidaService(procesador_pago=_ProcesadorInstantaneo())
+    return lambda: servicio.procesar(libro.id)
+
+
+@escenario("compra_rapida_optimista", tamanos=(1,))
+def _compra_rapida_optimista(tamano):
+    libro = _crear_catalogo(1)[0]
+    servicio = CompraRapidaService(
+        procesador_pago=_ProcesadorInstantaneo(),
+        estrategia=CompraRapidaService.RESERVA_OPTIMISTA,
+    )
+    return lambda: servicio.procesar(libro.id)
+
+
+@escenario("compra_rapida_fragmentada", tamanos=(4, 16))
+def _compra_rapida_fragmentada(tamano):
+    # El tamano es la cantidad de fragmentos del inventario del libro.
+    libro = _crear_catalogo(1)[0]
+    rebalancear(libro.id, tamano)
+    servicio = CompraRapidaService(procesador_pago=_ProcesadorInstantaneo())
+    return lambda: servicio.procesar(libro.id)
+
+
+@escenario("compra_rapida_encolada", tamanos=(1,))
+def _compra_rapida_encolada(tamano):
+    # Solo la parte sincrona del request: reserva + insercion en la cola.
+    libro = _crear_catalogo(1)[0]
+    return lambda: encolar_compra_rapida(libro.id)
+
+
+@escenario("procesar_compras_encoladas", tamanos=(10, 100))
+def _procesar_compras_encoladas(tamano):
+    libro = _crear_catalogo(1)[0]
+    for _ in range(tamano):
+        encolar_compra_rapida(libro.id)
+    procesador = _ProcesadorInstantaneo()
+
+    def operacion():
+        # Se reencolan las mismas compras para medir siempre un lote completo.
+        CompraEncolada.objects.update(estado=CompraEncolada.Estado.PENDIENTE, orden=None, cobro_iniciado=None)
+        procesar_compras_encoladas(procesador, lote=tamano)
+
+    return operacion
+
+
+@escenario("catalogo_sin_cache", tamanos=(10, 100, 1000))
+def _catalogo_sin_cache(tamano):
+    from .views import _build_catalog_items
+
+    _crear_catalogo(tamano)
+
+    def operacion():
+        invalidar_catalogo()
+        _build_catalog_items()
+
+    return operacion
+
+
+def _catalogo_con_modelos():
+    # Camino anterior a ProductoCatalogo: serializer sobre modelos, un dict y un Libro por fila.
+    libros = Libro.objects.select_related("inventario").order_by("id")
+    productos = [dict(producto) for producto in LibroSerializer(libros, many=True).data]
+    cache.set("benchmark:catalogo_modelos", productos)
+    precios = [Decimal(producto["precio"]) for producto in productos]
+    return [
+        {
+            "libro": Libro(id=producto["id"], titulo=producto["titulo"], precio=precio),
+            "stock_actual": producto["stock_actual"],
+            "total_con_iva": total,
+        }
+        for producto, precio, total in zip(
+            productos, precios, (CalculadorImpuestos.obtener_total_con_iva(precio) for precio in precios)
+        )
+    ]
+
+
+@escenario("catalogo_modelos", tamanos=(10, 100, 1000))
+def _catalogo_modelos(tamano):
+    _crear_catalogo(tamano)
+    return _catalogo_con_modelos
+
+
+@escenario("catalogo_con_cache", tamanos=(10, 100, 1000))
+def _catalogo_con_cache(tamano):
+    from .views import _build_catalog_items
+
+    _crear_catalogo(tamano)
+    _build_catalog_items()
+    return _build_catalog_items
+
+
+@escenario("libro_serializer", tamanos=(10, 100, 1000))
+def _libro_serializer(tamano):
+    _crear_catalogo(tamano)
+    return lambda: LibroSerializer(
+        Libro.objects.select_related("inventario").order_by("id"),
+        many=True,
+    ).data
+
+
+@escenario("impuestos_total_con_iva", tamanos=(1000, 10000))
+def _impuestos_total_con_iva(tamano):
+    aleatorio = random.Random(tamano)
+    precios = [Decimal(aleatorio.randint(1, 100_000)) / 100 for _ in range(tamano)]
+
+    def operacion():
+        for precio in precios:
+            CalculadorImpuestos.obtener_total_con_iva(precio)
+
+    return operacion
+
+
+@escenario("impuestos_totales_lote", tamanos=(1000, 10000))
+def _impuestos_totales_lote(tamano):
+    aleatorio = random.Random(tamano)
+    precios = [Decimal(aleatorio.randint(1, 100_000)) / 100 for _ in range(tamano)]
+    # El camino por lote del catalogo: una tasa por libro, sin reglas cargadas.
+    motor = MotorImpuestos()
+    tasas = [motor.tasa()] * tamano
+    return lambda: motor.totales_con_iva(precios, tasas)
+
+
+@escenario("importar_catalogo", tamanos=(1000, 10000))
+def _importar_catalogo(tamano, lote=2000):
+    filas = [
+        (f"BENCH-{indice}", f"Benchmark {indice}", Decimal(10 + indice % 90), indice % 50)
+        for indice in range(tamano)
+    ]
+
+    def operacion():
+        for inicio in range(0, tamano, lote):
+            importar_lote(filas[inicio:inicio + lote])
+
+    return operacion
+
+
+def medir(nombre, tamano, repeticiones=5, memoria=False):
+    """
+    Retorna `{"consultas": int, "mediana_ms": float}` para un escenario y tamano.
+    Con `memoria=True` agrega `pico_kb`, medido con tracemalloc en una corrida aparte.
+    """
+    try:
+        with transaction.atomic():
+            operacion = ESCENARIOS[nombre].preparar(tamano)
+            with CaptureQueriesContext(connection) as consultas:
+                operacion()
+
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                operacion()
+                tiempos.append(time.perf_counter() - inicio)
+
+            pico = None
+            if memoria:
+                tracemalloc.start()
+                try:
+                    operacion()
+                    pico = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+
+            transaction.set_rollback(True)
+    finally:
+        # El catalogo armado con datos revertidos no debe quedar en cache.
+        invalidar_catalogo()
+
+    resultado = {
+        "consultas": len(consultas.captured_queries),
+        "mediana_ms": round(statistics.median(tiempos) * 1000, 3),
+    }
+    if pico is not None:
+        resultado["pico_kb"] = round(pico / 1024, 1)
+    return resultado
+
+
+def ejecutar(nombres=None, repeticiones=5, memoria=False):
+    resultados = {}
+    for nombre, definicion in ESCENARIOS.items():
+        if nombres and nombre not in nombres:
+            continue
+        for tamano in definicion.tamanos:
+            resultados[f"{nombre}[{tamano}]"] = medir(nombre, tamano, repeticiones, memoria)
+    return resultados
+
+
+def comparar(resultados, linea_base, tiempos_base=None, tolerancia=0.5, piso_ms=1.0):
+    """
+    Lista de regresiones frente a la linea base. Las consultas no admiten
+    tolerancia. Los tiempos solo se comparan si se pasa `tiempos_base`, grabada
+    en la misma maquina, y pueden crecer hasta `tolerancia` (y al menos `piso_ms`).
+    """
+    regresiones = []
+    for clave, actual in resultados.items():
+        base = linea_base.get(clave)
+        if base is not None and actual["consultas"] > base["consultas"]:
+            regresiones.append(f"{clave}: {actual['consultas']} consultas (linea base {base['consultas']})")
+
+        base_ms = (tiempos_base or {}).get(clave)
+        if base_ms is None:
+            continue
+        limite = max(base_ms * (1 + tolerancia), base_ms + piso_ms)
+        if actual["mediana_ms"] > limite:
+            regresiones.append(f"{clave}: {actual['mediana_ms']:.2f} ms (tiempo local {base_ms:.2f} ms)")
+    return regresiones
+
+
+def cargar_linea_base(ruta=RUTA_LINEA_BASE):
+    ruta = Path(ruta)
+    if not ruta.exists():
+        return {}
+    return json.loads(ruta.read_text())
+
+
+def guardar_linea_base(resultados, ruta=RUTA_LINEA_BASE):
+    ruta = Path(ruta)
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    ruta.write_text(json.dumps(resultados, indent=2, sort_keys=True) + "\n")
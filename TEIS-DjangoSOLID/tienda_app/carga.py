@@ -0,0 +1,204 @@
+"""
+Utilidades para la simulacion de carga de `manage.py simular_carga`.
+
+Los compradores usan el `Client` de Django contra la base de datos local, sin
+levantar servidores ni llamar servicios externos. En las rutas async los
+compradores son corrutinas con `AsyncClient` en un solo event loop, como las
+atenderia un worker ASGI.
+"""
+
+import asyncio
+import json
+import math
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+from asgiref.sync import sync_to_async
+from django.db import OperationalError, connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+RUTAS = ("fbv", "cbv", "service", "compra", "api", "api_async")
+RUTAS_ASYNC = ("api_async",)
+
+_URLS_API = {
+    "api": "api_comprar",
+    "api_async": "api_comprar_async",
+}
+
+_URLS = {
+    "fbv": "compra_rapida_fbv",
+    "cbv": "compra_rapida_cbv",
+    "service": "compra_rapida_service",
+    "compra": "finalizar_compra",
+}
+
+
+def percentil(valores_ordenados, porcentaje):
+    """Percentil por rango mas cercano sobre una lista ya ordenada."""
+    if not valores_ordenados:
+        return 0.0
+    posicion = math.ceil(porcentaje / 100 * len(valores_ordenados)) - 1
+    return valores_ordenados[max(posicion, 0)]
+
+
+class _ClientePorHilo(Client):
+    """
+    Client que no relanza las excepciones de las vistas y solo guarda las de
+    sus propios requests: `got_request_exception` es global, asi que el Client
+    de Django tambien recibe las de los requests de otros hilos.
+    """
+
+    def __init__(self, **defaults):
+        super().__init__(raise_request_exception=False, **defaults)
+        self._hilo = threading.get_ident()
+
+    def store_exc_info(self, **kwargs):
+        if threading.get_ident() == self._hilo:
+            super().store_exc_info(**kwargs)
+
+
+class _ClienteAsync(AsyncClient):
+    """
+    AsyncClient que no relanza ni guarda excepciones: todos los compradores
+    corren en el hilo del event loop y no hay forma de atribuirlas. Sus
+    compras se clasifican solo por la respuesta.
+    """
+
+    def __init__(self, **defaults):
+        super().__init__(raise_request_exception=False, **defaults)
+
+    def store_exc_info(self, **kwargs):
+        pass
+
+
+# Textos de los errores de lock de SQLite y PostgreSQL.
+_MENSAJES_DE_LOCK = ("database is locked", "database table is locked", "deadlock", "lock timeout", "could not obtain lock")
+
+
+def _es_error_de_lock(exc):
+    mensaje = str(exc).lower()
+    return isinstance(exc, OperationalError) or "lock" in mensaje or "deadlock" in mensaje
+
+
+def _comprar(cliente, ruta, libro_id, host):
+    # Con AsyncClient retorna una corrutina.
+    if ruta in _URLS_API:
+        return cliente.post(
+            reverse(_URLS_API[ruta]),
+            data=json.dumps({"libro_id": libro_id, "direccion_envio": "Simulacion de carga"}),
+            content_type="application/json",
+            HTTP_HOST=host,
+        )
+    return cliente.post(reverse(_URLS[ruta], args=[libro_id]), HTTP_HOST=host)
+
+
+def _clasificar(respuesta):
+    # Se clasifica por la respuesta de cada compra: un 5xx es de lock si la
+    # excepcion de su propio request o el cuerpo (con DEBUG) lo indican.
+    if respuesta.status_code < 300:
+        return "exito"
+    if respuesta.status_code < 500:
+        return "rechazo"
+    if respuesta.exc_info and _es_error_de_lock(respuesta.exc_info[1]):
+        return "lock"
+    cuerpo = respuesta.content.decode(errors="replace").lower()
+    if any(mensaje in cuerpo for mensaje in _MENSAJES_DE_LOCK):
+        return "lock"
+    return "error"
+
+
+def ejecutar_comprador(ruta, libro_id, compras, host):
+    """
+    Ejecuta `compras` intentos secuenciales y retorna una lista de tuplas
+    `(resultado, latencia_segundos)` con resultado en exito/rechazo/error/lock.
+    """
+    cliente = _ClientePorHilo()
+    resultados = []
+    try:
+        for _ in range(compras):
+            inicio = time.perf_counter()
+            resultado = _clasificar(_comprar(cliente, ruta, libro_id, host))
+            resultados.append((resultado, time.perf_counter() - inicio))
+    finally:
+        connections.close_all()
+    return resultados
+
+
+async def _aejecutar_comprador(ruta, libro_id, compras, host):
+    # Version async de `ejecutar_comprador`; el ASGIHandler cierra las conexiones de cada request.
+    cliente = _ClienteAsync()
+    resultados = []
+    for _ in range(compras):
+        inicio = time.perf_counter()
+        resultado = _clasificar(await _comprar(cliente, ruta, libro_id, host))
+        resultados.append((resultado, time.perf_counter() - inicio))
+    return resultados
+
+
+async def _aejecutar_compradores(ruta, libro_id, compradores, compras_por_comprador, host):
+    try:
+        por_comprador = await asyncio.gather(
+            *(_aejecutar_comprador(ruta, libro_id, compras_por_comprador, host) for _ in range(compradores))
+        )
+    finally:
+        await sync_to_async(connections.close_all)()
+    return [resultado for resultados in por_comprador for resultado in resultados]
+
+
+def ejecutar_compradores(ruta, libro_id, compradores, compras_por_comprador, host, modo="hilos", workers=None):
+    """
+    Lanza los compradores en paralelo y retorna `(resultados, duracion_segundos)`.
+    En las rutas sync `workers` limita cuantos compradores se atienden a la vez
+    (como los workers sync de Gunicorn); por defecto uno por comprador. Las
+    rutas async atienden a todos los compradores desde un solo event loop.
+    """
+    inicio = time.perf_counter()
+    if ruta in RUTAS_ASYNC:
+        resultados = asyncio.run(
+            _aejecutar_compradores(ruta, libro_id, compradores, compras_por_comprador, host)
+        )
+        return resultados, time.perf_counter() - inicio
+
+    workers = workers or compradores
+    if modo == "procesos":
+        # Cada proceso hijo debe abrir sus propias conexiones.
+        connections.close_all()
+        ejecutor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("fork"))
+    else:
+        ejecutor = ThreadPoolExecutor(max_workers=workers)
+
+    with ejecutor:
+        futuros = [
+            ejecutor.submit(ejecutar_comprador, ruta, libro_id, compras_por_comprador, host)
+            for _ in range(compradores)
+        ]
+        resultados = [resultado for futuro in futuros for resultado in futuro.result()]
+    return resultados, time.perf_counter() - inicio
+
+
+def resumir(resultados, duracion, stock_inicial, stock_final, unidades_vendidas):
+    latencias = sorted(latencia for _, latencia in resultados)
+    conteo = {clave: 0 for clave in ("exito", "rechazo", "error", "lock")}
+    for resultado, _ in resultados:
+        conteo[resultado] += 1
+
+    return {
+        "requests": len(resultados),
+        "duracion_s": duracion,
+        "requests_por_segundo": len(resultados) / duracion if duracion else 0.0,
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p95_ms": percentil(latencias, 95) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+        "exitos": conteo["exito"],
+        "rechazos": conteo["rechazo"],
+        "errores": conteo["error"],
+        "errores_lock": conteo["lock"],
+        "sobreventa": max(conteo["exito"] - stock_inicial, 0),
+        "stock_inicial": stock_inicial,
+        "stock_final": stock_final,
+        "unidades_vendidas": unidades_vendidas,
+        "stock_consistente": stock_final >= 0 and stock_inicial - stock_final == unidades_vendidas,
+    }
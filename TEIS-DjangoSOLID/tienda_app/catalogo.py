@@ -0,0 +1,238 @@
+import hashlib
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .domain.logic import motor_impuestos
+from .fragmentos import con_stock, fragmentos_con_stock
+from .models import Libro
+
+# El catalogo serializado vive bajo una clave versionada: invalidar es subir la
+# version y las entradas viejas simplemente expiran.
+CLAVE_VERSION = "catalogo:version"
+CLAVE_STOCK_MODIFICADO = "catalogo:stock_modificado"
+
+# Columnas leidas con values_list: ni instancias de modelo ni dicts por fila.
+# `stock_total` suma la fila de Inventario y los fragmentos del libro.
+_COLUMNAS = ("id", "titulo", "precio", "categoria", "stock_total")
+
+
+class ProductoCatalogo:
+    """
+    Fila de catalogo de solo lectura. Se comparte entre requests del mismo
+    proceso, asi que no debe modificarse.
+    """
+
+    __slots__ = ("id", "titulo", "precio", "categoria", "stock_actual", "total_con_iva")
+
+    def __init__(self, id, titulo, precio, categoria, stock_actual):
+        self.id = id
+        self.titulo = titulo
+        self.precio = precio
+        self.categoria = categoria
+        self.stock_actual = stock_actual or 0
+        self.total_con_iva = None
+
+    def __getitem__(self, campo):
+        # Compatibilidad con el formato anterior {"libro": Libro, "stock_actual": int}.
+        if campo == "libro":
+            return self
+        try:
+            return getattr(self, campo)
+        except AttributeError:
+            raise KeyError(campo) from None
+
+    def a_dict(self):
+        """Mismo formato que LibroSerializer."""
+        return {
+            "id": self.id,
+            "titulo": self.titulo,
+            "precio": str(self.precio),
+            "categoria": self.categoria,
+            "stock_actual": self.stock_actual,
+        }
+
+
+def _leer_productos(libros):
+    return [ProductoCatalogo(*fila) for fila in con_stock(libros).values_list(*_COLUMNAS)]
+
+
+async def _aleer_productos(libros):
+    return [ProductoCatalogo(*fila) async for fila in con_stock(libros).values_list(*_COLUMNAS)]
+
+
+# Copia del catalogo en memoria del proceso: (version, tomada_en, productos). Con
+# una cache por proceso (LocMem) los cambios de version de un worker no llegan a los
+# demas, asi que la copia tambien vence a los CATALOGO_CACHE_TIMEOUT segundos.
+_snapshot = (None, 0.0, ())
+
+
+def _snapshot_vigente(version):
+    version_local, tomada_en, productos = _snapshot
+    if version_local == version and time.monotonic() - tomada_en < settings.CATALOGO_CACHE_TIMEOUT:
+        return productos
+    return None
+
+
+def _guardar_snapshot(version, productos):
+    global _snapshot
+    _snapshot = (version, time.monotonic(), productos)
+
+
+def _nueva_version():
+    # Basada en el reloj para no reutilizar claves viejas si el backend pierde la version.
+    return int(time.time() * 1000)
+
+
+def _incrementar_version():
+    try:
+        return cache.incr(CLAVE_VERSION)
+    except ValueError:
+        version = _nueva_version()
+        cache.set(CLAVE_VERSION, version, timeout=None)
+        return version
+
+
+def version_catalogo():
+    valores = cache.get_many([CLAVE_VERSION, CLAVE_STOCK_MODIFICADO])
+    version = valores.get(CLAVE_VERSION)
+    if version is None:
+        cache.add(CLAVE_VERSION, _nueva_version(), timeout=None)
+        cache.delete(CLAVE_STOCK_MODIFICADO)
+        return cache.get(CLAVE_VERSION)
+
+    # Los cambios de stock toleran CATALOGO_STOCK_STALENESS segundos de retraso,
+    # asi una rafaga de compras reconstruye el catalogo una vez y no en cada compra.
+    modificado_en = valores.get(CLAVE_STOCK_MODIFICADO)
+    if modificado_en is not None and time.time() - modificado_en >= settings.CATALOGO_STOCK_STALENESS:
+        cache.delete(CLAVE_STOCK_MODIFICADO)
+        return _incrementar_version()
+    return version
+
+
+async def aversion_catalogo():
+    """Version async de `version_catalogo`; solo delega cuando hay que escribir la version."""
+    valores = await cache.aget_many([CLAVE_VERSION, CLAVE_STOCK_MODIFICADO])
+    version = valores.get(CLAVE_VERSION)
+    modificado_en = valores.get(CLAVE_STOCK_MODIFICADO)
+    if version is not None and (
+        modificado_en is None or time.time() - modificado_en < settings.CATALOGO_STOCK_STALENESS
+    ):
+        return version
+    return await sync_to_async(version_catalogo)()
+
+
+def invalidar_catalogo():
+    _incrementar_version()
+    cache.delete(CLAVE_STOCK_MODIFICADO)
+
+
+def marcar_stock_modificado():
+    # add() conserva el primer instante: la ventana se cuenta desde el primer cambio.
+    cache.add(CLAVE_STOCK_MODIFICADO, time.time(), timeout=None)
+
+
+def _con_totales(productos):
+    totales = motor_impuestos.totales_con_iva(
+        [producto.precio for producto in productos],
+        [motor_impuestos.tasa(producto.categoria) for producto in productos],
+    )
+    for producto, total in zip(productos, totales):
+        producto.total_con_iva = total
+    return productos
+
+
+def obtener_catalogo():
+    """
+    Catalogo completo como tupla de ProductoCatalogo con su total con IVA.
+    Se sirve desde memoria del proceso mientras la version no cambie y la copia
+    no venza; si no, se toma de la cache o se reconstruye con una sola consulta.
+    """
+    version = version_catalogo()
+    productos = _snapshot_vigente(version)
+    if productos is not None:
+        return productos
+
+    clave = f"catalogo:productos:{version}"
+    productos = cache.get(clave)
+    if productos is None:
+        productos = _con_totales(tuple(_leer_productos(Libro.objects.order_by("id"))))
+        cache.set(clave, productos, settings.CATALOGO_CACHE_TIMEOUT)
+    _guardar_snapshot(version, productos)
+    return productos
+
+
+async def aobtener_catalogo():
+    """Version async de `obtener_catalogo`: misma copia del proceso y misma cache compartida."""
+    version = await aversion_catalogo()
+    productos = _snapshot_vigente(version)
+    if productos is not None:
+        return productos
+
+    clave = f"catalogo:productos:{version}"
+    productos = await cache.aget(clave)
+    if productos is None:
+        productos = _con_totales(tuple(await _aleer_productos(Libro.objects.order_by("id"))))
+        await cache.aset(clave, productos, settings.CATALOGO_CACHE_TIMEOUT)
+    _guardar_snapshot(version, productos)
+    return productos
+
+
+def _clave_pagina(version, filtros):
+    huella = hashlib.md5(json.dumps(filtros, default=str).encode()).hexdigest()
+    return f"catalogo:pagina:{version}:{huella}"
+
+
+def _libros_de_pagina(cursor, limite, en_stock, precio_min, precio_max):
+    libros = Libro.objects.order_by("id")
+    if cursor is not None:
+        libros = libros.filter(id__gt=cursor)
+    if en_stock is True:
+        libros = libros.filter(Q(inventario__cantidad__gt=0) | fragmentos_con_stock())
+    elif en_stock is False:
+        libros = libros.filter(Q(inventario__isnull=True) | Q(inventario__cantidad=0), ~fragmentos_con_stock())
+    if precio_min is not None:
+        libros = libros.filter(precio__gte=precio_min)
+    if precio_max is not None:
+        libros = libros.filter(precio__lte=precio_max)
+    return libros[:limite + 1]
+
+
+def _armar_pagina(libros, limite):
+    productos = [producto.a_dict() for producto in libros[:limite]]
+    contenido = json.dumps(productos, sort_keys=True, default=str).encode()
+    return {
+        "productos": productos,
+        "siguiente": productos[-1]["id"] if len(libros) > limite else None,
+        "etag": f'"{hashlib.md5(contenido).hexdigest()}"',
+    }
+
+
+def obtener_pagina_productos(cursor=None, limite=100, en_stock=None, precio_min=None, precio_max=None):
+    """
+    Pagina de productos con paginacion por cursor sobre `id` (keyset): cada
+    request lee como maximo `limite + 1` filas sin importar el tamano del catalogo.
+    Retorna un dict con `productos`, `siguiente` (cursor o None) y `etag`.
+    """
+    filtros = [cursor, limite, en_stock, precio_min, precio_max]
+    clave = _clave_pagina(version_catalogo(), filtros)
+    pagina = cache.get(clave)
+    if pagina is None:
+        pagina = _armar_pagina(_leer_productos(_libros_de_pagina(*filtros)), limite)
+        cache.set(clave, pagina, settings.CATALOGO_CACHE_TIMEOUT)
+    return pagina
+
+
+async def aobtener_pagina_productos(cursor=None, limite=100, en_stock=None, precio_min=None, precio_max=None):
+    """Version async de `obtener_pagina_productos`; comparte las claves de cache."""
+    filtros = [cursor, limite, en_stock, precio_min, precio_max]
+    clave = _clave_pagina(await aversion_catalogo(), filtros)
+    pagina = await cache.aget(clave)
+    if pagina is None:
+        pagina = _armar_pagina(await _aleer_productos(_libros_de_pagina(*filtros)), limite)
+        await cache.aset(clave, pagina, settings.CATALOGO_CACHE_TIMEOUT)
+    return pagina
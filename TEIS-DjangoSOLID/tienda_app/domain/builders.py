@@ -1,5 +1,7 @@
+from django.utils import timezone
+
 from ..models import Orden
-from .logic import CalculadorImpuestos
+from .logic import motor_impuestos
 
 class OrdenBuilder:
     def __init__(self):
@@ -9,6 +11,7 @@ class OrdenBuilder:
         self._usuario = None
         self._items = []
         self._direccion = ""
+        self._reservada_hasta = None
 
     def con_usuario(self, usuario):
         self._usuario = usuario
@@ -22,17 +25,26 @@ class OrdenBuilder:
         self._direccion = direccion
         return self
 
+    def con_reserva(self, hasta):
+        # La orden nace PENDIENTE hasta que se confirme el pago.
+        self._reservada_hasta = hasta
+        return self
+
     def build(self) -> Orden:
         if not self._usuario or not self._items:
             raise ValueError("Datos insuficientes para crear la orden.")
 
-        subtotal = sum(p.precio for p in self._items)
-        total_con_iva = CalculadorImpuestos.obtener_total_con_iva(subtotal)
+        total_con_iva = motor_impuestos.totales(
+            (p.precio, 1, motor_impuestos.tasa_libro(p)) for p in self._items
+        )["total"]
 
         orden = Orden.objects.create(
             usuario=self._usuario,
             total=total_con_iva,
-            direccion_envio=self._direccion
+            direccion_envio=self._direccion,
+            estado=Orden.Estado.PENDIENTE if self._reservada_hasta else Orden.Estado.CONFIRMADA,
+            reservada_hasta=self._reservada_hasta,
+            confirmada_en=None if self._reservada_hasta else timezone.now(),
         )
         self.reset()
         return orden
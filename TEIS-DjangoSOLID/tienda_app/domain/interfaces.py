@@ -1,10 +1,31 @@
+import asyncio
 from abc import ABC, abstractmethod
 
+class PagoIndeterminado(Exception):
+    """
+    La pasarela no confirmo ni rechazo el cobro (timeout o error de red tras
+    los reintentos). El cargo pudo haberse hecho: quien llama no debe liberar
+    el stock ni volver a cobrar con otra referencia sin verificarlo.
+    """
+
+
 class ProcesadorPago(ABC):
     """
     D: Inversión de Dependencias.
     Definimos el CONTRATO que cualquier banco debe seguir.
+    `productos` es el detalle de la compra, `{libro_id: cantidad}`, y
+    `referencia` identifica el cobro (la orden o la compra encolada); los
+    procesadores que no los necesitan los ignoran. `pagar` retorna True si el
+    pago se aprobo, False si se rechazo y lanza PagoIndeterminado si no se sabe.
     """
     @abstractmethod
-    def pagar(self, monto: float) -> bool:
-        pass
\ No newline at end of file
+    def pagar(self, monto: float, productos: dict | None = None, referencia: str | None = None) -> bool:
+        pass
+
+    async def apagar(self, monto: float, productos: dict | None = None, referencia: str | None = None) -> bool:
+        """
+        Version async de `pagar` para las vistas ASGI. Por defecto corre `pagar`
+        en un hilo aparte; los procesadores que pueden esperar sin bloquear la
+        sobreescriben.
+        """
+        return await asyncio.to_thread(self.pagar, monto, productos, referencia)
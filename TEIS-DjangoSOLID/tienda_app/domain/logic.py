@@ -1,5 +1,12 @@
 from decimal import Decimal
 
+_CENTAVO = Decimal("0.01")
+
+
+def _como_decimal(valor):
+    # Los Decimal (precios del ORM) se usan tal cual; el resto pasa por str como en el camino escalar.
+    return valor if isinstance(valor, Decimal) else Decimal(str(valor))
+
 
 class CalculadorImpuestos:
     """
@@ -13,3 +20,108 @@ class CalculadorImpuestos:
     def obtener_total_con_iva(precio_base):
         base = Decimal(str(precio_base))
         return (base * CalculadorImpuestos.IVA).quantize(Decimal("0.01"))
+
+
+class MotorImpuestos:
+    """
+    Tasas de IVA por categoria de libro y region. Las reglas se compilan una
+    sola vez en un dict `(categoria, region) -> tasa`; cada combinacion resuelta
+    (con sus comodines) queda memorizada, asi que calcular no consulta la base.
+    Sin reglas, toda tasa es la de `CalculadorImpuestos.IVA`.
+    """
+
+    COMODIN = "*"
+
+    def __init__(self, reglas=(), region="", tasa_por_defecto=None):
+        self.cargar(reglas, region, tasa_por_defecto)
+
+    @staticmethod
+    def _normalizar(valor):
+        return (valor or "").strip().lower()
+
+    def _compilar_regla(self, indice, regla):
+        # Cada error nombra la regla y la clave culpable: llega tal cual al
+        # ImproperlyConfigured que levanta `TiendaAppConfig.ready()`.
+        if not isinstance(regla, dict):
+            raise ValueError(f"regla {indice}: se esperaba un objeto y llego {regla!r}")
+        if "tasa" not in regla:
+            raise ValueError(f"regla {indice}: falta la clave 'tasa'")
+        try:
+            tasa = Decimal(str(regla["tasa"]))
+        except ArithmeticError:
+            raise ValueError(f"regla {indice}: 'tasa' no es un numero: {regla['tasa']!r}") from None
+        if not tasa.is_finite() or tasa < 0:
+            raise ValueError(f"regla {indice}: 'tasa' no puede ser negativa ni infinita: {regla['tasa']!r}")
+        for campo in ("categoria", "region"):
+            if not isinstance(regla.get(campo) or "", str):
+                raise ValueError(f"regla {indice}: '{campo}' debe ser texto: {regla[campo]!r}")
+
+        clave = (
+            self._normalizar(regla.get("categoria")) or self.COMODIN,
+            self._normalizar(regla.get("region")) or self.COMODIN,
+        )
+        return clave, tasa
+
+    def cargar(self, reglas=(), region="", tasa_por_defecto=None):
+        """Reglas: `[{"categoria": "ebook", "region": "", "tasa": "0.05"}, ...]`; vacio = comodin."""
+        if not isinstance(reglas, (list, tuple)):
+            raise ValueError(f"se esperaba una lista de reglas y llego {reglas!r}")
+        tabla = dict(self._compilar_regla(indice, regla) for indice, regla in enumerate(reglas))
+
+        if tasa_por_defecto is None:
+            tasa_por_defecto = CalculadorImpuestos.IVA - 1
+        self.tasa_por_defecto = Decimal(str(tasa_por_defecto))
+        self.region = self._normalizar(region)
+        self._tabla = tabla
+        self._resueltas = {}
+
+    def tasa(self, categoria="", region=None):
+        clave = (self._normalizar(categoria), self.region if region is None else self._normalizar(region))
+        tasa = self._resueltas.get(clave)
+        if tasa is None:
+            categoria, region = clave
+            candidatas = ((categoria, region), (categoria, self.COMODIN), (self.COMODIN, region))
+            tasa = next(
+                (self._tabla[candidata] for candidata in candidatas if candidata in self._tabla),
+                self._tabla.get((self.COMODIN, self.COMODIN), self.tasa_por_defecto),
+            )
+            self._resueltas[clave] = tasa
+        return tasa
+
+    def tasa_libro(self, libro, region=None):
+        return self.tasa(getattr(libro, "categoria", ""), region)
+
+    def totales(self, lineas):
+        """
+        Subtotal, IVA y total de lineas `(precio, cantidad, tasa)`. El IVA se
+        redondea una vez por tasa sobre su subtotal: con una sola tasa es
+        exactamente `obtener_total_con_iva(subtotal)`.
+        """
+        subtotales = {}
+        for precio, cantidad, tasa in lineas:
+            subtotales[tasa] = subtotales.get(tasa, Decimal("0")) + _como_decimal(precio) * cantidad
+
+        subtotal = sum(subtotales.values(), Decimal("0"))
+        total = sum(
+            ((parcial * (1 + tasa)).quantize(_CENTAVO) for tasa, parcial in subtotales.items()),
+            Decimal("0.00"),
+        )
+        return {"subtotal": subtotal, "iva": total - subtotal, "total": total}
+
+    def total_libro(self, libro, cantidad=1, region=None):
+        return self.totales([(libro.precio, cantidad, self.tasa_libro(libro, region))])["total"]
+
+    def totales_con_iva(self, precios, tasas):
+        """Total con IVA de cada precio con su tasa; version por lote de `total_libro`."""
+        factores = {}
+        totales = []
+        for precio, tasa in zip(precios, tasas):
+            factor = factores.get(tasa)
+            if factor is None:
+                factor = factores[tasa] = 1 + tasa
+            totales.append((_como_decimal(precio) * factor).quantize(_CENTAVO))
+        return totales
+
+
+# Instancia del proceso; `TiendaAppConfig.ready()` le carga las reglas de settings.
+motor_impuestos = MotorImpuestos()
@@ -0,0 +1,158 @@
+import csv
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max, Min, Prefetch
+from django.utils import timezone
+
+from .models import MarcaIncremental, Orden, OrdenItem
+from .reportes import inicio_del_dia
+
+MARCA_EXPORTACION = "exportacion_ordenes"
+COLUMNAS_CSV = [
+    "orden_id",
+    "fecha_creacion",
+    "usuario",
+    "estado",
+    "direccion_envio",
+    "total",
+    "item_id",
+    "libro_id",
+    "cantidad",
+    "precio_unitario",
+]
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: retorna la linea en vez de guardarla."""
+
+    def write(self, valor):
+        return valor
+
+
+def tope_incremental(ahora=None):
+    """
+    Ultimo Orden.id exportable en modo incremental: antes de la primera orden
+    PENDIENTE y sin ordenes mas recientes que REPORTES_VENTAS_MARGEN_SEGUNDOS.
+    """
+    ahora = ahora or timezone.now()
+    margen = ahora - timedelta(seconds=settings.REPORTES_VENTAS_MARGEN_SEGUNDOS)
+    tope = Orden.objects.filter(fecha_creacion__lte=margen).aggregate(tope=Max("id"))["tope"] or 0
+    primera_pendiente = Orden.objects.filter(estado=Orden.Estado.PENDIENTE).aggregate(primera=Min("id"))["primera"]
+    if primera_pendiente is not None:
+        tope = min(tope, primera_pendiente - 1)
+    return tope
+
+
+def _consulta_ordenes(desde=None, hasta=None, desde_id=None):
+    ordenes = Orden.objects.order_by("id")
+    if desde:
+        ordenes = ordenes.filter(fecha_creacion__gte=inicio_del_dia(desde))
+    if hasta:
+        ordenes = ordenes.filter(fecha_creacion__lt=inicio_del_dia(hasta + timedelta(days=1)))
+    if desde_id is not None:
+        ordenes = ordenes.filter(id__gt=desde_id, id__lte=tope_incremental())
+
+    items = OrdenItem.objects.order_by("id").only("id", "orden_id", "libro_id", "cantidad", "precio_unitario")
+    return ordenes.prefetch_related(Prefetch("items", queryset=items))
+
+
+def ordenes_para_exportar(desde=None, hasta=None, desde_id=None, chunk_size=2000):
+    """
+    Itera las ordenes con sus items usando un cursor del servidor: en memoria
+    solo vive un bloque de `chunk_size` ordenes a la vez. Con `desde_id` se
+    exportan solo ordenes posteriores a ese id y hasta `tope_incremental()`.
+    """
+    return _consulta_ordenes(desde, hasta, desde_id).iterator(chunk_size=chunk_size)
+
+
+def aordenes_para_exportar(desde=None, hasta=None, desde_id=None, chunk_size=2000):
+    """
+    Igual que ordenes_para_exportar pero con `aiterator()`, para que un worker
+    ASGI escriba cada bloque apenas lo lee. Los filtros (incluido
+    `tope_incremental()`) se resuelven al llamarla, en contexto sync.
+    """
+    return _consulta_ordenes(desde, hasta, desde_id).aiterator(chunk_size=chunk_size)
+
+
+def _datos_orden(orden):
+    return [
+        orden.id,
+        orden.fecha_creacion.isoformat(),
+        orden.usuario,
+        orden.estado,
+        orden.direccion_envio,
+        str(orden.total),
+    ]
+
+
+def _filas_csv(escritor, orden):
+    datos = _datos_orden(orden)
+    items = orden.items.all()
+    if not items:
+        return [escritor.writerow(datos + ["", "", "", ""])]
+    return [
+        escritor.writerow(datos + [item.id, item.libro_id, item.cantidad, str(item.precio_unitario)])
+        for item in items
+    ]
+
+
+def _linea_ndjson(orden):
+    registro = dict(zip(COLUMNAS_CSV[:6], _datos_orden(orden)))
+    registro["items"] = [
+        {
+            "item_id": item.id,
+            "libro_id": item.libro_id,
+            "cantidad": item.cantidad,
+            "precio_unitario": str(item.precio_unitario),
+        }
+        for item in orden.items.all()
+    ]
+    return json.dumps(registro, ensure_ascii=False) + "\n"
+
+
+def lineas_csv(ordenes):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUMNAS_CSV)
+    for orden in ordenes:
+        yield from _filas_csv(escritor, orden)
+
+
+def lineas_ndjson(ordenes):
+    for orden in ordenes:
+        yield _linea_ndjson(orden)
+
+
+async def alineas_csv(ordenes):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUMNAS_CSV)
+    async for orden in ordenes:
+        for fila in _filas_csv(escritor, orden):
+            yield fila
+
+
+async def alineas_ndjson(ordenes):
+    async for orden in ordenes:
+        yield _linea_ndjson(orden)
+
+
+FORMATOS = {
+    "csv": (lineas_csv, "text/csv; charset=utf-8"),
+    "ndjson": (lineas_ndjson, "application/x-ndjson"),
+}
+
+# Bajo ASGI, StreamingHttpResponse junta un iterador sync completo antes de
+# enviarlo (sync_to_async(list)); con estos generadores async se envia por bloques.
+FORMATOS_ASYNC = {
+    "csv": alineas_csv,
+    "ndjson": alineas_ndjson,
+}
+
+
+def marca_exportacion():
+    return MarcaIncremental.objects.filter(nombre=MARCA_EXPORTACION).values_list("ultimo_id", flat=True).first() or 0
+
+
+def guardar_marca_exportacion(ultimo_id):
+    MarcaIncremental.objects.update_or_create(nombre=MARCA_EXPORTACION, defaults={"ultimo_id": ultimo_id})
@@ -0,0 +1,121 @@
+"""
+Inventario fragmentado para libros muy demandados.
+
+El stock de un libro fragmentado vive en K filas de `InventarioFragmento` y su
+fila de `Inventario` queda en 0, asi que compras concurrentes del mismo libro
+bloquean filas distintas. El stock total siempre es `Inventario.cantidad` mas
+la suma de los fragmentos.
+"""
+
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Inventario, InventarioFragmento, Libro
+
+FRAGMENTOS_MAXIMOS = 64
+
+
+def con_stock(libros):
+    """Anota `stock_total` (fila principal mas fragmentos) en un queryset de Libro."""
+    fragmentos = (
+        InventarioFragmento.objects
+        .filter(libro_id=OuterRef("pk"))
+        .values("libro_id")
+        .annotate(total=Sum("cantidad"))
+        .values("total")
+    )
+    return libros.annotate(
+        stock_total=(
+            Coalesce("inventario__cantidad", 0, output_field=models.IntegerField())
+            + Coalesce(Subquery(fragmentos), 0, output_field=models.IntegerField())
+        )
+    )
+
+
+def fragmentos_con_stock():
+    """Condicion para filtrar libros con algun fragmento disponible."""
+    return Exists(InventarioFragmento.objects.filter(libro_id=OuterRef("pk"), cantidad__gt=0))
+
+
+def stock_de(libro_id):
+    return con_stock(Libro.objects.filter(pk=libro_id)).values_list("stock_total", flat=True).get()
+
+
+def descontar_fragmentos(libro_id, cantidad):
+    """
+    Descuenta `cantidad` unidades de los fragmentos del libro dentro de la
+    transaccion en curso. Toma un fragmento al azar con SKIP LOCKED, o sea el
+    siguiente libre si otro comprador lo tiene bloqueado; solo si ningun fragmento
+    libre alcanza espera por los que tienen stock y reparte el descuento.
+    Retorna False, sin descontar nada, si los fragmentos no alcanzan.
+    """
+    libre = (
+        InventarioFragmento.objects
+        .select_for_update(skip_locked=True)
+        .filter(libro_id=libro_id, cantidad__gte=cantidad)
+        .order_by("?")
+        .values_list("pk", flat=True)
+        .first()
+    )
+    if libre is not None:
+        InventarioFragmento.objects.filter(pk=libre).update(cantidad=F("cantidad") - cantidad)
+        return True
+
+    # Se bloquea en orden de indice para no cruzarse con otro comprador en la misma espera.
+    fragmentos = list(
+        InventarioFragmento.objects
+        .select_for_update()
+        .filter(libro_id=libro_id, cantidad__gt=0)
+        .order_by("indice")
+    )
+    if sum(fragmento.cantidad for fragmento in fragmentos) < cantidad:
+        return False
+
+    pendiente = cantidad
+    for fragmento in fragmentos:
+        tomado = min(pendiente, fragmento.cantidad)
+        fragmento.cantidad -= tomado
+        pendiente -= tomado
+    InventarioFragmento.objects.bulk_update(fragmentos, ["cantidad"])
+    return True
+
+
+def rebalancear(libro_id, fragmentos=None, total=None):
+    """
+    Reparte el stock del libro en `fragmentos` partes iguales y deja la fila
+    principal en 0. `fragmentos=None` conserva la cantidad actual y `0` devuelve
+    todo a la fila principal. `total` reemplaza el stock actual (importacion).
+    Retorna la cantidad de fragmentos resultante.
+    """
+    if fragmentos is not None and not 0 <= fragmentos <= FRAGMENTOS_MAXIMOS:
+        raise ValueError(f"La cantidad de fragmentos debe estar entre 0 y {FRAGMENTOS_MAXIMOS}.")
+
+    with transaction.atomic():
+        inventario = Inventario.objects.select_for_update().get(libro_id=libro_id)
+        actuales = list(
+            InventarioFragmento.objects
+            .select_for_update()
+            .filter(libro_id=libro_id)
+            .order_by("indice")
+        )
+        if fragmentos is None:
+            fragmentos = len(actuales)
+        if total is None:
+            total = inventario.cantidad + sum(fragmento.cantidad for fragmento in actuales)
+
+        InventarioFragmento.objects.filter(libro_id=libro_id, indice__gte=fragmentos).delete()
+        if fragmentos:
+            base, resto = divmod(total, fragmentos)
+            InventarioFragmento.objects.bulk_create(
+                [
+                    InventarioFragmento(libro_id=libro_id, indice=indice, cantidad=base + (indice < resto))
+                    for indice in range(fragmentos)
+                ],
+                update_conflicts=True,
+                unique_fields=["libro", "indice"],
+                update_fields=["cantidad"],
+            )
+            total = 0
+        Inventario.objects.filter(pk=inventario.pk).update(cantidad=total)
+    return fragmentos
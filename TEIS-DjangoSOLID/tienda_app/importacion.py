@@ -0,0 +1,146 @@
+"""
+Importacion masiva de catalogo (Libro + Inventario) desde CSV, NDJSON o JSON.
+
+El archivo se lee fila a fila y se escribe en lotes: cada lote es una
+transaccion con dos upserts (`bulk_create(update_conflicts=True)`), asi que el
+costo crece con la cantidad de lotes y no con la cantidad de filas.
+"""
+
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from .catalogo import invalidar_catalogo
+from .fragmentos import rebalancear
+from .models import Inventario, InventarioFragmento, Libro
+
+_CENTAVOS = Decimal("0.01")
+_PRECIO_MAXIMO = Decimal("99999999.99")
+MAX_ERRORES_REPORTADOS = 20
+
+
+def leer_filas(ruta):
+    """Genera `(numero_de_linea, fila)` sin cargar el archivo completo (salvo `.json`)."""
+    ruta = Path(ruta)
+    sufijo = ruta.suffix.lower()
+    with ruta.open(encoding="utf-8", newline="") as archivo:
+        if sufijo == ".csv":
+            yield from enumerate(csv.DictReader(archivo), start=2)
+        elif sufijo in (".ndjson", ".jsonl"):
+            for numero, linea in enumerate(archivo, start=1):
+                if not linea.strip():
+                    continue
+                try:
+                    yield numero, json.loads(linea)
+                except json.JSONDecodeError:
+                    yield numero, None
+        elif sufijo == ".json":
+            yield from enumerate(json.load(archivo), start=1)
+        else:
+            raise ValueError(f"Formato no soportado: {ruta.suffix}. Use .csv, .ndjson, .jsonl o .json.")
+
+
+def normalizar_fila(fila):
+    """Retorna `(sku, titulo, precio, cantidad)`; `cantidad` es None si la fila no trae stock."""
+    if not isinstance(fila, dict):
+        raise ValueError("la fila no es un objeto valido")
+
+    sku = str(fila.get("sku") or "").strip()
+    titulo = str(fila.get("titulo") or "").strip()
+    if not sku or len(sku) > 64:
+        raise ValueError("sku vacio o mayor a 64 caracteres")
+    if not titulo or len(titulo) > 200:
+        raise ValueError("titulo vacio o mayor a 200 caracteres")
+
+    try:
+        precio = Decimal(str(fila.get("precio", "")).strip()).quantize(_CENTAVOS)
+    except InvalidOperation:
+        raise ValueError(f"precio invalido: {fila.get('precio')!r}") from None
+    # "NaN" pasa el quantize y haria fallar la comparacion de rango con InvalidOperation.
+    if not precio.is_finite():
+        raise ValueError(f"precio invalido: {fila.get('precio')!r}")
+    if not Decimal("0") <= precio <= _PRECIO_MAXIMO:
+        raise ValueError(f"precio fuera de rango: {precio}")
+
+    cantidad = fila.get("cantidad")
+    if cantidad is None or str(cantidad).strip() == "":
+        return sku, titulo, precio, None
+    try:
+        cantidad = int(str(cantidad).strip())
+    except ValueError:
+        raise ValueError(f"cantidad invalida: {cantidad!r}") from None
+    if cantidad < 0:
+        raise ValueError(f"cantidad negativa: {cantidad}")
+    return sku, titulo, precio, cantidad
+
+
+def importar_lote(filas):
+    """Upsert de un lote de filas normalizadas en una sola transaccion."""
+    # Un mismo sku dos veces en un INSERT ... ON CONFLICT falla en PostgreSQL: gana la ultima fila.
+    por_sku = {fila[0]: fila for fila in filas}
+    with transaction.atomic():
+        Libro.objects.bulk_create(
+            [Libro(sku=sku, titulo=titulo, precio=precio) for sku, titulo, precio, _ in por_sku.values()],
+            update_conflicts=True,
+            unique_fields=["sku"],
+            update_fields=["titulo", "precio"],
+        )
+        con_stock = {sku: cantidad for sku, _, _, cantidad in por_sku.values() if cantidad is not None}
+        if not con_stock:
+            return
+        # La misma consulta marca los libros fragmentados: la cantidad del archivo es
+        # su stock total y se reparte de nuevo entre los fragmentos.
+        libros = (
+            Libro.objects
+            .filter(sku__in=con_stock)
+            .annotate(fragmentado=Exists(InventarioFragmento.objects.filter(libro_id=OuterRef("pk"))))
+            .values_list("sku", "id", "fragmentado")
+        )
+        ids, fragmentados = {}, []
+        for sku, libro_id, fragmentado in libros:
+            ids[sku] = libro_id
+            if fragmentado:
+                fragmentados.append(sku)
+        Inventario.objects.bulk_create(
+            [Inventario(libro_id=ids[sku], cantidad=cantidad) for sku, cantidad in con_stock.items()],
+            update_conflicts=True,
+            unique_fields=["libro"],
+            update_fields=["cantidad"],
+        )
+        for sku in fragmentados:
+            rebalancear(ids[sku], total=con_stock[sku])
+
+
+def importar_catalogo(ruta, lote=2000, al_avanzar=None):
+    """
+    Importa el archivo en lotes de `lote` filas validas. Las filas invalidas se
+    saltan y se reportan. `al_avanzar(procesadas)` se llama despues de cada lote.
+    """
+    resumen = {"importadas": 0, "invalidas": 0, "lotes": 0, "errores": []}
+
+    def validas():
+        for numero, fila in leer_filas(ruta):
+            try:
+                yield normalizar_fila(fila)
+            except ValueError as error:
+                resumen["invalidas"] += 1
+                if len(resumen["errores"]) < MAX_ERRORES_REPORTADOS:
+                    resumen["errores"].append(f"linea {numero}: {error}")
+
+    filas = validas()
+    while bloque := list(islice(filas, lote)):
+        importar_lote(bloque)
+        resumen["importadas"] += len(bloque)
+        resumen["lotes"] += 1
+        if al_avanzar:
+            al_avanzar(resumen["importadas"])
+
+    # bulk_create no emite post_save: se invalida el catalogo una sola vez al final.
+    if resumen["importadas"]:
+        invalidar_catalogo()
+    return resumen
@@ -0,0 +1,176 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_FIN = object()
+
+
+class RegistroAuditoria:
+    """
+    Bitacora de auditoria en formato JSON lines que no bloquea el request.
+
+    `registrar()` solo encola el evento; un hilo de fondo escribe los eventos
+    por lotes con un unico `write` en modo append (las lineas de distintos
+    workers nunca quedan mezcladas) y rota el archivo por tamano. La cola
+    admite hasta `max_pendientes` eventos: si el disco no da abasto se
+    descartan (y se cuentan en `descartados`) en vez de crecer sin limite.
+    """
+
+    def __init__(self, ruta, max_bytes=10 * 1024 * 1024, respaldos=5, tamano_lote=500, max_pendientes=10000):
+        self.ruta = str(ruta)
+        self.max_bytes = max_bytes
+        self.respaldos = respaldos
+        self.tamano_lote = tamano_lote
+        self.max_pendientes = max_pendientes
+        self.descartados = 0
+        self._descartados_reportados = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._cola = None
+        self._hilo = None
+
+    def _asegurar_hilo(self):
+        # Tras un fork (workers de Gunicorn) el hilo del padre no existe en el hijo.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._cola = queue.Queue(maxsize=self.max_pendientes)
+            self._hilo = threading.Thread(target=self._escritor, name=f"auditoria:{self.ruta}", daemon=True)
+            self._hilo.start()
+            self._pid = os.getpid()
+
+    def registrar(self, evento, **datos):
+        self._asegurar_hilo()
+        registro = {
+            "fecha": datetime.datetime.now().isoformat(),
+            "evento": evento,
+            "pid": os.getpid(),
+            **datos,
+        }
+        try:
+            self._cola.put_nowait(registro)
+        except queue.Full:
+            with self._lock:
+                self.descartados += 1
+
+    def flush(self):
+        """Bloquea hasta que todos los eventos encolados esten escritos."""
+        if self._pid == os.getpid():
+            self._cola.join()
+
+    def cerrar(self):
+        if self._pid != os.getpid():
+            return
+        self._cola.put(_FIN)
+        self._hilo.join()
+        self._pid = None
+
+    def _escritor(self):
+        cola = self._cola
+        while True:
+            lote = [cola.get()]
+            while len(lote) < self.tamano_lote:
+                try:
+                    lote.append(cola.get_nowait())
+                except queue.Empty:
+                    break
+
+            registros = [registro for registro in lote if registro is not _FIN]
+            try:
+                if registros:
+                    self._escribir(registros)
+            except Exception:
+                # Un lote fallido (disco lleno, permisos) no debe matar el hilo:
+                # se reporta y se sigue con el siguiente.
+                logger.exception("No se pudieron escribir %d eventos en %s", len(registros), self.ruta)
+            finally:
+                self._reportar_descartados()
+                for _ in lote:
+                    cola.task_done()
+            if len(registros) != len(lote):
+                return
+
+    def _reportar_descartados(self):
+        descartados = self.descartados
+        if descartados != self._descartados_reportados:
+            logger.warning("Cola de %s llena: %d eventos descartados en total", self.ruta, descartados)
+            self._descartados_reportados = descartados
+
+    def _escribir(self, registros):
+        contenido = "".join(
+            json.dumps(registro, default=str, ensure_ascii=False) + "\n"
+            for registro in registros
+        ).encode("utf-8")
+        # El lock de archivo serializa rotacion y escritura entre workers: sin el,
+        # dos workers podian rotar a la vez y perder un respaldo o fallar el replace.
+        with self._lock_archivo():
+            self._rotar_si_excede(len(contenido))
+            descriptor = os.open(self.ruta, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(descriptor, contenido)
+            finally:
+                os.close(descriptor)
+
+    @contextmanager
+    def _lock_archivo(self):
+        if fcntl is None:
+            yield
+            return
+        descriptor = os.open(f"{self.ruta}.lock", os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(descriptor)
+
+    def _rotar_si_excede(self, bytes_nuevos):
+        try:
+            tamano = os.path.getsize(self.ruta)
+        except FileNotFoundError:
+            return
+        if tamano == 0 or tamano + bytes_nuevos <= self.max_bytes:
+            return
+
+        for indice in range(self.respaldos - 1, 0, -1):
+            origen = f"{self.ruta}.{indice}"
+            if os.path.exists(origen):
+                os.replace(origen, f"{self.ruta}.{indice + 1}")
+        if self.respaldos > 0:
+            os.replace(self.ruta, f"{self.ruta}.1")
+        else:
+            os.remove(self.ruta)
+
+
+_registros = {}
+_registros_lock = threading.Lock()
+
+
+def obtener_registro(ruta):
+    """Retorna la bitacora compartida del proceso para `ruta`."""
+    ruta = str(ruta)
+    registro = _registros.get(ruta)
+    if registro is None:
+        with _registros_lock:
+            registro = _registros.setdefault(ruta, RegistroAuditoria(ruta))
+    return registro
+
+
+@atexit.register
+def cerrar_registros():
+    # Garantiza que nada quede en memoria cuando el worker termina.
+    for registro in list(_registros.values()):
+        registro.cerrar()
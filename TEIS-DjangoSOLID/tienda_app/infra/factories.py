@@ -1,20 +1,76 @@
 import os
-from .gateways import BancoNacionalProcesador
+import threading
+
+from .gateways import BancoNacionalProcesador, MicroservicioPagosProcesador
 
 # Implementacion ligera para pruebas (Mocking)
 class MockPaymentProcessor:
-    def pagar(self, monto: float) -> bool:
+    def pagar(self, monto: float, productos: dict | None = None, referencia: str | None = None) -> bool:
         print(f"[DEBUG] Mock Payment: Procesando pago de ${monto} sin cargo real.")
         return True
 
+    async def apagar(self, monto: float, productos: dict | None = None, referencia: str | None = None) -> bool:
+        return self.pagar(monto, productos, referencia)
+
+
+def _crear_procesador_http():
+    return MicroservicioPagosProcesador(
+        base_url=os.getenv('PAGOS_API_URL', 'http://pagos_flask:5000'),
+        timeout=float(os.getenv('PAGOS_API_TIMEOUT', '3')),
+    )
+
+
 class PaymentFactory:
-    @staticmethod
-    def get_processor():
+    """
+    Registro de procesadores por proceso: cada proveedor se construye una sola
+    vez (de forma perezosa) y la misma instancia se comparte entre los hilos
+    del worker. Los procesadores registrados deben ser thread-safe.
+    """
+
+    PROVEEDOR_POR_DEFECTO = 'BANCO'
+
+    _constructores = {
+        'BANCO': BancoNacionalProcesador,
+        'MOCK': MockPaymentProcessor,
+        'HTTP': _crear_procesador_http,
+    }
+    _instancias = {}
+    _proveedor_configurado = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def register_processor(cls, provider, constructor):
+        """Registra (o reemplaza) un proveedor; `constructor` no recibe argumentos."""
+        with cls._lock:
+            cls._constructores[provider] = constructor
+            cls._instancias.pop(provider, None)
+
+    @classmethod
+    def reset(cls):
+        """Olvida las instancias y vuelve a leer PAYMENT_PROVIDER. Pensado para tests."""
+        with cls._lock:
+            cls._instancias.clear()
+            cls._proveedor_configurado = None
+
+    @classmethod
+    def _proveedor_activo(cls):
         # LECCION ARQUITECTURA: La configuracion viene del ambiente, no del codigo
-        provider = os.getenv('PAYMENT_PROVIDER', 'BANCO')
+        if cls._proveedor_configurado is None:
+            cls._proveedor_configurado = os.getenv('PAYMENT_PROVIDER', cls.PROVEEDOR_POR_DEFECTO)
+        return cls._proveedor_configurado
 
-        if provider == 'MOCK':
-            return MockPaymentProcessor()
+    @classmethod
+    def get_processor(cls, provider=None):
+        provider = provider or cls._proveedor_activo()
+        instancia = cls._instancias.get(provider)
+        if instancia is not None:
+            return instancia
 
-        # Por defecto usamos la infraestructura real
-        return BancoNacionalProcesador()
+        with cls._lock:
+            instancia = cls._instancias.get(provider)
+            if instancia is None:
+                # Por defecto usamos la infraestructura real
+                constructor = cls._constructores.get(provider, cls._constructores[cls.PROVEEDOR_POR_DEFECTO])
+                instancia = constructor()
+                cls._instancias[provider] = instancia
+            return instancia
@@ -1,16 +1,101 @@
-import datetime
-from ..domain.interfaces import ProcesadorPago
+import http.client
+import json
+import random
+import time
+import uuid
+
+from ..domain.interfaces import PagoIndeterminado, ProcesadorPago
+from .auditoria import obtener_registro
+from .http import CircuitBreaker, PoolConexionesHTTP
 
 class BancoNacionalProcesador(ProcesadorPago):
 
-    def pagar(self, monto: float) -> bool:
+    def pagar(self, monto: float, productos: dict | None = None, referencia: str | None = None) -> bool:
         # Reemplazo de SU_NOMBRE por identidad del estudiante.
         archivo_log = "pagos_locales_MATEO.log"
 
-        with open(archivo_log, "a") as f:
-            f.write(
-                f"[{datetime.datetime.now()}] "
-                f"Transaccion exitosa por: ${monto}\n"
-            )
+        obtener_registro(archivo_log).registrar("transaccion_exitosa", monto=monto)
 
         return True
+
+    async def apagar(self, monto: float, productos: dict | None = None, referencia: str | None = None) -> bool:
+        # La bitacora solo encola el evento: no hay nada que esperar fuera del loop.
+        return self.pagar(monto, productos, referencia)
+
+
+class MicroservicioPagosProcesador(ProcesadorPago):
+    """
+    Cobra a traves del microservicio Flask (`POST /api/v2/comprar`).
+
+    Usa conexiones keep-alive reutilizables, reintenta errores de red y 5xx
+    con backoff exponencial con jitter, y deja de llamar al servicio mientras
+    el circuit breaker este abierto (el pago se reporta como rechazado, sin
+    haberlo enviado). Si tras los reintentos el servicio no respondio, el
+    cobro pudo haberse hecho y se lanza PagoIndeterminado.
+    `apagar` usa la version por defecto: la libreria estandar no trae un
+    cliente HTTP async, asi que el pool sincrono se espera en un hilo aparte,
+    sin bloquear el event loop.
+    """
+
+    RUTA_COMPRA = "/api/v2/comprar"
+
+    def __init__(
+        self,
+        base_url,
+        timeout=3.0,
+        reintentos=2,
+        espera_base=0.1,
+        tamano_pool=10,
+        circuit_breaker=None,
+        pool=None,
+    ):
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.pool = pool or PoolConexionesHTTP(base_url, tamano=tamano_pool, timeout=timeout)
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+    def _esperar_antes_de_reintentar(self, intento):
+        # "Full jitter": evita que todos los workers reintenten al mismo tiempo.
+        time.sleep(random.uniform(0, self.espera_base * (2 ** intento)))
+
+    @staticmethod
+    def _cuerpo(monto, productos):
+        # El microservicio v2 modela compras de un producto; un carrito con
+        # varios titulos se cobra solo por su monto.
+        cuerpo = {"monto": str(monto)}
+        if productos and len(productos) == 1:
+            producto_id, cantidad = next(iter(productos.items()))
+            cuerpo.update(producto_id=producto_id, cantidad=cantidad)
+        return json.dumps(cuerpo)
+
+    def pagar(self, monto: float, productos: dict | None = None, referencia: str | None = None) -> bool:
+        if not self.circuit_breaker.permitir():
+            return False
+
+        # La llave sale de la referencia del cobro, asi los reintentos y la
+        # conciliacion repiten la misma: el microservicio responde lo mismo a
+        # una llave ya vista sin procesar la compra otra vez.
+        llave = referencia or uuid.uuid4().hex
+        headers = {"Content-Type": "application/json", "Idempotency-Key": llave}
+        cuerpo = self._cuerpo(monto, productos)
+
+        for intento in range(self.reintentos + 1):
+            if intento:
+                self._esperar_antes_de_reintentar(intento - 1)
+            try:
+                status, contenido = self.pool.solicitar("POST", self.RUTA_COMPRA, cuerpo, headers)
+            except (OSError, http.client.HTTPException):
+                continue
+            if status >= 500:
+                continue
+
+            self.circuit_breaker.registrar_exito()
+            if status != 200:
+                return False
+            try:
+                return json.loads(contenido).get("status") == "Aprobado"
+            except ValueError:
+                return False
+
+        self.circuit_breaker.registrar_fallo()
+        raise PagoIndeterminado(f"La pasarela no respondio al cobro {llave} tras {self.reintentos + 1} intentos.")
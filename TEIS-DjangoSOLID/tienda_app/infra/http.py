@@ -0,0 +1,132 @@
+import http.client
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class CircuitBreaker:
+    """
+    Corta las llamadas a un servicio remoto tras `umbral_fallos` fallos seguidos.
+    Pasado `tiempo_reapertura` deja pasar una llamada de prueba (semiabierto):
+    si funciona el circuito se cierra, si falla vuelve a abrirse.
+    """
+
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, umbral_fallos=5, tiempo_reapertura=30.0, reloj=time.monotonic):
+        self.umbral_fallos = umbral_fallos
+        self.tiempo_reapertura = tiempo_reapertura
+        self._reloj = reloj
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._abierto_desde = None
+        self._prueba_en_curso = False
+
+    @property
+    def estado(self):
+        with self._lock:
+            return self._estado_actual()
+
+    def _estado_actual(self):
+        if self._abierto_desde is None:
+            return self.CERRADO
+        if self._reloj() - self._abierto_desde >= self.tiempo_reapertura:
+            return self.SEMIABIERTO
+        return self.ABIERTO
+
+    def permitir(self):
+        with self._lock:
+            estado = self._estado_actual()
+            if estado == self.CERRADO:
+                return True
+            if estado == self.SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            return False
+
+    def registrar_exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._abierto_desde = None
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self._prueba_en_curso or self._fallos >= self.umbral_fallos:
+                self._abierto_desde = self._reloj()
+            self._prueba_en_curso = False
+
+
+class PoolConexionesHTTP:
+    """
+    Pool de conexiones HTTP/1.1 keep-alive hacia un solo host.
+    Reutiliza hasta `tamano` conexiones ociosas; las que fallan se descartan.
+    """
+
+    # Errores tipicos de una conexion keep-alive que el servidor ya cerro.
+    _ERRORES_CONEXION_VIEJA = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+    def __init__(self, base_url, tamano=10, timeout=3.0):
+        partes = urlsplit(base_url)
+        self.esquema = partes.scheme or "http"
+        self.host = partes.hostname
+        self.puerto = partes.port
+        self.prefijo = partes.path.rstrip("/")
+        self.timeout = timeout
+        self._ociosas = queue.LifoQueue(maxsize=tamano)
+        self.conexiones_creadas = 0
+
+    def _nueva_conexion(self):
+        clase = http.client.HTTPSConnection if self.esquema == "https" else http.client.HTTPConnection
+        self.conexiones_creadas += 1
+        return clase(self.host, self.puerto, timeout=self.timeout)
+
+    def _tomar(self):
+        try:
+            return self._ociosas.get_nowait(), True
+        except queue.Empty:
+            return self._nueva_conexion(), False
+
+    def _devolver(self, conexion):
+        try:
+            self._ociosas.put_nowait(conexion)
+        except queue.Full:
+            conexion.close()
+
+    def solicitar(self, metodo, ruta, cuerpo=None, headers=None):
+        """Retorna `(status, cuerpo_bytes)`. Propaga errores de red y timeouts."""
+        conexion, reutilizada = self._tomar()
+        try:
+            try:
+                return self._enviar(conexion, metodo, ruta, cuerpo, headers)
+            except self._ERRORES_CONEXION_VIEJA:
+                if not reutilizada:
+                    raise
+                conexion.close()
+                conexion = self._nueva_conexion()
+                return self._enviar(conexion, metodo, ruta, cuerpo, headers)
+        except Exception:
+            conexion.close()
+            raise
+
+    def _enviar(self, conexion, metodo, ruta, cuerpo, headers):
+        conexion.request(metodo, f"{self.prefijo}{ruta}", body=cuerpo, headers=headers or {})
+        respuesta = conexion.getresponse()
+        # Leer todo el cuerpo es obligatorio para poder reutilizar la conexion.
+        contenido = respuesta.read()
+        if respuesta.will_close:
+            conexion.close()
+        else:
+            self._devolver(conexion)
+        return respuesta.status, contenido
+
+    def cerrar(self):
+        while True:
+            try:
+                self._ociosas.get_nowait().close()
+            except queue.Empty:
+                return
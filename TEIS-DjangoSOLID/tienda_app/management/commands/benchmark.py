@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tienda_app import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide consultas SQL y tiempos de las rutas de compra y catalogo, y falla "
+        "si las consultas crecen frente a la linea base versionada. Con --tiempos "
+        "compara tambien los tiempos contra los grabados en esta maquina."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("escenarios", nargs="*", help="Escenarios a ejecutar (por defecto todos).")
+        parser.add_argument("--repeticiones", type=int, default=5)
+        parser.add_argument(
+            "--tiempos",
+            action="store_true",
+            help="Comparar tambien los tiempos contra los grabados en esta maquina con --guardar-tiempos.",
+        )
+        parser.add_argument("--tolerancia", type=float, default=0.5, help="Crecimiento de tiempo tolerado (0.5 = 50%%).")
+        parser.add_argument("--memoria", action="store_true", help="Medir tambien el pico de memoria (tracemalloc).")
+        parser.add_argument("--guardar", action="store_true", help="Guardar las consultas como nueva linea base.")
+        parser.add_argument("--guardar-tiempos", action="store_true", help="Guardar los tiempos como referencia local.")
+        parser.add_argument("--linea-base", default=str(benchmarks.RUTA_LINEA_BASE))
+        parser.add_argument("--tiempos-locales", default=str(benchmarks.RUTA_TIEMPOS_LOCALES))
+
+    def handle(self, *args, **options):
+        desconocidos = set(options["escenarios"]) - set(benchmarks.ESCENARIOS)
+        if desconocidos:
+            raise CommandError(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+
+        tiempos_base = None
+        if options["tiempos"] and not options["guardar_tiempos"]:
+            tiempos_base = benchmarks.cargar_linea_base(options["tiempos_locales"])
+            if not tiempos_base:
+                raise CommandError(
+                    f"No hay tiempos locales en {options['tiempos_locales']}: grabelos antes con --guardar-tiempos."
+                )
+
+        resultados = benchmarks.ejecutar(options["escenarios"], options["repeticiones"], options["memoria"])
+        linea_base = benchmarks.cargar_linea_base(options["linea_base"])
+
+        for clave, medicion in resultados.items():
+            base = linea_base.get(clave)
+            referencia = f" (base {base['consultas']} consultas)" if base else ""
+            if tiempos_base and clave in tiempos_base:
+                referencia += f" (local {tiempos_base[clave]:.2f} ms)"
+            pico = f" {medicion['pico_kb']:>10.1f} KB" if "pico_kb" in medicion else ""
+            self.stdout.write(
+                f"{clave:<36} {medicion['consultas']:>4} consultas {medicion['mediana_ms']:>10.2f} ms{pico}{referencia}"
+            )
+
+        if options["guardar"] or options["guardar_tiempos"]:
+            # La linea base versionada solo guarda consultas; los tiempos quedan
+            # en un archivo local y el pico de memoria no se guarda.
+            if options["guardar"]:
+                linea_base.update({clave: {"consultas": m["consultas"]} for clave, m in resultados.items()})
+                benchmarks.guardar_linea_base(linea_base, options["linea_base"])
+                self.stdout.write(self.style.SUCCESS(f"Linea base guardada en {options['linea_base']}"))
+            if options["guardar_tiempos"]:
+                tiempos = benchmarks.cargar_linea_base(options["tiempos_locales"])
+                tiempos.update({clave: m["mediana_ms"] for clave, m in resultados.items()})
+                benchmarks.guardar_linea_base(tiempos, options["tiempos_locales"])
+                self.stdout.write(self.style.SUCCESS(f"Tiempos locales guardados en {options['tiempos_locales']}"))
+            return
+
+        regresiones = benchmarks.comparar(resultados, linea_base, tiempos_base, tolerancia=options["tolerancia"])
+        if regresiones:
+            raise CommandError("Regresiones de rendimiento:\n" + "\n".join(regresiones))
+        self.stdout.write(self.style.SUCCESS("Sin regresiones frente a la linea base."))
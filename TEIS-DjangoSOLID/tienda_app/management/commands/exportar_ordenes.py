@@ -0,0 +1,54 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tienda_app.exportacion import FORMATOS, guardar_marca_exportacion, marca_exportacion, ordenes_para_exportar
+
+
+class Command(BaseCommand):
+    help = "Exporta ordenes con sus items en CSV o NDJSON sin cargar el historial en memoria."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--formato", choices=sorted(FORMATOS), default="csv")
+        parser.add_argument("--salida", help="Archivo destino. Por defecto se escribe a stdout.")
+        parser.add_argument("--desde", type=date.fromisoformat, help="Fecha inicial inclusiva (YYYY-MM-DD).")
+        parser.add_argument("--hasta", type=date.fromisoformat, help="Fecha final inclusiva (YYYY-MM-DD).")
+        parser.add_argument("--desde-id", type=int, help="Exporta solo ordenes con id mayor a este.")
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Continua desde la ultima orden exportada y guarda la nueva marca al terminar.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Ordenes leidas por bloque del cursor.")
+
+    def handle(self, *args, **options):
+        if options["incremental"] and options["desde_id"] is not None:
+            raise CommandError("--incremental y --desde-id no se pueden combinar.")
+
+        desde_id = marca_exportacion() if options["incremental"] else options["desde_id"]
+        ordenes = ordenes_para_exportar(
+            desde=options["desde"],
+            hasta=options["hasta"],
+            desde_id=desde_id,
+            chunk_size=options["chunk_size"],
+        )
+        exportadas = {"total": 0, "ultimo_id": desde_id or 0}
+
+        def registrar(ordenes):
+            for orden in ordenes:
+                exportadas["total"] += 1
+                exportadas["ultimo_id"] = orden.id
+                yield orden
+
+        generar_lineas, _ = FORMATOS[options["formato"]]
+        lineas = generar_lineas(registrar(ordenes))
+        if options["salida"]:
+            with open(options["salida"], "w", encoding="utf-8", newline="") as destino:
+                destino.writelines(lineas)
+        else:
+            for linea in lineas:
+                self.stdout.write(linea, ending="")
+
+        if options["incremental"] and exportadas["ultimo_id"] > (desde_id or 0):
+            guardar_marca_exportacion(exportadas["ultimo_id"])
+        self.stderr.write(f"Ordenes exportadas: {exportadas['total']} (ultimo id: {exportadas['ultimo_id']})")
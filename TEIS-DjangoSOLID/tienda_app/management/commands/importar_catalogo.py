@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tienda_app.importacion import importar_catalogo
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa libros y stock desde un archivo CSV, NDJSON o JSON "
+        "(columnas: sku, titulo, precio, cantidad opcional), actualizando los que ya existen por sku."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("ruta", help="Archivo .csv, .ndjson, .jsonl o .json.")
+        parser.add_argument("--lote", type=int, default=2000, help="Filas por transaccion.")
+
+    def handle(self, *args, **options):
+        if options["lote"] < 1:
+            raise CommandError("--lote debe ser mayor a 0.")
+
+        inicio = time.perf_counter()
+        try:
+            resumen = importar_catalogo(
+                options["ruta"],
+                lote=options["lote"],
+                al_avanzar=lambda procesadas: self.stdout.write(f"Filas importadas: {procesadas}"),
+            )
+        except (OSError, ValueError) as error:
+            raise CommandError(str(error)) from error
+
+        for error in resumen["errores"]:
+            self.stderr.write(f"Fila invalida en {error}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Importacion completada: {resumen['importadas']} filas en {resumen['lotes']} lotes, "
+                f"{resumen['invalidas']} invalidas, {time.perf_counter() - inicio:.1f} s."
+            )
+        )
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tienda_app.services import liberar_reservas_expiradas
+
+
+class Command(BaseCommand):
+    help = "Devuelve al inventario el stock de ordenes pendientes cuya reserva expiro."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limite", type=int, default=500, help="Ordenes liberadas por lote.")
+        parser.add_argument(
+            "--intervalo",
+            type=float,
+            default=0,
+            help="Segundos entre barridos. Con 0 se ejecuta un solo barrido.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while True:
+                liberadas = liberar_reservas_expiradas(limite=options["limite"])
+                total += liberadas
+                if liberadas < options["limite"]:
+                    break
+
+            self.stdout.write(f"Reservas liberadas: {total}")
+            if not options["intervalo"]:
+                return
+            time.sleep(options["intervalo"])
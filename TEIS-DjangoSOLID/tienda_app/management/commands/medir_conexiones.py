@@ -0,0 +1,114 @@
+import statistics
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.urls import reverse
+
+from tienda_app.carga import percentil
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la latencia por request abriendo una conexion por request, con "
+        "conexiones persistentes y con el pool de psycopg (solo PostgreSQL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="Requests por modo.")
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            default=60,
+            help="CONN_MAX_AGE del modo persistente (segundos).",
+        )
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1:
+            raise CommandError("--requests debe ser mayor que 0.")
+
+        modos = [("sin_persistencia", 0, None), ("persistente", options["max_age"], None)]
+        if connection.vendor == "postgresql":
+            # Las opciones de DB_POOL si esta activo; si no, los valores por defecto de psycopg.
+            modos.append(("pool", 0, settings.DATABASES["default"]["OPTIONS"].get("pool") or True))
+        else:
+            self.stdout.write(f"El modo pool requiere PostgreSQL; la base actual es {connection.vendor}.")
+
+        host = next((host for host in settings.ALLOWED_HOSTS if "*" not in host), "localhost").lstrip(".")
+        # Una compra encolada inexistente: el request hace una sola consulta y responde 404.
+        url = reverse("api_compra_encolada", args=[uuid.uuid4()])
+
+        medianas = {}
+        for nombre, max_age, pool in modos:
+            with self._modo(max_age, pool):
+                latencias, conexiones = self._medir(url, host, options["requests"])
+                if pool:
+                    # Con pool cada request toma una conexion prestada: se reportan las conexiones reales.
+                    conexiones = connection.pool.get_stats()["connections_num"]
+            medianas[nombre] = percentil(latencias, 50) * 1000
+            self._reportar(nombre, max_age, latencias, conexiones)
+
+        base = medianas["sin_persistencia"]
+        for nombre, mediana in medianas.items():
+            if nombre != "sin_persistencia":
+                self.stdout.write(self.style.SUCCESS(f"{nombre}: {base - mediana:.3f} ms menos por request (p50)"))
+
+    @contextmanager
+    def _modo(self, max_age, pool):
+        ajustes = connection.settings_dict
+        max_age_original = ajustes["CONN_MAX_AGE"]
+        pool_original = ajustes["OPTIONS"].get("pool")
+        connection.close()
+        ajustes["CONN_MAX_AGE"] = max_age
+        if pool:
+            ajustes["OPTIONS"]["pool"] = pool
+        else:
+            ajustes["OPTIONS"].pop("pool", None)
+        try:
+            yield
+        finally:
+            connection.close()
+            if pool and not pool_original:
+                connection.close_pool()
+            ajustes["CONN_MAX_AGE"] = max_age_original
+            if pool_original:
+                ajustes["OPTIONS"]["pool"] = pool_original
+            else:
+                ajustes["OPTIONS"].pop("pool", None)
+
+    def _medir(self, url, host, requests):
+        # El Client no cierra conexiones al terminar cada request; se hace igual
+        # que el handler WSGI/ASGI con request_started/request_finished.
+        cliente = Client()
+        conexiones = []
+
+        def contar(sender, connection, **kwargs):
+            conexiones.append(connection.alias)
+
+        connection_created.connect(contar)
+        latencias = []
+        try:
+            for _ in range(requests):
+                inicio = time.perf_counter()
+                close_old_connections()
+                response = cliente.get(url, HTTP_HOST=host)
+                close_old_connections()
+                latencias.append(time.perf_counter() - inicio)
+                if response.status_code != 404:
+                    raise CommandError(f"Respuesta inesperada: {response.status_code}")
+        finally:
+            connection_created.disconnect(contar)
+        return sorted(latencias), len(conexiones)
+
+    def _reportar(self, nombre, max_age, latencias, conexiones):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Modo {nombre} (CONN_MAX_AGE={max_age})"))
+        self.stdout.write(
+            f"  requests={len(latencias)} media={statistics.fmean(latencias) * 1000:.3f}ms "
+            f"p50={percentil(latencias, 50) * 1000:.3f}ms p95={percentil(latencias, 95) * 1000:.3f}ms"
+        )
+        self.stdout.write(f"  conexiones abiertas={conexiones}")
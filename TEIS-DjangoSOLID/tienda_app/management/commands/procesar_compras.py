@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tienda_app.infra.factories import PaymentFactory
+from tienda_app.services import procesar_compras_encoladas
+
+
+class Command(BaseCommand):
+    help = "Cobra las compras rapidas encoladas y crea sus ordenes en lotes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=100, help="Compras procesadas por lote.")
+        parser.add_argument("--proveedor", default=None, help="Pasarela de pagos; por defecto PAYMENT_PROVIDER.")
+        parser.add_argument(
+            "--intervalo",
+            type=float,
+            default=0,
+            help="Segundos de espera cuando la cola queda vacia. Con 0 se vacia la cola una vez y termina.",
+        )
+
+    def handle(self, *args, **options):
+        procesador = PaymentFactory.get_processor(options["proveedor"])
+        while True:
+            totales = dict.fromkeys(("confirmadas", "rechazadas", "por_verificar"), 0)
+            while True:
+                resultado = procesar_compras_encoladas(procesador, lote=options["lote"])
+                for clave, cantidad in resultado.items():
+                    totales[clave] += cantidad
+                if sum(resultado.values()) < options["lote"]:
+                    break
+
+            self.stdout.write(
+                f"Compras confirmadas: {totales['confirmadas']}, rechazadas: {totales['rechazadas']}, "
+                f"por verificar: {totales['por_verificar']}"
+            )
+            if not options["intervalo"]:
+                return
+            time.sleep(options["intervalo"])
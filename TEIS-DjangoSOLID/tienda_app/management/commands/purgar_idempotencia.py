@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from tienda_app.api.idempotencia import purgar_solicitudes_vencidas
+
+
+class Command(BaseCommand):
+    help = "Elimina las respuestas guardadas de Idempotency-Key mas antiguas que IDEMPOTENCIA_TTL_HORAS."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Solicitudes idempotentes eliminadas: {purgar_solicitudes_vencidas()}")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tienda_app.fragmentos import FRAGMENTOS_MAXIMOS, rebalancear, stock_de
+from tienda_app.models import Inventario, InventarioFragmento
+
+
+class Command(BaseCommand):
+    help = (
+        "Reparte el stock de libros muy demandados en K fragmentos iguales. "
+        "Con --fragmentos 0 devuelve todo el stock a la fila principal de Inventario."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("libro_ids", nargs="*", type=int)
+        parser.add_argument(
+            "--fragmentos",
+            type=int,
+            default=None,
+            help=f"Cantidad de fragmentos (0 a {FRAGMENTOS_MAXIMOS}). Por defecto conserva la actual.",
+        )
+        parser.add_argument("--todos", action="store_true", help="Rebalancear todos los libros ya fragmentados.")
+
+    def handle(self, *args, **options):
+        fragmentos = options["fragmentos"]
+        if fragmentos is not None and not 0 <= fragmentos <= FRAGMENTOS_MAXIMOS:
+            raise CommandError(f"--fragmentos debe estar entre 0 y {FRAGMENTOS_MAXIMOS}.")
+
+        libro_ids = list(options["libro_ids"])
+        if options["todos"]:
+            libro_ids += InventarioFragmento.objects.values_list("libro_id", flat=True).distinct().order_by("libro_id")
+        if not libro_ids:
+            raise CommandError("Indique al menos un libro_id o use --todos.")
+
+        for libro_id in dict.fromkeys(libro_ids):
+            try:
+                resultado = rebalancear(libro_id, fragmentos)
+            except Inventario.DoesNotExist:
+                raise CommandError(f"El libro {libro_id} no tiene inventario.") from None
+            self.stdout.write(f"Libro {libro_id}: {stock_de(libro_id)} unidades en {resultado} fragmentos")
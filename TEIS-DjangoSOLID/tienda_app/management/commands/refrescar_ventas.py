@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tienda_app.reportes import refrescar_ventas_diarias
+
+
+class Command(BaseCommand):
+    help = "Consolida en VentaDiaria las ventas confirmadas nuevas desde el ultimo refresco."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lote", type=int, default=50000, help="Ids de OrdenItem por transaccion.")
+        parser.add_argument(
+            "--intervalo",
+            type=float,
+            default=0,
+            help="Segundos entre refrescos. Con 0 se ejecuta un solo refresco.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            procesados = refrescar_ventas_diarias(lote=options["lote"])
+            self.stdout.write(f"Items consolidados: {procesados}")
+            if not options["intervalo"]:
+                return
+            time.sleep(options["intervalo"])
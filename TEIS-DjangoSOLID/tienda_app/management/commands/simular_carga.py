@@ -0,0 +1,153 @@
+import asyncio
+import os
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from tienda_app.carga import RUTAS, ejecutar_compradores, resumir
+from tienda_app.fragmentos import FRAGMENTOS_MAXIMOS, rebalancear, stock_de
+from tienda_app.infra.factories import PaymentFactory
+from tienda_app.models import Inventario, Libro, Orden, OrdenItem
+
+
+class ProcesadorSimulado:
+    """Pasarela local para la simulacion: aprueba todo tras una latencia fija."""
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+
+    def pagar(self, monto, productos=None, referencia=None):
+        if self.latencia:
+            time.sleep(self.latencia)
+        return True
+
+    async def apagar(self, monto, productos=None, referencia=None):
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+        return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Simula compradores concurrentes contra las rutas de compra y reporta "
+        "throughput, latencias, sobreventa, errores de lock y consistencia del stock."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rutas", default=",".join(RUTAS), help=f"Rutas separadas por coma: {', '.join(RUTAS)}.")
+        parser.add_argument("--compradores", type=int, default=10)
+        parser.add_argument("--compras", type=int, default=5, help="Compras por comprador.")
+        parser.add_argument("--stock", type=int, default=20, help="Stock inicial del libro de cada ruta.")
+        parser.add_argument("--modo", choices=["hilos", "procesos"], default="hilos")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help=(
+                "Compradores atendidos a la vez en las rutas sync, como N workers sync de Gunicorn "
+                "(por defecto uno por comprador). api_async atiende a todos desde un solo event loop."
+            ),
+        )
+        parser.add_argument(
+            "--latencia-pago",
+            type=float,
+            default=0.0,
+            help="Segundos que tarda la pasarela simulada en aprobar cada pago.",
+        )
+        parser.add_argument(
+            "--fragmentos",
+            default="0",
+            help=(
+                "Cantidades de fragmentos de inventario separadas por coma (p. ej. 0,4,16); "
+                "cada ruta se simula una vez por cantidad."
+            ),
+        )
+        parser.add_argument("--conservar", action="store_true", help="No borrar los libros y ordenes creados.")
+
+    def handle(self, *args, **options):
+        rutas = [ruta.strip() for ruta in options["rutas"].split(",") if ruta.strip()]
+        desconocidas = set(rutas) - set(RUTAS)
+        if desconocidas:
+            raise CommandError(f"Rutas desconocidas: {', '.join(sorted(desconocidas))}")
+        try:
+            fragmentos = [int(valor) for valor in options["fragmentos"].split(",") if valor.strip()]
+        except ValueError:
+            raise CommandError("--fragmentos debe ser una lista de enteros separados por coma.") from None
+        if not fragmentos or not all(0 <= valor <= FRAGMENTOS_MAXIMOS for valor in fragmentos):
+            raise CommandError(f"--fragmentos debe tener valores entre 0 y {FRAGMENTOS_MAXIMOS}.")
+        if options["workers"] is not None and options["workers"] < 1:
+            raise CommandError("--workers debe ser mayor que 0.")
+
+        host = next((host for host in settings.ALLOWED_HOSTS if "*" not in host), "localhost").lstrip(".")
+        self._usar_pasarela_simulada(options["latencia_pago"])
+        try:
+            for ruta in rutas:
+                for cantidad in fragmentos:
+                    self._simular_ruta(ruta, host, options, cantidad)
+        finally:
+            self._restaurar_pasarela()
+
+    def _usar_pasarela_simulada(self, latencia):
+        self._proveedor_original = os.environ.get("PAYMENT_PROVIDER")
+        PaymentFactory.register_processor("SIMULACION", lambda: ProcesadorSimulado(latencia))
+        os.environ["PAYMENT_PROVIDER"] = "SIMULACION"
+        PaymentFactory.reset()
+
+    def _restaurar_pasarela(self):
+        if self._proveedor_original is None:
+            os.environ.pop("PAYMENT_PROVIDER", None)
+        else:
+            os.environ["PAYMENT_PROVIDER"] = self._proveedor_original
+        PaymentFactory.reset()
+
+    def _simular_ruta(self, ruta, host, options, fragmentos=0):
+        libro = Libro.objects.create(titulo=f"Simulacion de carga ({ruta})", precio=Decimal("10.00"))
+        Inventario.objects.create(libro=libro, cantidad=options["stock"])
+        if fragmentos:
+            rebalancear(libro.id, fragmentos)
+        try:
+            resultados, duracion = ejecutar_compradores(
+                ruta,
+                libro.id,
+                options["compradores"],
+                options["compras"],
+                host,
+                modo=options["modo"],
+                workers=options["workers"],
+            )
+            vendidas = (
+                OrdenItem.objects
+                .filter(libro=libro, orden__estado=Orden.Estado.CONFIRMADA)
+                .aggregate(total=Sum("cantidad"))["total"]
+            ) or 0
+            stock_final = stock_de(libro.id)
+            nombre = f"{ruta} con {fragmentos} fragmentos" if fragmentos else ruta
+            self._reportar(nombre, resumir(resultados, duracion, options["stock"], stock_final, vendidas))
+        finally:
+            if not options["conservar"]:
+                Orden.objects.filter(items__libro=libro).delete()
+                libro.delete()
+
+    def _reportar(self, ruta, resumen):
+        estilo = self.style.SUCCESS if resumen["stock_consistente"] and not resumen["sobreventa"] else self.style.ERROR
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Ruta {ruta}"))
+        self.stdout.write(
+            f"  requests={resumen['requests']} duracion={resumen['duracion_s']:.2f}s "
+            f"rps={resumen['requests_por_segundo']:.1f}"
+        )
+        self.stdout.write(
+            f"  latencia p50={resumen['p50_ms']:.1f}ms p95={resumen['p95_ms']:.1f}ms p99={resumen['p99_ms']:.1f}ms"
+        )
+        self.stdout.write(
+            f"  exitos={resumen['exitos']} rechazos={resumen['rechazos']} "
+            f"errores={resumen['errores']} errores_lock={resumen['errores_lock']}"
+        )
+        self.stdout.write(
+            estilo(
+                f"  sobreventa={resumen['sobreventa']} stock {resumen['stock_inicial']} -> {resumen['stock_final']} "
+                f"vendidas={resumen['unidades_vendidas']} consistente={resumen['stock_consistente']}"
+            )
+        )
@@ -0,0 +1,189 @@
+"""
+Metricas por request: consultas SQL, tiempo en la base de datos, tiempo en
+sentencias que toman locks de fila y tiempo total de la vista.
+
+El wrapper de consultas se instala una vez por conexion y solo mide cuando hay
+un request activo en el contexto, asi que su costo fuera de un request es una
+lectura de ContextVar.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+_medicion_actual = contextvars.ContextVar("medicion_request", default=None)
+
+# Buckets (segundos) del histograma de duracion, al estilo de los clientes Prometheus.
+BUCKETS_DURACION = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MedicionRequest:
+    __slots__ = ("consultas", "tiempo_sql", "tiempo_lock")
+
+    def __init__(self):
+        self.consultas = 0
+        self.tiempo_sql = 0.0
+        self.tiempo_lock = 0.0
+
+
+def _toma_locks(sql):
+    # No hay forma portable de medir solo la espera del lock desde el cliente:
+    # se acumula el tiempo de las sentencias que bloquean filas.
+    return sql.startswith("UPDATE") or "FOR UPDATE" in sql
+
+
+def medir_consulta(execute, sql, params, many, context):
+    medicion = _medicion_actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracion = time.perf_counter() - inicio
+        medicion.consultas += 1
+        medicion.tiempo_sql += duracion
+        if _toma_locks(sql):
+            medicion.tiempo_lock += duracion
+
+
+def instalar_medicion(sender, connection, **kwargs):
+    if medir_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(medir_consulta)
+
+
+class _AcumuladoRuta:
+    __slots__ = ("requests", "errores", "duracion", "buckets", "consultas", "tiempo_sql", "tiempo_lock")
+
+    def __init__(self):
+        self.requests = 0
+        self.errores = 0
+        self.duracion = 0.0
+        self.buckets = [0] * len(BUCKETS_DURACION)
+        self.consultas = 0
+        self.tiempo_sql = 0.0
+        self.tiempo_lock = 0.0
+
+
+class RegistroMetricas:
+    """Acumula metricas por nombre de URL y las exporta en formato Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rutas = {}
+
+    def observar(self, url_name, duracion, medicion, status_code):
+        with self._lock:
+            acumulado = self._rutas.get(url_name)
+            if acumulado is None:
+                acumulado = self._rutas[url_name] = _AcumuladoRuta()
+            acumulado.requests += 1
+            acumulado.errores += status_code >= 500
+            acumulado.duracion += duracion
+            posicion = bisect.bisect_left(BUCKETS_DURACION, duracion)
+            if posicion < len(BUCKETS_DURACION):
+                acumulado.buckets[posicion] += 1
+            acumulado.consultas += medicion.consultas
+            acumulado.tiempo_sql += medicion.tiempo_sql
+            acumulado.tiempo_lock += medicion.tiempo_lock
+
+    def reiniciar(self):
+        with self._lock:
+            self._rutas.clear()
+
+    def exportar(self):
+        with self._lock:
+            rutas = sorted(self._rutas.items())
+            lineas = [
+                "# HELP tienda_http_request_duration_seconds Duracion de la vista por URL.",
+                "# TYPE tienda_http_request_duration_seconds histogram",
+            ]
+            for url_name, acumulado in rutas:
+                etiqueta = f'url_name="{url_name}"'
+                acumulados = 0
+                for limite, cantidad in zip(BUCKETS_DURACION, acumulado.buckets):
+                    acumulados += cantidad
+                    lineas.append(
+                        f'tienda_http_request_duration_seconds_bucket{{{etiqueta},le="{limite}"}} {acumulados}'
+                    )
+                lineas.append(f'tienda_http_request_duration_seconds_bucket{{{etiqueta},le="+Inf"}} {acumulado.requests}')
+                lineas.append(f"tienda_http_request_duration_seconds_sum{{{etiqueta}}} {acumulado.duracion:.6f}")
+                lineas.append(f"tienda_http_request_duration_seconds_count{{{etiqueta}}} {acumulado.requests}")
+
+            contadores = (
+                ("tienda_http_errors_total", "Respuestas 5xx por URL.", "errores", "{}"),
+                ("tienda_db_queries_total", "Consultas SQL por URL.", "consultas", "{}"),
+                ("tienda_db_time_seconds_total", "Tiempo en la base de datos por URL.", "tiempo_sql", "{:.6f}"),
+                (
+                    "tienda_db_lock_time_seconds_total",
+                    "Tiempo en sentencias que toman locks de fila por URL.",
+                    "tiempo_lock",
+                    "{:.6f}",
+                ),
+            )
+            for nombre, ayuda, campo, formato in contadores:
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} counter")
+                for url_name, acumulado in rutas:
+                    valor = formato.format(getattr(acumulado, campo))
+                    lineas.append(f'{nombre}{{url_name="{url_name}"}} {valor}')
+        return "\n".join(lineas) + "\n"
+
+
+registro_metricas = RegistroMetricas()
+
+
+class MetricasMiddleware:
+    """
+    Mide cada request, agrega el header `Server-Timing` y alimenta el registro
+    que expone `/metrics/`. Soporta ambos modos: bajo ASGI no obliga a correr
+    las vistas async en un hilo.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._asincrono = iscoroutinefunction(get_response)
+        if self._asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self._asincrono:
+            return self._medir_async(request)
+
+        medicion = MedicionRequest()
+        token = _medicion_actual.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        return self._registrar(request, response, medicion, inicio)
+
+    async def _medir_async(self, request):
+        medicion = MedicionRequest()
+        token = _medicion_actual.set(medicion)
+        inicio = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        return self._registrar(request, response, medicion, inicio)
+
+    @staticmethod
+    def _registrar(request, response, medicion, inicio):
+        duracion = time.perf_counter() - inicio
+        url_name = getattr(getattr(request, "resolver_match", None), "url_name", None) or "sin_ruta"
+        registro_metricas.observar(url_name, duracion, medicion, response.status_code)
+        response["Server-Timing"] = (
+            f'db;dur={medicion.tiempo_sql * 1000:.2f};desc="{medicion.consultas} consultas", '
+            f"lock;dur={medicion.tiempo_lock * 1000:.2f}, "
+            f"view;dur={duracion * 1000:.2f}"
+        )
+        return response
@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0003_ordenitem"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orden",
+            name="estado",
+            field=models.CharField(
+                choices=[
+                    ("pendiente", "Pendiente de pago"),
+                    ("confirmada", "Confirmada"),
+                    ("liberada", "Liberada"),
+                ],
+                default="confirmada",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="orden",
+            name="reservada_hasta",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="orden",
+            index=models.Index(fields=["estado", "reservada_hasta"], name="orden_reserva_idx"),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0004_orden_estado"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="libro",
+            index=models.Index(fields=["precio"], name="libro_precio_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="inventario",
+            index=models.Index(fields=["cantidad", "libro"], name="inventario_stock_idx"),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0005_indices_catalogo"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SolicitudIdempotente",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("clave", models.CharField(max_length=255, unique=True)),
+                ("huella", models.CharField(max_length=64)),
+                (
+                    "estado",
+                    models.CharField(
+                        choices=[("en_proceso", "En proceso"), ("completada", "Completada")],
+                        default="en_proceso",
+                        max_length=20,
+                    ),
+                ),
+                ("status_code", models.PositiveSmallIntegerField(blank=True, null=True)),
+                ("respuesta", models.JSONField(blank=True, null=True)),
+                ("creada", models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0006_solicitudidempotente"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="orden",
+            index=models.Index(fields=["usuario", "fecha_creacion"], name="orden_usuario_fecha_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="orden",
+            index=models.Index(fields=["fecha_creacion"], name="orden_fecha_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="ordenitem",
+            index=models.Index(fields=["libro", "orden"], name="ordenitem_libro_orden_idx"),
+        ),
+        migrations.AlterField(
+            model_name="ordenitem",
+            name="libro",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="orden_items",
+                to="tienda_app.libro",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="inventario",
+            index=models.Index(
+                condition=models.Q(("cantidad__gt", 0)),
+                fields=["libro"],
+                name="inventario_disponible_idx",
+            ),
+        ),
+    ]
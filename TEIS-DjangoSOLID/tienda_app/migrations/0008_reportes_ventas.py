@@ -0,0 +1,43 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0007_indices_ordenes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MarcaIncremental",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("nombre", models.CharField(max_length=100, unique=True)),
+                ("ultimo_id", models.BigIntegerField(default=0)),
+                ("actualizada", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="VentaDiaria",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("fecha", models.DateField()),
+                ("unidades", models.PositiveIntegerField(default=0)),
+                ("ingresos", models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                (
+                    "libro",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ventas_diarias",
+                        to="tienda_app.libro",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [models.UniqueConstraint(fields=("fecha", "libro"), name="unique_venta_por_dia")],
+                "indexes": [models.Index(fields=["libro", "fecha"], name="venta_libro_fecha_idx")],
+            },
+        ),
+    ]
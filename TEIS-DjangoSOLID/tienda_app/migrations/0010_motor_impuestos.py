@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def calcular_ingresos_con_iva(apps, schema_editor):
+    # Las ventas ya resumidas se hicieron con la tasa unica de 19%.
+    VentaDiaria = apps.get_model("tienda_app", "VentaDiaria")
+    VentaDiaria.objects.update(ingresos_con_iva=F("ingresos") * Decimal("1.19"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0009_libro_sku"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="libro",
+            name="categoria",
+            field=models.CharField(blank=True, default="", max_length=50),
+        ),
+        migrations.AddField(
+            model_name="ordenitem",
+            name="tasa_iva",
+            field=models.DecimalField(decimal_places=4, default=Decimal("0.19"), max_digits=5),
+        ),
+        migrations.AddField(
+            model_name="ventadiaria",
+            name="ingresos_con_iva",
+            field=models.DecimalField(decimal_places=6, default=0, max_digits=20),
+        ),
+        migrations.RunPython(calcular_ingresos_con_iva, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0010_motor_impuestos"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InventarioFragmento",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("indice", models.PositiveSmallIntegerField()),
+                ("cantidad", models.PositiveIntegerField(default=0)),
+                (
+                    "libro",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="fragmentos",
+                        to="tienda_app.libro",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(fields=("libro", "indice"), name="unique_fragmento_por_libro"),
+                ],
+            },
+        ),
+    ]
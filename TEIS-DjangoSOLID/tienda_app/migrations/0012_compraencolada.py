@@ -0,0 +1,63 @@
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0011_inventariofragmento"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CompraEncolada",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("token", models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ("usuario", models.CharField(default="Invitado", max_length=100)),
+                ("direccion_envio", models.CharField(default="Dirección Local", max_length=255)),
+                ("precio_unitario", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("tasa_iva", models.DecimalField(decimal_places=4, max_digits=5)),
+                ("total", models.DecimalField(decimal_places=2, max_digits=10)),
+                (
+                    "estado",
+                    models.CharField(
+                        choices=[
+                            ("pendiente", "Pendiente"),
+                            ("procesando", "Procesando"),
+                            ("confirmada", "Confirmada"),
+                            ("rechazada", "Rechazada"),
+                        ],
+                        default="pendiente",
+                        max_length=20,
+                    ),
+                ),
+                ("error", models.CharField(blank=True, default="", max_length=255)),
+                ("creada", models.DateTimeField(auto_now_add=True)),
+                ("actualizada", models.DateTimeField(auto_now=True)),
+                (
+                    "libro",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="compras_encoladas",
+                        to="tienda_app.libro",
+                    ),
+                ),
+                (
+                    "orden",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="compra_encolada",
+                        to="tienda_app.orden",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["estado", "id"], name="compra_encolada_estado_idx")],
+            },
+        ),
+    ]
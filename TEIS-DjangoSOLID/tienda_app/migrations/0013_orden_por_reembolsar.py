@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0012_compraencolada"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="orden",
+            name="estado",
+            field=models.CharField(
+                choices=[
+                    ("pendiente", "Pendiente de pago"),
+                    ("confirmada", "Confirmada"),
+                    ("liberada", "Liberada"),
+                    ("por_reembolsar", "Pagada sin stock, por reembolsar"),
+                ],
+                default="confirmada",
+                max_length=20,
+            ),
+        ),
+    ]
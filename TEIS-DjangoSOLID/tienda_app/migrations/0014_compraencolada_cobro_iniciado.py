@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0013_orden_por_reembolsar"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="compraencolada",
+            name="cobro_iniciado",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="compraencolada",
+            name="estado",
+            field=models.CharField(
+                choices=[
+                    ("pendiente", "Pendiente"),
+                    ("procesando", "Procesando"),
+                    ("confirmada", "Confirmada"),
+                    ("rechazada", "Rechazada"),
+                    ("por_verificar", "Cobro por verificar"),
+                ],
+                default="pendiente",
+                max_length=20,
+            ),
+        ),
+    ]
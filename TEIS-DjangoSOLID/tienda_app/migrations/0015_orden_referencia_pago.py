@@ -0,0 +1,25 @@
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0014_compraencolada_cobro_iniciado"),
+    ]
+
+    operations = [
+        # Sin default al agregarla: las ordenes existentes se cobraron con llaves
+        # que no se guardaron y quedan en NULL en vez de compartir un mismo UUID.
+        migrations.AddField(
+            model_name="orden",
+            name="referencia_pago",
+            field=models.UUIDField(editable=False, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="orden",
+            name="referencia_pago",
+            field=models.UUIDField(default=uuid.uuid4, editable=False, null=True, unique=True),
+        ),
+    ]
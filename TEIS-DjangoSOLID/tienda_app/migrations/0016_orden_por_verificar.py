@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0015_orden_referencia_pago"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="orden",
+            name="estado",
+            field=models.CharField(
+                choices=[
+                    ("pendiente", "Pendiente de pago"),
+                    ("confirmada", "Confirmada"),
+                    ("liberada", "Liberada"),
+                    ("por_reembolsar", "Pagada sin stock, por reembolsar"),
+                    ("por_verificar", "Cobro por verificar"),
+                ],
+                default="confirmada",
+                max_length=20,
+            ),
+        ),
+    ]
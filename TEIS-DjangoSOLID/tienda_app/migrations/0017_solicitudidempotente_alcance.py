@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0016_orden_por_verificar"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="solicitudidempotente",
+            name="cliente",
+            field=models.CharField(default="", max_length=150),
+        ),
+        migrations.AddField(
+            model_name="solicitudidempotente",
+            name="ruta",
+            field=models.CharField(default="", max_length=255),
+        ),
+        migrations.AlterField(
+            model_name="solicitudidempotente",
+            name="clave",
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddConstraint(
+            model_name="solicitudidempotente",
+            constraint=models.UniqueConstraint(
+                fields=("cliente", "ruta", "clave"),
+                name="unique_clave_por_cliente_y_ruta",
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def reconstruir_resumen_por_confirmacion(apps, schema_editor):
+    # No se sabe cuando se confirmaron las ordenes existentes: se usa su fecha de
+    # creacion. El resumen se armo con la marca por id, que no se traduce a una
+    # fecha; se borra y el proximo `refrescar_ventas` lo reconstruye completo.
+    Orden = apps.get_model("tienda_app", "Orden")
+    MarcaIncremental = apps.get_model("tienda_app", "MarcaIncremental")
+    VentaDiaria = apps.get_model("tienda_app", "VentaDiaria")
+    Orden.objects.filter(estado="confirmada").update(confirmada_en=F("fecha_creacion"))
+    MarcaIncremental.objects.filter(nombre="ventas_diarias").delete()
+    VentaDiaria.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tienda_app", "0017_solicitudidempotente_alcance"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orden",
+            name="confirmada_en",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="orden",
+            index=models.Index(fields=["confirmada_en"], name="orden_confirmada_en_idx"),
+        ),
+        migrations.AddField(
+            model_name="marcaincremental",
+            name="ultima_fecha",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(reconstruir_resumen_por_confirmacion, migrations.RunPython.noop),
+    ]
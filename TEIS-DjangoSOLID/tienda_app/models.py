@@ -1,9 +1,21 @@
+import uuid
+from decimal import Decimal
+
 from django.db import models
 
 
 class Libro(models.Model):
+    # Codigo del proveedor; clave de `importar_catalogo` para actualizar en vez de duplicar.
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     titulo = models.CharField(max_length=200)
     precio = models.DecimalField(max_digits=10, decimal_places=2)
+    # Define la tasa de IVA aplicable segun las reglas de IMPUESTOS_REGLAS.
+    categoria = models.CharField(max_length=50, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["precio"], name="libro_precio_idx"),
+        ]
 
     def __str__(self):
         return self.titulo
@@ -12,8 +24,51 @@ class Inventario(models.Model):
     libro = models.OneToOneField(Libro, on_delete=models.CASCADE)
     cantidad = models.PositiveIntegerField()
 
+    class Meta:
+        indexes = [
+            # Filtro en_stock del catalogo: cantidad > 0 y join por libro sin tocar la tabla.
+            models.Index(fields=["cantidad", "libro"], name="inventario_stock_idx"),
+            # Solo filas con existencias: es el camino de en_stock=true y de la reserva de compra.
+            models.Index(
+                fields=["libro"],
+                condition=models.Q(cantidad__gt=0),
+                name="inventario_disponible_idx",
+            ),
+        ]
+
+
+class InventarioFragmento(models.Model):
+    """
+    Parte del stock de un libro muy demandado. El stock total del libro es
+    `Inventario.cantidad` mas la suma de sus fragmentos; `rebalancear_inventario`
+    reparte el total en K fragmentos para que las compras no compitan por una fila.
+    """
+
+    # La restriccion unica (libro, indice) cubre las busquedas por libro.
+    libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name="fragmentos", db_index=False)
+    indice = models.PositiveSmallIntegerField()
+    cantidad = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["libro", "indice"], name="unique_fragmento_por_libro"),
+        ]
+
 
 class Orden(models.Model):
+    class Estado(models.TextChoices):
+        # PENDIENTE: stock reservado, pago en curso. LIBERADA: la reserva expiro
+        # y el stock se devolvio al inventario. POR_REEMBOLSAR: el pago se aprobo
+        # despues de liberar la reserva y ya no quedaba stock; el cobro se
+        # devuelve a mano. POR_VERIFICAR: no se sabe si la pasarela cobro, o
+        # cobro y la orden no se pudo confirmar; conserva su stock reservado
+        # hasta conciliarla con `referencia_pago`.
+        PENDIENTE = "pendiente", "Pendiente de pago"
+        CONFIRMADA = "confirmada", "Confirmada"
+        LIBERADA = "liberada", "Liberada"
+        POR_REEMBOLSAR = "por_reembolsar", "Pagada sin stock, por reembolsar"
+        POR_VERIFICAR = "por_verificar", "Cobro por verificar"
+
     # Campo legacy: se conserva como espejo de compatibilidad para flujos single-item.
     # El detalle canonico de productos comprados vive en Orden.items.
     libro = models.ForeignKey(
@@ -27,15 +82,136 @@ class Orden(models.Model):
     direccion_envio = models.CharField(max_length=255, default="Dirección Local")
     total = models.DecimalField(max_digits=10, decimal_places=2)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.CONFIRMADA)
+    reservada_hasta = models.DateTimeField(null=True, blank=True)
+    # Momento en que la orden paso a CONFIRMADA: es el cursor de `refrescar_ventas`,
+    # asi una orden confirmada tarde (cobro tardio, conciliacion) tambien se consolida.
+    confirmada_en = models.DateTimeField(null=True, blank=True)
+    # Referencia del cobro en la pasarela (Idempotency-Key): los reintentos y la
+    # conciliacion usan la misma. Las ordenes anteriores a este campo quedan en NULL.
+    referencia_pago = models.UUIDField(default=uuid.uuid4, unique=True, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["estado", "reservada_hasta"], name="orden_reserva_idx"),
+            models.Index(fields=["usuario", "fecha_creacion"], name="orden_usuario_fecha_idx"),
+            models.Index(fields=["fecha_creacion"], name="orden_fecha_idx"),
+            models.Index(fields=["confirmada_en"], name="orden_confirmada_en_idx"),
+        ]
 
 
 class OrdenItem(models.Model):
     orden = models.ForeignKey(Orden, on_delete=models.CASCADE, related_name="items")
-    libro = models.ForeignKey(Libro, on_delete=models.PROTECT, related_name="orden_items")
+    # El indice compuesto (libro, orden) cubre las busquedas por libro.
+    libro = models.ForeignKey(Libro, on_delete=models.PROTECT, related_name="orden_items", db_index=False)
     cantidad = models.PositiveIntegerField()
     precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
+    # Tasa de IVA resuelta al comprar (0.19 = 19%); no cambia si luego cambian las reglas.
+    tasa_iva = models.DecimalField(max_digits=5, decimal_places=4, default=Decimal("0.19"))
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=["orden", "libro"], name="unique_libro_por_orden"),
         ]
+        indexes = [
+            models.Index(fields=["libro", "orden"], name="ordenitem_libro_orden_idx"),
+        ]
+
+
+class CompraEncolada(models.Model):
+    """
+    Compra rapida aceptada con su unidad de stock ya reservada. El cobro y la
+    Orden quedan para `manage.py procesar_compras`, que las procesa en lotes.
+    """
+
+    class Estado(models.TextChoices):
+        PENDIENTE = "pendiente", "Pendiente"
+        PROCESANDO = "procesando", "Procesando"
+        CONFIRMADA = "confirmada", "Confirmada"
+        RECHAZADA = "rechazada", "Rechazada"
+        # Volvio a la cola despues de llamar a la pasarela, o la pasarela fallo
+        # sin responder: puede estar cobrada, asi que no se cobra de nuevo ni se
+        # devuelve el stock sin revisarla.
+        POR_VERIFICAR = "por_verificar", "Cobro por verificar"
+
+    # Identificador publico de la URL de estado; el id secuencial no se expone.
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    libro = models.ForeignKey(Libro, on_delete=models.PROTECT, related_name="compras_encoladas")
+    usuario = models.CharField(max_length=100, default="Invitado")
+    direccion_envio = models.CharField(max_length=255, default="Dirección Local")
+    # Precio e IVA se fijan al aceptar la compra, no al procesarla.
+    precio_unitario = models.DecimalField(max_digits=10, decimal_places=2)
+    tasa_iva = models.DecimalField(max_digits=5, decimal_places=4)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.PENDIENTE)
+    orden = models.OneToOneField(
+        Orden,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="compra_encolada",
+    )
+    error = models.CharField(max_length=255, blank=True, default="")
+    # Se marca antes de llamar a la pasarela, asi un reintento sabe que ya hubo un intento de cobro.
+    cobro_iniciado = models.DateTimeField(null=True, blank=True)
+    creada = models.DateTimeField(auto_now_add=True)
+    actualizada = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # El worker toma las pendientes en orden de llegada.
+            models.Index(fields=["estado", "id"], name="compra_encolada_estado_idx"),
+        ]
+
+
+class SolicitudIdempotente(models.Model):
+    """
+    Primera respuesta de una compra enviada con el header Idempotency-Key. La
+    clave es unica por cliente (usuario o IP) y ruta, no en toda la tabla.
+    """
+
+    class Estado(models.TextChoices):
+        EN_PROCESO = "en_proceso", "En proceso"
+        COMPLETADA = "completada", "Completada"
+
+    cliente = models.CharField(max_length=150, default="")
+    ruta = models.CharField(max_length=255, default="")
+    clave = models.CharField(max_length=255)
+    huella = models.CharField(max_length=64)
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.EN_PROCESO)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    respuesta = models.JSONField(null=True, blank=True)
+    creada = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cliente", "ruta", "clave"], name="unique_clave_por_cliente_y_ruta"),
+        ]
+
+
+class MarcaIncremental(models.Model):
+    """Ultimo id o fecha procesada por un proceso incremental (resumenes, exportaciones)."""
+
+    nombre = models.CharField(max_length=100, unique=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    ultima_fecha = models.DateTimeField(null=True, blank=True)
+    actualizada = models.DateTimeField(auto_now=True)
+
+
+class VentaDiaria(models.Model):
+    """Resumen de ventas confirmadas por dia y libro, refrescado con `refrescar_ventas`."""
+
+    fecha = models.DateField()
+    libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name="ventas_diarias", db_index=False)
+    unidades = models.PositiveIntegerField(default=0)
+    ingresos = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Sin redondear: el redondeo a centavos se hace al reportar, sobre el total agregado.
+    ingresos_con_iva = models.DecimalField(max_digits=20, decimal_places=6, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["fecha", "libro"], name="unique_venta_por_dia"),
+        ]
+        indexes = [
+            models.Index(fields=["libro", "fecha"], name="venta_libro_fecha_idx"),
+        ]
@@ -0,0 +1,204 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Libro, MarcaIncremental, Orden, OrdenItem, VentaDiaria
+
+_CENTAVO = Decimal("0.01")
+FUENTE_RESUMEN = "resumen"
+FUENTE_VIVO = "vivo"
+MARCA_VENTAS = "ventas_diarias"
+
+
+def _ingresos():
+    return Sum(
+        F("cantidad") * F("precio_unitario"),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+
+
+def _ingresos_con_iva():
+    # Exacto con la tasa guardada en cada item; se redondea a centavos al reportar.
+    return Sum(
+        F("cantidad") * F("precio_unitario") * (1 + F("tasa_iva")),
+        output_field=DecimalField(max_digits=20, decimal_places=6),
+    )
+
+
+def _items_confirmados():
+    return OrdenItem.objects.filter(orden__estado=Orden.Estado.CONFIRMADA)
+
+
+def inicio_del_dia(fecha):
+    return datetime.combine(fecha, time.min, tzinfo=timezone.get_current_timezone())
+
+
+def _tope_refresco(ahora):
+    """
+    Ultimo `Orden.confirmada_en` que se puede consolidar sin dejar huecos: las
+    confirmaciones mas recientes que el margen podrian estar en transacciones
+    que aun no hicieron commit.
+    """
+    return ahora - timedelta(seconds=settings.REPORTES_VENTAS_MARGEN_SEGUNDOS)
+
+
+def _confirmados_despues_de(items, marca):
+    if marca is None:
+        return items
+    # Una orden confirmada sin `confirmada_en` (p. ej. conciliada a mano sin
+    # fijarlo) nunca entra al resumen: se sigue sumando en vivo.
+    return items.filter(Q(orden__confirmada_en__gt=marca) | Q(orden__confirmada_en__isnull=True))
+
+
+def _acumular_resumen(filas):
+    claves = {(fila["fecha"], fila["libro_id"]) for fila in filas}
+    existentes = {
+        (venta.fecha, venta.libro_id): venta
+        for venta in VentaDiaria.objects.filter(
+            fecha__in={fecha for fecha, _ in claves},
+            libro_id__in={libro_id for _, libro_id in claves},
+        )
+    }
+    nuevas, actualizadas = [], []
+    for fila in filas:
+        venta = existentes.get((fila["fecha"], fila["libro_id"]))
+        if venta is None:
+            nuevas.append(
+                VentaDiaria(
+                    fecha=fila["fecha"],
+                    libro_id=fila["libro_id"],
+                    unidades=fila["unidades"],
+                    ingresos=fila["ingresos"],
+                    ingresos_con_iva=fila["ingresos_con_iva"],
+                )
+            )
+        else:
+            venta.unidades += fila["unidades"]
+            venta.ingresos += fila["ingresos"]
+            venta.ingresos_con_iva += fila["ingresos_con_iva"]
+            actualizadas.append(venta)
+
+    VentaDiaria.objects.bulk_create(nuevas)
+    VentaDiaria.objects.bulk_update(actualizadas, ["unidades", "ingresos", "ingresos_con_iva"])
+
+
+def refrescar_ventas_diarias(ahora=None, lote=50000):
+    """
+    Consolida en VentaDiaria los OrdenItem de ordenes confirmadas despues de la
+    marca, en ventanas de unos `lote` items por `confirmada_en` con una
+    transaccion corta por ventana. La venta cuenta en el dia de la orden aunque
+    se haya confirmado despues. Retorna la cantidad de items consolidados.
+    """
+    tope = _tope_refresco(ahora or timezone.now())
+    procesados = 0
+    while True:
+        with transaction.atomic():
+            marca, _ = MarcaIncremental.objects.select_for_update().get_or_create(nombre=MARCA_VENTAS)
+            if marca.ultima_fecha is not None and marca.ultima_fecha >= tope:
+                return procesados
+
+            pendientes = _confirmados_despues_de(
+                _items_confirmados().filter(orden__confirmada_en__lte=tope),
+                marca.ultima_fecha,
+            )
+            # La ventana cierra en la confirmacion del item numero `lote`; los
+            # items confirmados en ese mismo instante entran todos juntos.
+            cierre = list(
+                pendientes
+                .order_by("orden__confirmada_en")
+                .values_list("orden__confirmada_en", flat=True)[lote - 1:lote]
+            )
+            hasta = cierre[0] if cierre else tope
+            filas = list(
+                pendientes
+                .filter(orden__confirmada_en__lte=hasta)
+                .annotate(fecha=TruncDate("orden__fecha_creacion"))
+                .values("fecha", "libro_id")
+                .annotate(
+                    unidades=Sum("cantidad"),
+                    ingresos=_ingresos(),
+                    ingresos_con_iva=_ingresos_con_iva(),
+                    items=Count("id"),
+                )
+            )
+            _acumular_resumen(filas)
+            marca.ultima_fecha = hasta
+            marca.save(update_fields=["ultima_fecha", "actualizada"])
+            procesados += sum(fila["items"] for fila in filas)
+        if not cierre:
+            return procesados
+
+
+def _sumar(filas, clave, acumulado):
+    for fila in filas:
+        total = acumulado.setdefault(
+            fila[clave],
+            {"unidades": 0, "ingresos": Decimal("0.00"), "ingresos_con_iva": Decimal("0")},
+        )
+        total["unidades"] += fila["unidades"]
+        total["ingresos"] += fila["ingresos"]
+        total["ingresos_con_iva"] += fila["ingresos_con_iva"]
+
+
+def _montos(total):
+    return {
+        "unidades": total["unidades"],
+        "ingresos": str(total["ingresos"].quantize(_CENTAVO)),
+        "ingresos_con_iva": str(total["ingresos_con_iva"].quantize(_CENTAVO)),
+    }
+
+
+def reporte_ventas(desde=None, hasta=None, libro_id=None, fuente=FUENTE_RESUMEN):
+    """
+    Unidades e ingresos confirmados por libro y por dia, agregados en la base.
+    Con fuente="resumen" se suma VentaDiaria hasta la marca y solo los items
+    posteriores se agregan en vivo; con fuente="vivo" se agrega todo OrdenItem.
+    """
+    items = _items_confirmados()
+    resumen = VentaDiaria.objects.all()
+    if desde:
+        items = items.filter(orden__fecha_creacion__gte=inicio_del_dia(desde))
+        resumen = resumen.filter(fecha__gte=desde)
+    if hasta:
+        items = items.filter(orden__fecha_creacion__lt=inicio_del_dia(hasta + timedelta(days=1)))
+        resumen = resumen.filter(fecha__lte=hasta)
+    if libro_id:
+        items = items.filter(libro_id=libro_id)
+        resumen = resumen.filter(libro_id=libro_id)
+
+    por_libro, por_dia = {}, {}
+    if fuente == FUENTE_RESUMEN:
+        marca = MarcaIncremental.objects.filter(nombre=MARCA_VENTAS).values_list("ultima_fecha", flat=True).first()
+        items = _confirmados_despues_de(items, marca)
+        totales_resumen = {
+            "unidades": Sum("unidades"),
+            "ingresos": Sum("ingresos"),
+            "ingresos_con_iva": Sum("ingresos_con_iva"),
+        }
+        _sumar(resumen.values("libro_id").annotate(**totales_resumen), "libro_id", por_libro)
+        _sumar(resumen.values("fecha").annotate(**totales_resumen), "fecha", por_dia)
+
+    items = items.annotate(fecha=TruncDate("orden__fecha_creacion"))
+    totales_items = {"unidades": Sum("cantidad"), "ingresos": _ingresos(), "ingresos_con_iva": _ingresos_con_iva()}
+    _sumar(items.values("libro_id").annotate(**totales_items), "libro_id", por_libro)
+    _sumar(items.values("fecha").annotate(**totales_items), "fecha", por_dia)
+
+    titulos = dict(Libro.objects.filter(id__in=por_libro).values_list("id", "titulo")) if por_libro else {}
+    general = {"unidades": 0, "ingresos": Decimal("0.00"), "ingresos_con_iva": Decimal("0")}
+    for total in por_libro.values():
+        for campo in general:
+            general[campo] += total[campo]
+    return {
+        "fuente": fuente,
+        "por_libro": [
+            {"libro_id": libro, "titulo": titulos.get(libro, ""), **_montos(total)}
+            for libro, total in sorted(por_libro.items(), key=lambda par: (-par[1]["ingresos"], par[0]))
+        ],
+        "por_dia": [{"fecha": fecha.isoformat(), **_montos(total)} for fecha, total in sorted(por_dia.items())],
+        "total": _montos(general),
+    }
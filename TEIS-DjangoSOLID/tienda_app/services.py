@@ -1,10 +1,22 @@
+import asyncio
+import logging
 from collections import Counter
+from datetime import timedelta
 
-from django.db import transaction
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Sum, When
+from django.utils import timezone
 
+from .catalogo import marcar_stock_modificado
 from .domain.builders import OrdenBuilder
-from .domain.logic import CalculadorImpuestos
-from .models import Inventario, Libro, Orden, OrdenItem
+from .domain.interfaces import PagoIndeterminado
+from .domain.logic import motor_impuestos
+from .fragmentos import descontar_fragmentos
+from .models import CompraEncolada, Inventario, Libro, Orden, OrdenItem
+
+logger = logging.getLogger(__name__)
 
 
 def _crear_items_orden(orden, conteo_por_libro, libros_por_id):
@@ -14,46 +26,460 @@ def _crear_items_orden(orden, conteo_por_libro, libros_por_id):
             libro=libros_por_id[libro_id],
             cantidad=cantidad,
             precio_unitario=libros_por_id[libro_id].precio,
+            tasa_iva=motor_impuestos.tasa_libro(libros_por_id[libro_id]),
         )
         for libro_id, cantidad in conteo_por_libro.items()
     ]
     OrdenItem.objects.bulk_create(items)
 
 
+def _ajuste_por_libro(conteo_por_libro, signo):
+    return Case(
+        *(
+            When(libro_id=libro_id, then=F("cantidad") + signo * cantidad)
+            for libro_id, cantidad in conteo_por_libro.items()
+        ),
+        default=F("cantidad"),
+        output_field=models.PositiveIntegerField(),
+    )
+
+
+def _con_existencias(conteo_por_libro):
+    condicion = Q()
+    for libro_id, cantidad in conteo_por_libro.items():
+        condicion |= Q(libro_id=libro_id, cantidad__gte=cantidad)
+    return condicion
+
+
+def _descontar_inventario(conteo_por_libro):
+    # Un solo UPDATE ... CASE para todo el carrito: el tiempo con los locks
+    # tomados no crece con la cantidad de libros distintos.
+    if not conteo_por_libro:
+        return
+    actualizados = (
+        Inventario.objects
+        .filter(_con_existencias(conteo_por_libro))
+        .update(cantidad=_ajuste_por_libro(conteo_por_libro, -1))
+    )
+    if actualizados != len(conteo_por_libro):
+        raise ValueError("No hay existencias suficientes para completar la compra.")
+    marcar_stock_modificado()
+
+
+def _reservar_en_fragmentos(libro_id, cantidad):
+    if not descontar_fragmentos(libro_id, cantidad):
+        return False
+    marcar_stock_modificado()
+    return True
+
+
+def _reservar_sin_fila_principal(libro_id):
+    # La fila de Inventario no tiene stock: el libro puede estar fragmentado.
+    if _reservar_en_fragmentos(libro_id, 1):
+        return Libro.objects.get(id=libro_id)
+    if not Inventario.objects.filter(libro_id=libro_id).exists():
+        raise Inventario.DoesNotExist("Inventario matching query does not exist.")
+    raise ValueError("No hay existencias.")
+
+
+def _reponer_inventario(conteo_por_libro):
+    # Lo devuelto vuelve a la fila principal, tambien en libros fragmentados;
+    # `rebalancear_inventario` lo redistribuye.
+    if not conteo_por_libro:
+        return
+    (
+        Inventario.objects
+        .filter(libro_id__in=conteo_por_libro.keys())
+        .update(cantidad=_ajuste_por_libro(conteo_por_libro, 1))
+    )
+    marcar_stock_modificado()
+
+
+def _vencimiento_reserva():
+    return timezone.now() + timedelta(seconds=settings.RESERVA_ORDEN_TTL_SEGUNDOS)
+
+
+def _confirmar_orden(orden, conteo_por_libro):
+    confirmada_en = timezone.now()
+    with transaction.atomic():
+        confirmadas = (
+            Orden.objects
+            .filter(pk=orden.pk, estado=Orden.Estado.PENDIENTE)
+            .update(estado=Orden.Estado.CONFIRMADA, reservada_hasta=None, confirmada_en=confirmada_en)
+        )
+        estado = Orden.Estado.CONFIRMADA
+        if not confirmadas:
+            # El barrido libero la reserva mientras se cobraba: el pago ya se hizo,
+            # asi que se intenta retomar el stock antes de rendirse.
+            try:
+                with transaction.atomic():
+                    _descontar_inventario(conteo_por_libro)
+            except ValueError:
+                # Se agoto mientras tanto: la orden queda como constancia del cobro.
+                estado = Orden.Estado.POR_REEMBOLSAR
+                confirmada_en = None
+            Orden.objects.filter(pk=orden.pk).update(estado=estado, reservada_hasta=None, confirmada_en=confirmada_en)
+    orden.estado = estado
+    orden.reservada_hasta = None
+    orden.confirmada_en = confirmada_en
+
+    if estado == Orden.Estado.POR_REEMBOLSAR:
+        logger.error("Orden %s cobrada por %s sin stock para confirmarla: queda por reembolsar.", orden.pk, orden.total)
+        raise ValueError(
+            f"Se agotaron las existencias mientras se procesaba el pago; "
+            f"el cobro de ${orden.total} de la orden {orden.pk} sera reembolsado."
+        )
+
+
+def _liberar_orden(orden, conteo_por_libro):
+    with transaction.atomic():
+        # Solo quien gana la transicion PENDIENTE -> LIBERADA devuelve el stock,
+        # asi el barrido y el flujo de pago nunca lo reponen dos veces.
+        liberadas = (
+            Orden.objects
+            .filter(pk=orden.pk, estado=Orden.Estado.PENDIENTE)
+            .update(estado=Orden.Estado.LIBERADA, reservada_hasta=None)
+        )
+        if liberadas:
+            _reponer_inventario(conteo_por_libro)
+        Orden.objects.filter(pk=orden.pk).delete()
+
+
+def _referencia_pago(orden):
+    return str(orden.referencia_pago) if orden.referencia_pago else None
+
+
+def _marcar_por_verificar(orden, motivo):
+    # La orden no se borra ni devuelve su stock: queda como constancia del cobro
+    # para conciliarla con la pasarela. Se registra antes de tocar la base por
+    # si la falla es justamente de la base.
+    logger.error(
+        "Orden %s (referencia %s) por %s queda por verificar: %s.",
+        orden.pk,
+        orden.referencia_pago,
+        orden.total,
+        motivo,
+    )
+    try:
+        marcadas = (
+            Orden.objects
+            .filter(pk=orden.pk, estado=Orden.Estado.PENDIENTE)
+            .update(estado=Orden.Estado.POR_VERIFICAR, reservada_hasta=None)
+        )
+    except Exception:
+        logger.exception("No se pudo marcar la orden %s por verificar.", orden.pk)
+        return
+    if marcadas:
+        orden.estado = Orden.Estado.POR_VERIFICAR
+        orden.reservada_hasta = None
+
+
+def _cobro_indeterminado(orden, exc):
+    """Deja la orden por verificar y retorna el PagoIndeterminado a lanzar."""
+    _marcar_por_verificar(orden, f"la pasarela no confirmo el cobro ({exc})")
+    return PagoIndeterminado(f"No se pudo confirmar el cobro de la orden {orden.pk}; queda por verificar.")
+
+
+def _confirmar_orden_pagada(orden, conteo_por_libro):
+    try:
+        _confirmar_orden(orden, conteo_por_libro)
+    except ValueError:
+        raise
+    except Exception as exc:
+        # Cobrada pero sin confirmar: si quedara PENDIENTE el barrido devolveria su stock.
+        _marcar_por_verificar(orden, f"el cobro se aprobo pero la orden no se pudo confirmar ({exc})")
+        raise
+
+
+def _pagar_y_cerrar(procesador_pago, orden, conteo_por_libro):
+    # Fase 2: el cobro ocurre sin transaccion abierta ni locks de inventario.
+    # Solo un rechazo explicito (False) libera la reserva; si la pasarela falla
+    # el cobro pudo hacerse y la orden queda por verificar.
+    try:
+        pagado = procesador_pago.pagar(orden.total, conteo_por_libro, _referencia_pago(orden))
+    except Exception as exc:
+        raise _cobro_indeterminado(orden, exc) from exc
+
+    # Fase 3: transaccion corta para confirmar o liberar la reserva.
+    if pagado:
+        _confirmar_orden_pagada(orden, conteo_por_libro)
+        return True
+
+    _liberar_orden(orden, conteo_por_libro)
+    return False
+
+
+async def _apagar(procesador_pago, monto, productos, referencia):
+    # Los procesadores fuera de la jerarquia de ProcesadorPago (dobles de test,
+    # registros propios) quiza solo implementan `pagar`.
+    apagar = getattr(procesador_pago, "apagar", None)
+    if apagar is None:
+        return await asyncio.to_thread(procesador_pago.pagar, monto, productos, referencia)
+    return await apagar(monto, productos, referencia)
+
+
+async def _apagar_y_cerrar(procesador_pago, orden, conteo_por_libro):
+    """Version async de `_pagar_y_cerrar`."""
+    try:
+        pagado = await _apagar(procesador_pago, orden.total, conteo_por_libro, _referencia_pago(orden))
+    except Exception as exc:
+        raise await sync_to_async(_cobro_indeterminado)(orden, exc) from exc
+
+    if pagado:
+        await sync_to_async(_confirmar_orden_pagada)(orden, conteo_por_libro)
+        return True
+
+    await sync_to_async(_liberar_orden)(orden, conteo_por_libro)
+    return False
+
+
+def liberar_reservas_expiradas(ahora=None, limite=500):
+    """
+    Devuelve al inventario el stock de las ordenes PENDIENTES cuya reserva vencio.
+    Retorna la cantidad de ordenes liberadas.
+    """
+    ahora = ahora or timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Orden.objects
+            .select_for_update(skip_locked=True)
+            .filter(estado=Orden.Estado.PENDIENTE, reservada_hasta__lt=ahora)
+            .order_by("reservada_hasta")
+            .values_list("id", flat=True)[:limite]
+        )
+        if not ids:
+            return 0
+
+        Orden.objects.filter(id__in=ids).update(estado=Orden.Estado.LIBERADA, reservada_hasta=None)
+        cantidades = (
+            OrdenItem.objects
+            .filter(orden_id__in=ids)
+            .values("libro_id")
+            .annotate(total=Sum("cantidad"))
+        )
+        _reponer_inventario({fila["libro_id"]: fila["total"] for fila in cantidades})
+        return len(ids)
+
+
+def _reservar_unidad(libro_id):
+    """
+    Reserva una unidad con un UPDATE condicional, sin select_for_update, y
+    retorna el Libro. Si la fila principal no tiene stock prueba los fragmentos.
+    """
+    reservado = (
+        Inventario.objects
+        .filter(libro_id=libro_id, cantidad__gt=0)
+        .update(cantidad=F("cantidad") - 1)
+    )
+    if reservado:
+        marcar_stock_modificado()
+        return Libro.objects.get(id=libro_id)
+    return _reservar_sin_fila_principal(libro_id)
+
+
+def encolar_compra_rapida(libro_id, usuario="Invitado", direccion="Dirección Local"):
+    """
+    Reserva una unidad del libro y encola la compra en una transaccion corta.
+    El cobro y la Orden quedan para `procesar_compras_encoladas`.
+    """
+    with transaction.atomic():
+        libro = _reservar_unidad(libro_id)
+        return CompraEncolada.objects.create(
+            libro=libro,
+            usuario=usuario,
+            direccion_envio=direccion,
+            precio_unitario=libro.precio,
+            tasa_iva=motor_impuestos.tasa_libro(libro),
+            total=motor_impuestos.total_libro(libro),
+        )
+
+
+def _tomar_compras_encoladas(lote, ahora):
+    # Las compras que otro worker tomo y no cerro a tiempo vuelven a la cola.
+    vencidas = ahora - timedelta(seconds=settings.COLA_COMPRAS_REINTENTO_SEGUNDOS)
+    with transaction.atomic():
+        compras = list(
+            CompraEncolada.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(estado=CompraEncolada.Estado.PENDIENTE)
+                | Q(estado=CompraEncolada.Estado.PROCESANDO, actualizada__lt=vencidas)
+            )
+            .order_by("id")[:lote]
+        )
+        if compras:
+            CompraEncolada.objects.filter(id__in=[compra.id for compra in compras]).update(
+                estado=CompraEncolada.Estado.PROCESANDO,
+                actualizada=ahora,
+            )
+    return compras
+
+
+def procesar_compras_encoladas(procesador_pago, lote=100, ahora=None):
+    """
+    Cobra hasta `lote` compras encoladas y crea sus ordenes confirmadas con un
+    `bulk_create` de Orden y otro de OrdenItem. Las rechazadas devuelven el stock.
+    Las que vuelven a la cola con un cobro ya iniciado no se cobran de nuevo, y
+    las que la pasarela no aprueba ni rechaza (excepcion) pudieron cobrarse:
+    ambas quedan POR_VERIFICAR con su stock reservado.
+    Retorna `{"confirmadas": int, "rechazadas": int, "por_verificar": int}`.
+    """
+    ahora = ahora or timezone.now()
+    compras = _tomar_compras_encoladas(lote, ahora)
+    if not compras:
+        return {"confirmadas": 0, "rechazadas": 0, "por_verificar": 0}
+
+    # Un worker anterior ya llamo a la pasarela por estas: cobrarlas otra vez
+    # podria duplicar el cargo. Se suman las que la pasarela deja sin respuesta.
+    sin_confirmar = {compra.id for compra in compras if compra.cobro_iniciado}
+    a_cobrar = [compra for compra in compras if compra.id not in sin_confirmar]
+    if a_cobrar:
+        CompraEncolada.objects.filter(id__in=[compra.id for compra in a_cobrar]).update(
+            cobro_iniciado=timezone.now(),
+        )
+
+    # El cobro ocurre fuera de toda transaccion, como en la reserva de dos fases.
+    errores = {}
+    for compra in a_cobrar:
+        try:
+            if not procesador_pago.pagar(compra.total, {compra.libro_id: 1}, str(compra.token)):
+                errores[compra.id] = "Pago rechazado."
+        except Exception as exc:
+            logger.error("Compra encolada %s: la pasarela no confirmo el cobro (%s).", compra.token, exc)
+            sin_confirmar.add(compra.id)
+
+    with transaction.atomic():
+        # Solo se cierran las compras que siguen tomadas por este worker.
+        vigentes = set(
+            CompraEncolada.objects
+            .select_for_update()
+            .filter(
+                id__in=[compra.id for compra in compras],
+                estado=CompraEncolada.Estado.PROCESANDO,
+                actualizada=ahora,
+            )
+            .values_list("id", flat=True)
+        )
+        for compra in a_cobrar:
+            if compra.id not in vigentes and compra.id not in errores:
+                logger.error(
+                    "Compra encolada %s cobrada por %s pero tomada por otro worker: conciliar a mano.",
+                    compra.token,
+                    compra.total,
+                )
+        compras = [compra for compra in compras if compra.id in vigentes]
+        por_verificar = [compra for compra in compras if compra.id in sin_confirmar]
+        pagadas = [compra for compra in compras if compra.id not in sin_confirmar and compra.id not in errores]
+        rechazadas = [compra for compra in compras if compra.id in errores]
+
+        cerrada = timezone.now()
+        ordenes = Orden.objects.bulk_create(
+            [
+                Orden(
+                    libro_id=compra.libro_id,
+                    usuario=compra.usuario,
+                    direccion_envio=compra.direccion_envio,
+                    total=compra.total,
+                    estado=Orden.Estado.CONFIRMADA,
+                    confirmada_en=cerrada,
+                )
+                for compra in pagadas
+            ]
+        )
+        OrdenItem.objects.bulk_create(
+            [
+                OrdenItem(
+                    orden=orden,
+                    libro_id=compra.libro_id,
+                    cantidad=1,
+                    precio_unitario=compra.precio_unitario,
+                    tasa_iva=compra.tasa_iva,
+                )
+                for compra, orden in zip(pagadas, ordenes)
+            ]
+        )
+
+        for compra, orden in zip(pagadas, ordenes):
+            compra.estado, compra.orden, compra.actualizada = CompraEncolada.Estado.CONFIRMADA, orden, cerrada
+        for compra in rechazadas:
+            compra.estado, compra.error, compra.actualizada = CompraEncolada.Estado.RECHAZADA, errores[compra.id], cerrada
+        for compra in por_verificar:
+            logger.error("Compra encolada %s con un cobro sin confirmar: queda por verificar.", compra.token)
+            compra.estado, compra.error, compra.actualizada = (
+                CompraEncolada.Estado.POR_VERIFICAR,
+                "Cobro sin confirmar: verificar con la pasarela.",
+                cerrada,
+            )
+        CompraEncolada.objects.bulk_update(compras, ["estado", "orden", "error", "actualizada"])
+        _reponer_inventario(Counter(compra.libro_id for compra in rechazadas))
+
+    return {"confirmadas": len(pagadas), "rechazadas": len(rechazadas), "por_verificar": len(por_verificar)}
+
+
 class CompraRapidaService:
-    def __init__(self, procesador_pago):
+    # Estrategias de reserva de stock, seleccionables por instancia.
+    BLOQUEO_PESIMISTA = "pesimista"
+    RESERVA_OPTIMISTA = "optimista"
+
+    def __init__(self, procesador_pago, estrategia=BLOQUEO_PESIMISTA):
+        if estrategia not in (self.BLOQUEO_PESIMISTA, self.RESERVA_OPTIMISTA):
+            raise ValueError(f"Estrategia de reserva desconocida: {estrategia}")
         self.procesador_pago = procesador_pago
+        self.estrategia = estrategia
 
     def procesar(self, libro_id):
+        if self.estrategia == self.RESERVA_OPTIMISTA:
+            orden = self._reservar_optimista(libro_id)
+        else:
+            orden = self._reservar_pesimista(libro_id)
+
+        if _pagar_y_cerrar(self.procesador_pago, orden, {libro_id: 1}):
+            return orden.total
+        return None
+
+    @staticmethod
+    def _crear_orden_pendiente(libro):
+        total = motor_impuestos.total_libro(libro)
+        orden = Orden.objects.create(
+            libro=libro,
+            total=total,
+            estado=Orden.Estado.PENDIENTE,
+            reservada_hasta=_vencimiento_reserva(),
+        )
+        _crear_items_orden(orden, {libro.id: 1}, {libro.id: libro})
+        return orden
+
+    def _reservar_pesimista(self, libro_id):
         with transaction.atomic():
+            # Solo se bloquea la fila principal si tiene stock; la de un libro
+            # fragmentado queda en 0 y las compras bloquean sus fragmentos.
             inv = (
                 Inventario.objects
                 .select_for_update()
                 .select_related("libro")
-                .get(libro_id=libro_id)
+                .filter(libro_id=libro_id, cantidad__gt=0)
+                .first()
             )
-            libro = inv.libro
+            if inv is None:
+                return self._crear_orden_pendiente(_reservar_sin_fila_principal(libro_id))
 
-            if inv.cantidad <= 0:
-                raise ValueError("No hay existencias.")
+            inv.cantidad -= 1
+            inv.save(update_fields=["cantidad"])
+            return self._crear_orden_pendiente(inv.libro)
 
-            total = CalculadorImpuestos.obtener_total_con_iva(libro.precio)
-            orden = Orden.objects.create(libro=libro, total=total)
-            _crear_items_orden(orden, {libro.id: 1}, {libro.id: libro})
-
-            if self.procesador_pago.pagar(total):
-                inv.cantidad -= 1
-                inv.save(update_fields=["cantidad"])
-                return total
-
-            orden.delete()
-            return None
+    def _reservar_optimista(self, libro_id):
+        # Sin select_for_update: el UPDATE condicional reserva la unidad y
+        # libera el lock de la fila al confirmar la transaccion corta.
+        with transaction.atomic():
+            return self._crear_orden_pendiente(_reservar_unidad(libro_id))
 
 
 class CompraService:
     def __init__(self, procesador_pago):
         self.procesador = procesador_pago
         self.builder = OrdenBuilder()
+        # Ultima orden procesada; la API la usa para armar la URL de estado.
+        self.ultima_orden = None
 
     @staticmethod
     def _contar_productos(lista_productos):
@@ -61,36 +487,49 @@ class CompraService:
 
     @staticmethod
     def _obtener_inventarios_bloqueados(conteo_por_libro):
+        """
+        Bloquea las filas de Inventario que alcanzan para su cantidad y retorna
+        `{libro_id: inventario}`. Los demas libros (sin stock en la fila principal
+        o fragmentados) se reservan en sus fragmentos y se retornan aparte como
+        `{libro_id: libro}`.
+        """
         inventarios = (
             Inventario.objects
             .select_for_update()
             .select_related("libro")
-            .filter(libro_id__in=conteo_por_libro.keys())
+            .filter(_con_existencias(conteo_por_libro))
         )
         inventarios_por_libro = {inventario.libro_id: inventario for inventario in inventarios}
 
         faltantes = [libro_id for libro_id in conteo_por_libro if libro_id not in inventarios_por_libro]
-        if faltantes:
+        if not faltantes:
+            return inventarios_por_libro, {}
+
+        sin_fila_principal = {
+            inventario.libro_id: inventario.libro
+            for inventario in Inventario.objects.select_related("libro").filter(libro_id__in=faltantes)
+        }
+        if len(sin_fila_principal) != len(faltantes):
             raise ValueError("No hay inventario configurado para uno o más libros.")
 
-        for libro_id, cantidad_requerida in conteo_por_libro.items():
-            inventario = inventarios_por_libro[libro_id]
-            if inventario.cantidad < cantidad_requerida:
-                raise ValueError(f"No hay existencias para '{inventario.libro.titulo}'.")
+        for libro_id in sorted(faltantes):
+            if not _reservar_en_fragmentos(libro_id, conteo_por_libro[libro_id]):
+                raise ValueError(f"No hay existencias para '{sin_fila_principal[libro_id].titulo}'.")
 
-        return inventarios_por_libro
+        return inventarios_por_libro, sin_fila_principal
 
-    def ejecutar_proceso_compra(self, usuario, lista_productos, direccion):
+    def _reservar_orden(self, usuario, lista_productos, direccion):
         if not lista_productos:
             raise ValueError("Debe incluir al menos un producto para comprar.")
 
+        conteo_por_libro = self._contar_productos(lista_productos)
+
+        # Fase 1: transaccion corta que reserva el stock y crea la orden PENDIENTE.
         with transaction.atomic():
-            conteo_por_libro = self._contar_productos(lista_productos)
-            inventarios_por_libro = self._obtener_inventarios_bloqueados(conteo_por_libro)
-            libros_por_id = {
-                libro_id: inventario.libro
-                for libro_id, inventario in inventarios_por_libro.items()
-            }
+            inventarios_por_libro, libros_por_id = self._obtener_inventarios_bloqueados(conteo_por_libro)
+            libros_por_id.update(
+                (libro_id, inventario.libro) for libro_id, inventario in inventarios_por_libro.items()
+            )
 
             # Uso del Builder: Semantica clara y validacion interna
             orden = (
@@ -98,18 +537,34 @@ class CompraService:
                 .con_usuario(usuario)
                 .con_productos(lista_productos)
                 .para_envio(direccion)
+                .con_reserva(_vencimiento_reserva())
                 .build()
             )
             _crear_items_orden(orden, conteo_por_libro, libros_por_id)
+            _descontar_inventario({libro_id: conteo_por_libro[libro_id] for libro_id in inventarios_por_libro})
+        return orden, conteo_por_libro
+
+    def ejecutar_proceso_compra(self, usuario, lista_productos, direccion):
+        orden, conteo_por_libro = self._reservar_orden(usuario, lista_productos, direccion)
+
+        # Uso del Factory (inyectado): Cambio de comportamiento sin cambio de codigo
+        if not _pagar_y_cerrar(self.procesador, orden, conteo_por_libro):
+            raise Exception("Error en la pasarela de pagos.")
+
+        self.ultima_orden = orden
+        return f"Orden {orden.id} procesada exitosamente."
 
-            # Uso del Factory (inyectado): Cambio de comportamiento sin cambio de codigo
-            if not self.procesador.pagar(orden.total):
-                orden.delete()
-                raise Exception("Error en la pasarela de pagos.")
+    async def aejecutar_proceso_compra(self, usuario, lista_productos, direccion):
+        """
+        Version async de `ejecutar_proceso_compra` con las mismas tres fases.
+        El ORM async no abre transacciones, asi que reservar, confirmar y liberar
+        corren como bloques sync en un hilo; el cobro se espera con `apagar` sin
+        retener ningun hilo mientras la pasarela responde.
+        """
+        orden, conteo_por_libro = await sync_to_async(self._reservar_orden)(usuario, lista_productos, direccion)
 
-            for libro_id, cantidad_requerida in conteo_por_libro.items():
-                inventario = inventarios_por_libro[libro_id]
-                inventario.cantidad -= cantidad_requerida
-                inventario.save(update_fields=["cantidad"])
+        if not await _apagar_y_cerrar(self.procesador, orden, conteo_por_libro):
+            raise Exception("Error en la pasarela de pagos.")
 
-            return f"Orden {orden.id} procesada exitosamente."
+        self.ultima_orden = orden
+        return f"Orden {orden.id} procesada exitosamente."
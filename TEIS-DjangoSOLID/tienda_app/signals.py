@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalogo import invalidar_catalogo, marcar_stock_modificado
+from .models import Inventario, Libro
+
+
+def _al_confirmar(funcion):
+    # Se invalida de inmediato y otra vez al confirmar la transaccion, para que
+    # una lectura concurrente no deje en cache datos previos al commit.
+    funcion()
+    transaction.on_commit(funcion)
+
+
+@receiver(post_save, sender=Libro)
+@receiver(post_delete, sender=Libro)
+@receiver(post_delete, sender=Inventario)
+def invalidar_catalogo_por_cambio(sender, **kwargs):
+    _al_confirmar(invalidar_catalogo)
+
+
+@receiver(post_save, sender=Inventario)
+def invalidar_catalogo_por_inventario(sender, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {"cantidad"}:
+        _al_confirmar(marcar_stock_modificado)
+        return
+    _al_confirmar(invalidar_catalogo)
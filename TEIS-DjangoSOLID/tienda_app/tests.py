@@ -1,32 +1,271 @@
+import asyncio
+import csv
+import importlib.util
 import json
 import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import skipUnless
 from unittest.mock import patch
 
-from django.test import TestCase
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
 from django.urls import reverse
-
-from .domain.logic import CalculadorImpuestos
+from django.utils import timezone
+
+from .api.idempotencia import respuestas_recientes
+from .api.serializers import LibroSerializer
+from .benchmarks import cargar_linea_base, comparar, medir
+from .carga import ejecutar_compradores, percentil, resumir
+from .catalogo import ProductoCatalogo, invalidar_catalogo, obtener_catalogo
+from .domain.interfaces import PagoIndeterminado, ProcesadorPago
+from .domain.logic import CalculadorImpuestos, MotorImpuestos, motor_impuestos
+from .exportacion import ordenes_para_exportar
+from .fragmentos import con_stock, descontar_fragmentos, rebalancear, stock_de
+from .infra.auditoria import RegistroAuditoria, obtener_registro
 from .infra.factories import MockPaymentProcessor, PaymentFactory
-from .infra.gateways import BancoNacionalProcesador
-from .models import Inventario, Libro, Orden, OrdenItem
-from .services import CompraRapidaService, CompraService
+from .infra.gateways import BancoNacionalProcesador, MicroservicioPagosProcesador
+from .infra.http import CircuitBreaker
+from .metricas import MetricasMiddleware, registro_metricas
+from .models import (
+    CompraEncolada,
+    Inventario,
+    InventarioFragmento,
+    Libro,
+    Orden,
+    OrdenItem,
+    SolicitudIdempotente,
+    VentaDiaria,
+)
+from .reportes import refrescar_ventas_diarias, reporte_ventas
+from .services import (
+    CompraRapidaService,
+    CompraService,
+    _confirmar_orden,
+    _pagar_y_cerrar,
+    encolar_compra_rapida,
+    liberar_reservas_expiradas,
+    procesar_compras_encoladas,
+)
+from .views import CompraRapidaServiceView
 
 
 class ProcesadorPagoExitoso:
     def __init__(self):
         self.montos = []
+        self.productos = []
+        self.referencias = []
 
-    def pagar(self, monto):
+    def pagar(self, monto, productos=None, referencia=None):
         self.montos.append(monto)
+        self.productos.append(productos)
+        self.referencias.append(referencia)
         return True
 
 
 class ProcesadorPagoFallido:
-    def pagar(self, monto):
+    def pagar(self, monto, productos=None, referencia=None):
         return False
 
 
+class ProcesadorPagoAsync:
+    def __init__(self):
+        self.montos = []
+
+    def pagar(self, monto, productos=None, referencia=None):
+        raise AssertionError("Las vistas async deben cobrar con apagar().")
+
+    async def apagar(self, monto, productos=None, referencia=None):
+        await asyncio.sleep(0)
+        self.montos.append(monto)
+        return True
+
+
+class TotalesConIvaLoteTestCase(SimpleTestCase):
+    def _precios_aleatorios(self, semilla, cantidad=500):
+        aleatorio = random.Random(semilla)
+        precios = []
+        for _ in range(cantidad):
+            centavos = aleatorio.randint(0, 10_000_000)
+            precios.append(
+                aleatorio.choice(
+                    [
+                        Decimal(centavos) / 100,
+                        (Decimal(centavos) / 100).quantize(Decimal("0.01")),
+                        centavos / 100,
+                        str(Decimal(centavos) / 100),
+                        centavos // 100,
+                        Decimal(aleatorio.randint(0, 10**7)) / 1000,
+                    ]
+                )
+            )
+        return precios
+
+    def _totales_con_iva(self, precios):
+        motor = MotorImpuestos()
+        return motor.totales_con_iva(precios, [motor.tasa()] * len(precios))
+
+    def test_totales_con_iva_coincide_con_el_camino_escalar(self):
+        for semilla in range(20):
+            with self.subTest(semilla=semilla):
+                precios = self._precios_aleatorios(semilla)
+                esperados = [CalculadorImpuestos.obtener_total_con_iva(precio) for precio in precios]
+
+                obtenidos = self._totales_con_iva(precios)
+
+                self.assertEqual(obtenidos, esperados)
+                self.assertEqual([str(total) for total in obtenidos], [str(total) for total in esperados])
+
+    def test_totales_con_iva_respeta_redondeo_bancario(self):
+        # 0.50 * 1.19 = 0.595 y 2.50 * 1.19 = 2.975: el empate se resuelve hacia el par.
+        precios = [Decimal("0.50"), Decimal("2.50"), Decimal("0.00")]
+
+        self.assertEqual(
+            self._totales_con_iva(precios),
+            [CalculadorImpuestos.obtener_total_con_iva(precio) for precio in precios],
+        )
+
+
+class MotorImpuestosTestCase(SimpleTestCase):
+    REGLAS = [
+        {"categoria": "ebook", "tasa": "0.05"},
+        {"categoria": "texto", "region": "norte", "tasa": "0"},
+        {"region": "norte", "tasa": "0.10"},
+    ]
+
+    def test_resuelve_con_comodines_y_tasa_por_defecto(self):
+        motor = MotorImpuestos(self.REGLAS)
+
+        self.assertEqual(motor.tasa("ebook"), Decimal("0.05"))
+        self.assertEqual(motor.tasa("EBOOK", region="norte"), Decimal("0.05"))
+        self.assertEqual(motor.tasa("texto", region="norte"), Decimal("0"))
+        self.assertEqual(motor.tasa("texto"), Decimal("0.19"))
+        self.assertEqual(motor.tasa("novela", region="norte"), Decimal("0.10"))
+        self.assertEqual(MotorImpuestos(self.REGLAS, region="norte").tasa("novela"), Decimal("0.10"))
+
+    def test_sin_reglas_coincide_con_obtener_total_con_iva(self):
+        motor = MotorImpuestos()
+        aleatorio = random.Random(7)
+        for _ in range(200):
+            precios = [Decimal(aleatorio.randint(1, 100_000)) / 100 for _ in range(aleatorio.randint(1, 20))]
+            lineas = [(precio, 1, motor.tasa()) for precio in precios]
+
+            self.assertEqual(motor.totales(lineas)["total"], CalculadorImpuestos.obtener_total_con_iva(sum(precios)))
+            self.assertEqual(
+                motor.totales_con_iva(precios, [motor.tasa()] * len(precios)),
+                [CalculadorImpuestos.obtener_total_con_iva(precio) for precio in precios],
+            )
+
+    def test_totales_redondea_una_vez_por_tasa(self):
+        motor = MotorImpuestos(self.REGLAS)
+        ebook = Libro(precio=Decimal("10.00"), categoria="ebook")
+        papel = Libro(precio=Decimal("0.50"), categoria="")
+
+        totales = motor.totales(
+            [(ebook.precio, 2, motor.tasa_libro(ebook)), (papel.precio, 3, motor.tasa_libro(papel))]
+        )
+
+        self.assertEqual(totales["subtotal"], Decimal("21.50"))
+        self.assertEqual(totales["total"], Decimal("21.00") + Decimal("1.78"))
+        self.assertEqual(motor.total_libro(ebook), Decimal("10.50"))
+
+    def test_reglas_invalidas(self):
+        for regla in ({"categoria": "x"}, {"tasa": "abc"}, {"tasa": "-0.1"}, {"tasa": "NaN"}):
+            with self.subTest(regla=regla), self.assertRaises(ValueError):
+                MotorImpuestos([regla])
+
+    def test_reglas_mal_formadas_nombran_la_clave(self):
+        casos = [
+            ({"tasa": "0.05"}, "se esperaba una lista de reglas"),
+            (["ebook"], "regla 0: se esperaba un objeto"),
+            ([{"tasa": "0"}, {"categoria": "ebook"}], "regla 1: falta la clave 'tasa'"),
+            ([{"categoria": 5, "tasa": "0"}], "regla 0: 'categoria' debe ser texto"),
+            ([{"region": ["norte"], "tasa": "0"}], "regla 0: 'region' debe ser texto"),
+        ]
+        for reglas, mensaje in casos:
+            with self.subTest(reglas=reglas), self.assertRaisesMessage(ValueError, mensaje):
+                MotorImpuestos(reglas)
+
+    @override_settings(IMPUESTOS_REGLAS=[{"categoria": "ebook", "tasa": "0.05"}], IMPUESTOS_REGION="norte")
+    def test_ready_carga_las_reglas_de_settings(self):
+        self.addCleanup(motor_impuestos.cargar)
+
+        apps.get_app_config("tienda_app").ready()
+
+        self.assertEqual(motor_impuestos.tasa("ebook"), Decimal("0.05"))
+        self.assertEqual(motor_impuestos.region, "norte")
+
+    @override_settings(IMPUESTOS_REGLAS=[{"tasa": "-1"}])
+    def test_ready_rechaza_reglas_invalidas(self):
+        self.addCleanup(motor_impuestos.cargar)
+
+        with self.assertRaises(ImproperlyConfigured):
+            apps.get_app_config("tienda_app").ready()
+
+    @override_settings(IMPUESTOS_REGLAS=[{"categoria": "ebook", "tasa": "0.05"}, {"categoria": "texto"}])
+    def test_ready_rechaza_reglas_mal_formadas(self):
+        self.addCleanup(motor_impuestos.cargar)
+
+        with self.assertRaisesMessage(ImproperlyConfigured, "IMPUESTOS_REGLAS invalido: regla 1: falta la clave 'tasa'"):
+            apps.get_app_config("tienda_app").ready()
+
+
+class ImpuestosPorCategoriaTestCase(TestCase):
+    def setUp(self):
+        motor_impuestos.cargar([{"categoria": "ebook", "tasa": "0.05"}])
+        self.addCleanup(motor_impuestos.cargar)
+        self.ebook = Libro.objects.create(titulo="Ebook", precio=Decimal("10.00"), categoria="ebook")
+        self.papel = Libro.objects.create(titulo="Papel", precio=Decimal("100.00"))
+        Inventario.objects.create(libro=self.ebook, cantidad=5)
+        Inventario.objects.create(libro=self.papel, cantidad=5)
+
+    def test_compra_aplica_la_tasa_de_cada_libro_y_la_guarda_en_el_item(self):
+        servicio = CompraService(procesador_pago=ProcesadorPagoExitoso())
+
+        with self.assertNumQueries(0):
+            motor_impuestos.tasa_libro(self.ebook)
+        servicio.ejecutar_proceso_compra("Cliente", [self.ebook, self.ebook, self.papel], "Calle 1")
+
+        orden = Orden.objects.get()
+        self.assertEqual(orden.total, Decimal("21.00") + Decimal("119.00"))
+        self.assertEqual(orden.items.get(libro=self.ebook).tasa_iva, Decimal("0.05"))
+        self.assertEqual(orden.items.get(libro=self.papel).tasa_iva, Decimal("0.19"))
+
+    def test_reporte_usa_la_tasa_guardada_en_cada_item(self):
+        servicio = CompraService(procesador_pago=ProcesadorPagoExitoso())
+        servicio.ejecutar_proceso_compra("Cliente", [self.ebook, self.papel], "Calle 1")
+
+        vivo = reporte_ventas(fuente="vivo")
+        ayer = timezone.now() - timedelta(days=1)
+        Orden.objects.update(fecha_creacion=ayer, confirmada_en=ayer)
+        refrescar_ventas_diarias()
+
+        self.assertEqual(vivo["total"]["ingresos_con_iva"], "129.50")
+        self.assertEqual(reporte_ventas(fuente="resumen")["total"], vivo["total"])
+
+    def test_catalogo_muestra_el_total_con_la_tasa_de_la_categoria(self):
+        response = self.client.get(reverse("home"))
+
+        totales = {item["libro"].id: item["total_con_iva"] for item in response.context["items"]}
+        self.assertEqual(totales, {self.ebook.id: Decimal("10.50"), self.papel.id: Decimal("119.00")})
+
+
 class CompraServiceTestCase(TestCase):
     def setUp(self):
         self.libro_a = Libro.objects.create(titulo="Libro A", precio=Decimal("100.00"))
@@ -51,6 +290,8 @@ class CompraServiceTestCase(TestCase):
         self.assertEqual(orden.total, Decimal("297.50"))
         self.assertIsNone(orden.libro)
         self.assertEqual(procesador.montos, [Decimal("297.50")])
+        self.assertEqual(procesador.productos, [{self.libro_a.id: 2, self.libro_b.id: 1}])
+        self.assertEqual(procesador.referencias, [str(orden.referencia_pago)])
         self.assertEqual(orden.items.count(), 2)
 
         item_a = orden.items.get(libro=self.libro_a)
@@ -132,6 +373,56 @@ class CompraServiceTestCase(TestCase):
             )
 
 
+class CompraServiceConsultasTestCase(TestCase):
+    def setUp(self):
+        self.libros = [
+            Libro.objects.create(titulo=f"Libro {indice}", precio=Decimal("10.00"))
+            for indice in range(30)
+        ]
+        Inventario.objects.bulk_create(
+            [Inventario(libro=libro, cantidad=5) for libro in self.libros]
+        )
+
+    def _consultas_para(self, libros):
+        servicio = CompraService(procesador_pago=ProcesadorPagoExitoso())
+        with CaptureQueriesContext(connection) as consultas:
+            servicio.ejecutar_proceso_compra(
+                usuario="Estudiante",
+                lista_productos=libros,
+                direccion="EAFIT",
+            )
+        return len(consultas.captured_queries)
+
+    def test_cantidad_de_consultas_no_crece_con_el_carrito(self):
+        consultas_carrito_pequeno = self._consultas_para(self.libros[:2])
+        consultas_carrito_grande = self._consultas_para(self.libros)
+
+        self.assertEqual(consultas_carrito_pequeno, consultas_carrito_grande)
+        self.assertEqual(
+            list(Inventario.objects.order_by("libro_id").values_list("cantidad", flat=True)),
+            [3, 3] + [4] * 28,
+        )
+
+    def test_descuento_usa_un_solo_update(self):
+        servicio = CompraService(procesador_pago=ProcesadorPagoExitoso())
+
+        with CaptureQueriesContext(connection) as consultas:
+            servicio.ejecutar_proceso_compra(
+                usuario="Estudiante",
+                lista_productos=self.libros + self.libros[:5],
+                direccion="EAFIT",
+            )
+
+        updates = [
+            consulta["sql"]
+            for consulta in consultas.captured_queries
+            if consulta["sql"].startswith('UPDATE "tienda_app_inventario"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Inventario.objects.get(libro=self.libros[0]).cantidad, 3)
+        self.assertEqual(Inventario.objects.get(libro=self.libros[-1]).cantidad, 4)
+
+
 class CompraRapidaServiceTestCase(TestCase):
     def setUp(self):
         self.libro = Libro.objects.create(titulo="Libro Rapido", precio=Decimal("42.00"))
@@ -163,208 +454,2508 @@ class CompraRapidaServiceTestCase(TestCase):
             servicio.procesar(self.libro.id)
 
 
-class PaymentFactoryTestCase(TestCase):
-    def test_factory_retorna_mock_si_variable_de_entorno_es_mock(self):
-        with patch.dict(os.environ, {"PAYMENT_PROVIDER": "MOCK"}, clear=False):
-            procesador = PaymentFactory.get_processor()
-            self.assertIsInstance(procesador, MockPaymentProcessor)
-
-    def test_factory_retorna_banco_por_defecto(self):
-        with patch.dict(os.environ, {}, clear=False):
-            os.environ.pop("PAYMENT_PROVIDER", None)
-            procesador = PaymentFactory.get_processor()
-            self.assertIsInstance(procesador, BancoNacionalProcesador)
+class ProcesadorPagoConError:
+    def pagar(self, monto, productos=None, referencia=None):
+        raise ConnectionError("Pasarela caida")
 
 
-class CompraAPITestCase(TestCase):
+class CompraRapidaOptimistaTestCase(TestCase):
     def setUp(self):
-        self.libro = Libro.objects.create(titulo="API Libro", precio=Decimal("80.00"))
-        Inventario.objects.create(libro=self.libro, cantidad=1)
-        self.url = reverse("api_comprar")
-
-    @patch("tienda_app.api.views.PaymentFactory.get_processor")
-    def test_api_compra_exitosa_descuenta_stock(self, mock_get_processor):
-        mock_get_processor.return_value = ProcesadorPagoExitoso()
+        self.libro = Libro.objects.create(titulo="Libro Flash", precio=Decimal("42.00"))
+        Inventario.objects.create(libro=self.libro, cantidad=2)
 
-        response = self.client.post(
-            self.url,
-            data=json.dumps(
-                {
-                    "libro_id": self.libro.id,
-                    "direccion_envio": "Calle 123",
-                }
-            ),
-            content_type="application/json",
+    def _servicio(self, procesador):
+        return CompraRapidaService(
+            procesador_pago=procesador,
+            estrategia=CompraRapidaService.RESERVA_OPTIMISTA,
         )
 
-        self.assertEqual(response.status_code, 201)
-        self.assertEqual(response.json()["estado"], "exito")
-        self.assertEqual(Orden.objects.count(), 1)
-        self.assertEqual(Orden.objects.get().items.count(), 1)
-        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 0)
-        mock_get_processor.assert_called_once()
+    def test_reserva_optimista_descuenta_stock_y_crea_orden(self):
+        total = self._servicio(ProcesadorPagoExitoso()).procesar(self.libro.id)
 
-    def test_api_valida_payload(self):
-        response = self.client.post(
-            self.url,
-            data=json.dumps({"direccion_envio": "Sin libro"}),
-            content_type="application/json",
+        self.assertEqual(total, CalculadorImpuestos.obtener_total_con_iva(self.libro.precio))
+        orden = Orden.objects.get()
+        self.assertEqual(orden.libro, self.libro)
+        self.assertEqual(orden.items.get().cantidad, 1)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 1)
+
+    def test_reserva_optimista_no_usa_select_for_update(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self._servicio(ProcesadorPagoExitoso()).procesar(self.libro.id)
+
+        self.assertFalse(any("FOR UPDATE" in consulta["sql"] for consulta in consultas.captured_queries))
+        self.assertTrue(
+            any(
+                consulta["sql"].startswith('UPDATE "tienda_app_inventario"')
+                for consulta in consultas.captured_queries
+            )
         )
 
-        self.assertEqual(response.status_code, 400)
-        self.assertIn("libro_id", response.json())
+    def test_reserva_optimista_compensa_si_el_pago_falla(self):
+        total = self._servicio(ProcesadorPagoFallido()).procesar(self.libro.id)
 
-    def test_api_retorna_404_si_libro_no_existe(self):
-        response = self.client.post(
-            self.url,
-            data=json.dumps(
-                {
-                    "libro_id": 99999,
-                    "direccion_envio": "Calle 404",
-                }
-            ),
-            content_type="application/json",
-        )
+        self.assertIsNone(total)
+        self.assertEqual(Orden.objects.count(), 0)
+        self.assertEqual(OrdenItem.objects.count(), 0)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 2)
 
-        self.assertEqual(response.status_code, 404)
-        self.assertEqual(response.json()["error"], "Libro no encontrado.")
+    def test_reserva_optimista_deja_la_orden_por_verificar_si_la_pasarela_lanza_error(self):
+        with self.assertLogs("tienda_app.services", "ERROR"), self.assertRaises(PagoIndeterminado):
+            self._servicio(ProcesadorPagoConError()).procesar(self.libro.id)
 
-    @patch("tienda_app.api.views.PaymentFactory.get_processor")
-    def test_api_retorna_409_si_no_hay_stock(self, mock_get_processor):
-        mock_get_processor.return_value = ProcesadorPagoExitoso()
-        inventario = Inventario.objects.get(libro=self.libro)
-        inventario.cantidad = 0
-        inventario.save(update_fields=["cantidad"])
+        # El cobro pudo hacerse: la orden y su stock reservado se conservan.
+        orden = Orden.objects.get()
+        self.assertEqual(orden.estado, Orden.Estado.POR_VERIFICAR)
+        self.assertIsNone(orden.reservada_hasta)
+        self.assertEqual(orden.items.get().cantidad, 1)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 1)
 
-        response = self.client.post(
-            self.url,
-            data=json.dumps(
-                {
-                    "libro_id": self.libro.id,
-                    "direccion_envio": "Calle sin stock",
-                }
-            ),
-            content_type="application/json",
-        )
+    def test_reserva_optimista_falla_sin_stock(self):
+        Inventario.objects.filter(libro=self.libro).update(cantidad=0)
 
-        self.assertEqual(response.status_code, 409)
-        self.assertIn("No hay existencias", response.json()["error"])
+        with self.assertRaisesMessage(ValueError, "No hay existencias."):
+            self._servicio(ProcesadorPagoExitoso()).procesar(self.libro.id)
 
-    @patch("tienda_app.api.views.PaymentFactory.get_processor")
-    def test_api_compra_refleja_cambio_en_vista_html_inventario(self, mock_get_processor):
-        mock_get_processor.return_value = ProcesadorPagoExitoso()
-        inventario_url = reverse("inventario")
+        self.assertEqual(Orden.objects.count(), 0)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 0)
 
-        before_response = self.client.get(inventario_url)
-        before_stock = next(
-            item["stock_actual"]
-            for item in before_response.context["items"]
-            if item["libro"].id == self.libro.id
-        )
+    def test_reserva_optimista_falla_sin_inventario(self):
+        Inventario.objects.filter(libro=self.libro).delete()
 
-        self.client.post(
-            self.url,
-            data=json.dumps(
-                {
-                    "libro_id": self.libro.id,
-                    "direccion_envio": "Calle HTML",
-                }
-            ),
-            content_type="application/json",
-        )
+        with self.assertRaises(Inventario.DoesNotExist):
+            self._servicio(ProcesadorPagoExitoso()).procesar(self.libro.id)
 
-        after_response = self.client.get(inventario_url)
-        after_stock = next(
-            item["stock_actual"]
-            for item in after_response.context["items"]
-            if item["libro"].id == self.libro.id
-        )
+    def test_rechaza_estrategia_desconocida(self):
+        with self.assertRaisesMessage(ValueError, "Estrategia de reserva desconocida"):
+            CompraRapidaService(procesador_pago=ProcesadorPagoExitoso(), estrategia="otra")
 
-        self.assertEqual(before_stock, 1)
-        self.assertEqual(after_stock, 0)
 
+class ProcesadorPagoSinLocks:
+    """Registra si el cobro ocurre dentro de una transaccion abierta."""
 
-class ProductosAPITestCase(TestCase):
+    def __init__(self):
+        self.en_transaccion = []
+
+    def pagar(self, monto, productos=None, referencia=None):
+        self.en_transaccion.append(connection.in_atomic_block)
+        return True
+
+
+class ReservaDosFasesTestCase(TransactionTestCase):
     def setUp(self):
-        self.libro_b = Libro.objects.create(titulo="Libro B", precio=Decimal("55.00"))
-        self.libro_a = Libro.objects.create(titulo="Libro A", precio=Decimal("40.00"))
-        Inventario.objects.create(libro=self.libro_b, cantidad=2)
-        Inventario.objects.create(libro=self.libro_a, cantidad=5)
-        self.url = reverse("api_productos")
+        self.libro = Libro.objects.create(titulo="Libro Reserva", precio=Decimal("20.00"))
+        Inventario.objects.create(libro=self.libro, cantidad=3)
 
-    def test_api_productos_lista_libros_y_stock(self):
-        response = self.client.get(self.url)
+    def test_compra_service_cobra_sin_transaccion_abierta(self):
+        procesador = ProcesadorPagoSinLocks()
 
-        self.assertEqual(response.status_code, 200)
-        self.assertEqual(
-            response.json(),
-            [
-                {
-                    "id": self.libro_b.id,
-                    "titulo": "Libro B",
-                    "precio": "55.00",
-                    "stock_actual": 2,
-                },
-                {
-                    "id": self.libro_a.id,
-                    "titulo": "Libro A",
-                    "precio": "40.00",
-                    "stock_actual": 5,
-                },
-            ],
+        CompraService(procesador_pago=procesador).ejecutar_proceso_compra(
+            usuario="Estudiante",
+            lista_productos=[self.libro],
+            direccion="EAFIT",
         )
 
-    def test_api_productos_mantiene_orden_estable_por_id(self):
-        response = self.client.get(self.url)
+        self.assertEqual(procesador.en_transaccion, [False])
+        orden = Orden.objects.get()
+        self.assertEqual(orden.estado, Orden.Estado.CONFIRMADA)
+        self.assertIsNone(orden.reservada_hasta)
 
-        ids = [item["id"] for item in response.json()]
-        self.assertEqual(ids, sorted(ids))
+    def test_compra_rapida_cobra_sin_transaccion_abierta_en_ambas_estrategias(self):
+        for estrategia in (CompraRapidaService.BLOQUEO_PESIMISTA, CompraRapidaService.RESERVA_OPTIMISTA):
+            procesador = ProcesadorPagoSinLocks()
 
+            CompraRapidaService(procesador_pago=procesador, estrategia=estrategia).procesar(self.libro.id)
 
-class CompraHTMLViewTestCase(TestCase):
-    def setUp(self):
-        self.libro = Libro.objects.create(titulo="Libro HTML", precio=Decimal("90.00"))
-        Inventario.objects.create(libro=self.libro, cantidad=2)
+            self.assertEqual(procesador.en_transaccion, [False])
 
-    def test_home_renderiza_catalogo(self):
-        response = self.client.get(reverse("home"))
+        self.assertEqual(Orden.objects.filter(estado=Orden.Estado.CONFIRMADA).count(), 2)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 1)
 
-        self.assertEqual(response.status_code, 200)
-        self.assertTemplateUsed(response, "tienda_app/catalogo.html")
-        self.assertContains(response, "Catálogo")
-        self.assertContains(response, self.libro.titulo)
 
-    def test_compra_regular_get_usa_template_dedicado(self):
-        response = self.client.get(reverse("finalizar_compra", args=[self.libro.id]))
+class ProcesadorPagoQueObservaReserva:
+    def __init__(self, libro):
+        self.libro = libro
+        self.estados = []
+        self.stock_durante_pago = []
 
-        self.assertEqual(response.status_code, 200)
-        self.assertTemplateUsed(response, "tienda_app/compra.html")
-        self.assertEqual(response.context["total"], CalculadorImpuestos.obtener_total_con_iva(self.libro.precio))
+    def pagar(self, monto, productos=None, referencia=None):
+        self.estados.append(Orden.objects.get().estado)
+        self.stock_durante_pago.append(Inventario.objects.get(libro=self.libro).cantidad)
+        return True
 
-    @patch("tienda_app.views.PaymentFactory.get_processor")
-    def test_compra_regular_post_renderiza_exito_en_template(self, mock_get_processor):
-        mock_get_processor.return_value = ProcesadorPagoExitoso()
 
-        response = self.client.post(reverse("finalizar_compra", args=[self.libro.id]))
+class ProcesadorPagoConBarrido:
+    """Simula que el barrido libera la reserva mientras el banco responde."""
 
-        self.assertEqual(response.status_code, 200)
-        self.assertTemplateUsed(response, "tienda_app/compra.html")
-        self.assertIn("Orden", response.context["mensaje_exito"])
-        self.assertEqual(Orden.objects.count(), 1)
-        self.assertEqual(Orden.objects.get().items.count(), 1)
+    def pagar(self, monto, productos=None, referencia=None):
+        liberar_reservas_expiradas(ahora=timezone.now() + timedelta(days=1))
+        return True
 
-    @patch("tienda_app.views.PaymentFactory.get_processor")
-    def test_compra_regular_post_renderiza_error_en_template(self, mock_get_processor):
-        mock_get_processor.return_value = ProcesadorPagoFallido()
 
-        response = self.client.post(reverse("finalizar_compra", args=[self.libro.id]))
+class ProcesadorPagoConBarridoAgotado(ProcesadorPagoConBarrido):
+    """Ademas, otro comprador se lleva el stock liberado antes de confirmar."""
 
-        self.assertEqual(response.status_code, 400)
-        self.assertTemplateUsed(response, "tienda_app/compra.html")
-        self.assertEqual(response.context["error"], "Error en la pasarela de pagos.")
+    def __init__(self, libro):
+        self.libro = libro
+
+    def pagar(self, monto, productos=None, referencia=None):
+        super().pagar(monto)
+        Inventario.objects.filter(libro=self.libro).update(cantidad=0)
+        return True
+
+
+class ReservaOrdenTestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="Libro Reserva", precio=Decimal("20.00"))
+        Inventario.objects.create(libro=self.libro, cantidad=3)
+
+    def test_stock_queda_reservado_y_orden_pendiente_durante_el_pago(self):
+        procesador = ProcesadorPagoQueObservaReserva(self.libro)
+
+        CompraService(procesador_pago=procesador).ejecutar_proceso_compra(
+            usuario="Estudiante",
+            lista_productos=[self.libro, self.libro],
+            direccion="EAFIT",
+        )
+
+        self.assertEqual(procesador.estados, [Orden.Estado.PENDIENTE])
+        self.assertEqual(procesador.stock_durante_pago, [1])
+        self.assertEqual(Orden.objects.get().estado, Orden.Estado.CONFIRMADA)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 1)
+
+    @override_settings(RESERVA_ORDEN_TTL_SEGUNDOS=60)
+    def test_reserva_vence_segun_configuracion(self):
+        antes = timezone.now()
+
+        CompraRapidaService(procesador_pago=ProcesadorPagoFallido())._reservar_pesimista(self.libro.id)
+
+        orden = Orden.objects.get()
+        self.assertEqual(orden.estado, Orden.Estado.PENDIENTE)
+        self.assertGreaterEqual(orden.reservada_hasta, antes + timedelta(seconds=60))
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 2)
+
+    def test_barrido_libera_solo_reservas_vencidas(self):
+        servicio = CompraRapidaService(procesador_pago=ProcesadorPagoExitoso())
+        vencida = servicio._reservar_pesimista(self.libro.id)
+        vigente = servicio._reservar_pesimista(self.libro.id)
+        Orden.objects.filter(pk=vencida.pk).update(reservada_hasta=timezone.now() - timedelta(seconds=1))
+
+        liberadas = liberar_reservas_expiradas()
+
+        self.assertEqual(liberadas, 1)
+        self.assertEqual(Orden.objects.get(pk=vencida.pk).estado, Orden.Estado.LIBERADA)
+        self.assertEqual(Orden.objects.get(pk=vigente.pk).estado, Orden.Estado.PENDIENTE)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 2)
+
+    def test_barrido_no_toca_ordenes_confirmadas(self):
+        CompraRapidaService(procesador_pago=ProcesadorPagoExitoso()).procesar(self.libro.id)
+
+        self.assertEqual(liberar_reservas_expiradas(ahora=timezone.now() + timedelta(days=1)), 0)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 2)
+
+    def test_pago_fallido_despues_del_barrido_no_repone_dos_veces(self):
+        servicio = CompraRapidaService(procesador_pago=ProcesadorPagoFallido())
+        orden = servicio._reservar_pesimista(self.libro.id)
+        liberar_reservas_expiradas(ahora=timezone.now() + timedelta(days=1))
+
+        self.assertFalse(_pagar_y_cerrar(servicio.procesador_pago, orden, {self.libro.id: 1}))
+
+        self.assertEqual(Orden.objects.count(), 0)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 3)
+
+    def test_cobro_indeterminado_deja_la_orden_por_verificar_con_su_referencia(self):
+        class ProcesadorSinRespuesta:
+            def pagar(self, monto, productos=None, referencia=None):
+                self.referencia = referencia
+                raise PagoIndeterminado("La pasarela no respondio.")
+
+        procesador = ProcesadorSinRespuesta()
+        servicio = CompraService(procesador_pago=procesador)
+
+        with self.assertLogs("tienda_app.services", "ERROR") as logs, self.assertRaisesMessage(
+            PagoIndeterminado, "queda por verificar"
+        ):
+            servicio.ejecutar_proceso_compra(usuario="Estudiante", lista_productos=[self.libro], direccion="EAFIT")
+
+        orden = Orden.objects.get()
+        self.assertEqual(orden.estado, Orden.Estado.POR_VERIFICAR)
+        self.assertEqual(procesador.referencia, str(orden.referencia_pago))
+        self.assertIn(str(orden.referencia_pago), logs.output[0])
+        self.assertEqual(liberar_reservas_expiradas(ahora=timezone.now() + timedelta(days=1)), 0)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 2)
+
+    def test_orden_cobrada_que_no_se_puede_confirmar_queda_por_verificar(self):
+        servicio = CompraRapidaService(procesador_pago=ProcesadorPagoExitoso())
+
+        with patch("tienda_app.services._confirmar_orden", side_effect=OperationalError("database is locked")):
+            with self.assertLogs("tienda_app.services", "ERROR"), self.assertRaises(OperationalError):
+                servicio.procesar(self.libro.id)
+
+        self.assertEqual(Orden.objects.get().estado, Orden.Estado.POR_VERIFICAR)
+        # El barrido no devuelve el stock de una orden cobrada.
+        self.assertEqual(liberar_reservas_expiradas(ahora=timezone.now() + timedelta(days=1)), 0)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 2)
+
+    def test_pago_aprobado_despues_del_barrido_retoma_el_stock(self):
+        total = CompraRapidaService(procesador_pago=ProcesadorPagoConBarrido()).procesar(self.libro.id)
+
+        self.assertIsNotNone(total)
+        self.assertEqual(Orden.objects.get().estado, Orden.Estado.CONFIRMADA)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 2)
+
+    def test_pago_aprobado_sin_stock_tras_el_barrido_queda_por_reembolsar(self):
+        servicio = CompraRapidaService(procesador_pago=ProcesadorPagoConBarridoAgotado(self.libro))
+
+        with self.assertLogs("tienda_app.services", "ERROR"), self.assertRaisesMessage(ValueError, "reembolsado"):
+            servicio.procesar(self.libro.id)
+
+        orden = Orden.objects.get()
+        self.assertEqual(orden.estado, Orden.Estado.POR_REEMBOLSAR)
+        self.assertEqual(orden.total, Decimal("23.80"))
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 0)
+
+    def test_sin_stock_tras_el_barrido_no_descuenta_el_resto_del_carrito(self):
+        otro = Libro.objects.create(titulo="Otro Libro Reserva", precio=Decimal("5.00"))
+        Inventario.objects.create(libro=otro, cantidad=5)
+        servicio = CompraService(procesador_pago=ProcesadorPagoConBarridoAgotado(self.libro))
+
+        with self.assertLogs("tienda_app.services", "ERROR"), self.assertRaises(ValueError):
+            servicio.ejecutar_proceso_compra(usuario="Estudiante", lista_productos=[self.libro, otro], direccion="EAFIT")
+
+        self.assertEqual(Orden.objects.get().estado, Orden.Estado.POR_REEMBOLSAR)
+        self.assertEqual(Inventario.objects.get(libro=otro).cantidad, 5)
+
+    def test_comando_liberar_reservas(self):
+        orden = CompraRapidaService(procesador_pago=ProcesadorPagoExitoso())._reservar_optimista(self.libro.id)
+        Orden.objects.filter(pk=orden.pk).update(reservada_hasta=timezone.now() - timedelta(minutes=1))
+        salida = StringIO()
+
+        call_command("liberar_reservas", stdout=salida)
+
+        self.assertIn("Reservas liberadas: 1", salida.getvalue())
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 3)
+
+
+@override_settings(COMPRA_RAPIDA_ENCOLADA=True)
+class CompraEncoladaTestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="Libro Encolado", precio=Decimal("50.00"))
+        Inventario.objects.create(libro=self.libro, cantidad=5)
+
+    def _stock(self):
+        return Inventario.objects.get(libro=self.libro).cantidad
+
+    def test_rutas_rapidas_reservan_encolan_y_responden_202(self):
+        for ruta in ("compra_rapida_fbv", "compra_rapida_cbv", "compra_rapida_service"):
+            with self.subTest(ruta=ruta):
+                response = self.client.post(reverse(ruta, args=[self.libro.id]))
+
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual(response.json()["estado"], "pendiente")
+                self.assertEqual(response["Location"], response.json()["estado_url"])
+                estado = self.client.get(response["Location"])
+                self.assertEqual(estado.status_code, 200)
+                self.assertEqual(estado.json()["estado"], "pendiente")
+                self.assertIsNone(estado.json()["orden"])
+                self.assertEqual(estado["Retry-After"], "1")
+
+        self.assertEqual(self._stock(), 2)
+        self.assertEqual(CompraEncolada.objects.count(), 3)
+        self.assertFalse(Orden.objects.exists())
+
+    def test_sin_stock_o_libro_inexistente_no_encola(self):
+        Inventario.objects.filter(libro=self.libro).update(cantidad=0)
+
+        self.assertEqual(self.client.post(reverse("compra_rapida_service", args=[self.libro.id])).status_code, 400)
+        self.assertEqual(self.client.post(reverse("compra_rapida_cbv", args=[self.libro.id + 1])).status_code, 404)
+        self.assertFalse(CompraEncolada.objects.exists())
+
+    def test_worker_crea_ordenes_en_lote_con_consultas_constantes(self):
+        consultas_por_lote = []
+        for cantidad in (1, 4):
+            compras = [encolar_compra_rapida(self.libro.id, usuario="Lector") for _ in range(cantidad)]
+            procesador = ProcesadorPagoExitoso()
+            with CaptureQueriesContext(connection) as consultas:
+                resultado = procesar_compras_encoladas(procesador, lote=10)
+            consultas_por_lote.append(len(consultas))
+            self.assertEqual(resultado, {"confirmadas": cantidad, "rechazadas": 0, "por_verificar": 0})
+            self.assertEqual(procesador.productos, [{self.libro.id: 1}] * cantidad)
+            self.assertEqual(procesador.referencias, [str(compra.token) for compra in compras])
+
+        self.assertEqual(consultas_por_lote[0], consultas_por_lote[1])
+        compra = CompraEncolada.objects.select_related("orden").get(pk=compras[0].pk)
+        self.assertEqual(compra.estado, CompraEncolada.Estado.CONFIRMADA)
+        self.assertEqual(compra.orden.estado, Orden.Estado.CONFIRMADA)
+        self.assertEqual((compra.orden.usuario, compra.orden.total), ("Lector", compra.total))
+        item = compra.orden.items.get()
+        self.assertEqual((item.libro_id, item.cantidad, item.precio_unitario), (self.libro.id, 1, Decimal("50.00")))
+        self.assertEqual(self._stock(), 0)
+        estado = self.client.get(reverse("api_compra_encolada", args=[compra.token]))
+        self.assertEqual(estado.json()["orden"], compra.orden_id)
+        self.assertNotIn("Retry-After", estado)
+
+    def test_pagos_rechazados_devuelven_el_stock(self):
+        rechazada = encolar_compra_rapida(self.libro.id)
+
+        resultado = procesar_compras_encoladas(ProcesadorPagoFallido(), lote=1)
+
+        rechazada.refresh_from_db()
+        self.assertEqual(resultado, {"confirmadas": 0, "rechazadas": 1, "por_verificar": 0})
+        self.assertEqual((rechazada.estado, rechazada.error), ("rechazada", "Pago rechazado."))
+        self.assertEqual(self._stock(), 5)
+        self.assertFalse(Orden.objects.exists())
+
+    def test_error_de_la_pasarela_deja_la_compra_por_verificar(self):
+        compra = encolar_compra_rapida(self.libro.id)
+
+        with self.assertLogs("tienda_app.services", "ERROR") as logs:
+            resultado = procesar_compras_encoladas(ProcesadorPagoConError(), lote=1)
+
+        # El cargo pudo hacerse: no se rechaza ni se devuelve el stock.
+        compra.refresh_from_db()
+        self.assertEqual(resultado, {"confirmadas": 0, "rechazadas": 0, "por_verificar": 1})
+        self.assertEqual(compra.estado, CompraEncolada.Estado.POR_VERIFICAR)
+        self.assertIn(str(compra.token), logs.output[0])
+        self.assertEqual(self._stock(), 4)
+        self.assertFalse(Orden.objects.exists())
+        self.assertEqual(
+            procesar_compras_encoladas(ProcesadorPagoExitoso()),
+            {"confirmadas": 0, "rechazadas": 0, "por_verificar": 0},
+        )
+
+    def test_compra_tomada_por_un_worker_caido_vuelve_a_la_cola(self):
+        colgada = encolar_compra_rapida(self.libro.id)
+        en_curso = encolar_compra_rapida(self.libro.id)
+        ahora = timezone.now()
+        CompraEncolada.objects.filter(pk=colgada.pk).update(
+            estado=CompraEncolada.Estado.PROCESANDO,
+            actualizada=ahora - timedelta(seconds=settings.COLA_COMPRAS_REINTENTO_SEGUNDOS + 1),
+        )
+        CompraEncolada.objects.filter(pk=en_curso.pk).update(estado=CompraEncolada.Estado.PROCESANDO, actualizada=ahora)
+
+        self.assertEqual(
+            procesar_compras_encoladas(ProcesadorPagoExitoso(), ahora=ahora),
+            {"confirmadas": 1, "rechazadas": 0, "por_verificar": 0},
+        )
+        colgada.refresh_from_db()
+        self.assertEqual(colgada.estado, CompraEncolada.Estado.CONFIRMADA)
+        self.assertIsNotNone(colgada.cobro_iniciado)
+
+    def test_compra_reintentada_con_cobro_iniciado_no_se_cobra_de_nuevo(self):
+        compra = encolar_compra_rapida(self.libro.id)
+        ahora = timezone.now()
+        CompraEncolada.objects.filter(pk=compra.pk).update(
+            estado=CompraEncolada.Estado.PROCESANDO,
+            cobro_iniciado=ahora - timedelta(seconds=settings.COLA_COMPRAS_REINTENTO_SEGUNDOS + 1),
+            actualizada=ahora - timedelta(seconds=settings.COLA_COMPRAS_REINTENTO_SEGUNDOS + 1),
+        )
+        procesador = ProcesadorPagoExitoso()
+
+        with self.assertLogs("tienda_app.services", "ERROR"):
+            resultado = procesar_compras_encoladas(procesador, ahora=ahora)
+
+        self.assertEqual(resultado, {"confirmadas": 0, "rechazadas": 0, "por_verificar": 1})
+        self.assertEqual(procesador.montos, [])
+        compra.refresh_from_db()
+        self.assertEqual(compra.estado, CompraEncolada.Estado.POR_VERIFICAR)
+        self.assertFalse(Orden.objects.exists())
+        self.assertEqual(self._stock(), 4)
+
+    def test_cobro_aprobado_de_una_compra_tomada_por_otro_worker_queda_en_el_log(self):
+        compra = encolar_compra_rapida(self.libro.id)
+
+        class ProcesadorLento(ProcesadorPagoExitoso):
+            def pagar(self, monto, productos=None, referencia=None):
+                # Mientras el banco responde vence la ventana y otro worker la toma.
+                CompraEncolada.objects.filter(pk=compra.pk).update(actualizada=timezone.now() + timedelta(seconds=1))
+                return super().pagar(monto)
+
+        with self.assertLogs("tienda_app.services", "ERROR") as logs:
+            resultado = procesar_compras_encoladas(ProcesadorLento())
+
+        self.assertEqual(resultado, {"confirmadas": 0, "rechazadas": 0, "por_verificar": 0})
+        self.assertIn(str(compra.token), logs.output[0])
+        compra.refresh_from_db()
+        self.assertIsNotNone(compra.cobro_iniciado)
+
+    def test_comando_procesar_compras(self):
+        encolar_compra_rapida(self.libro.id)
+        encolar_compra_rapida(self.libro.id)
+        salida = StringIO()
+
+        with patch("tienda_app.management.commands.procesar_compras.PaymentFactory.get_processor") as get_processor:
+            get_processor.return_value = ProcesadorPagoExitoso()
+            call_command("procesar_compras", lote=1, stdout=salida)
+
+        self.assertIn("Compras confirmadas: 2, rechazadas: 0, por verificar: 0", salida.getvalue())
+        self.assertEqual(Orden.objects.count(), 2)
+
+
+class InventarioFragmentadoTestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="Lanzamiento", precio=Decimal("20.00"))
+        self.inventario = Inventario.objects.create(libro=self.libro, cantidad=10)
+
+    def _cantidades(self):
+        return list(
+            InventarioFragmento.objects.filter(libro=self.libro).order_by("indice").values_list("cantidad", flat=True)
+        )
+
+    def _principal(self):
+        self.inventario.refresh_from_db()
+        return self.inventario.cantidad
+
+    def test_rebalancear_reparte_el_total_y_puede_deshacerse(self):
+        self.assertEqual(rebalancear(self.libro.id, 4), 4)
+        self.assertEqual(self._cantidades(), [3, 3, 2, 2])
+        self.assertEqual(self._principal(), 0)
+
+        Inventario.objects.filter(pk=self.inventario.pk).update(cantidad=2)
+        rebalancear(self.libro.id)
+        self.assertEqual(self._cantidades(), [3, 3, 3, 3])
+
+        rebalancear(self.libro.id, 3)
+        self.assertEqual(self._cantidades(), [4, 4, 4])
+
+        rebalancear(self.libro.id, 0)
+        self.assertEqual(self._cantidades(), [])
+        self.assertEqual(self._principal(), 12)
+        with self.assertRaises(ValueError):
+            rebalancear(self.libro.id, -1)
+
+    def test_descontar_reparte_entre_fragmentos_si_ninguno_alcanza(self):
+        rebalancear(self.libro.id, 4)
+
+        self.assertTrue(descontar_fragmentos(self.libro.id, 5))
+        self.assertEqual(sum(self._cantidades()), 5)
+        self.assertFalse(descontar_fragmentos(self.libro.id, 6))
+        self.assertEqual(sum(self._cantidades()), 5)
+
+    def test_compra_rapida_descuenta_de_un_fragmento_con_ambas_estrategias(self):
+        rebalancear(self.libro.id, 2)
+
+        for estrategia in (CompraRapidaService.BLOQUEO_PESIMISTA, CompraRapidaService.RESERVA_OPTIMISTA):
+            with self.subTest(estrategia=estrategia):
+                servicio = CompraRapidaService(procesador_pago=ProcesadorPagoExitoso(), estrategia=estrategia)
+                total = servicio.procesar(self.libro.id)
+
+                self.assertEqual(total, CalculadorImpuestos.obtener_total_con_iva(self.libro.precio))
+        self.assertEqual(self._principal(), 0)
+        self.assertEqual(stock_de(self.libro.id), 8)
+
+    def test_compra_rapida_sin_stock_en_fragmentos(self):
+        rebalancear(self.libro.id, 2)
+        InventarioFragmento.objects.filter(libro=self.libro).update(cantidad=0)
+        servicio = CompraRapidaService(procesador_pago=ProcesadorPagoExitoso())
+
+        with self.assertRaisesMessage(ValueError, "No hay existencias."):
+            servicio.procesar(self.libro.id)
+        self.assertFalse(Orden.objects.exists())
+
+    def test_compra_service_mezcla_libros_fragmentados_y_normales(self):
+        rebalancear(self.libro.id, 3)
+        otro = Libro.objects.create(titulo="Normal", precio=Decimal("5.00"))
+        Inventario.objects.create(libro=otro, cantidad=2)
+
+        CompraService(procesador_pago=ProcesadorPagoExitoso()).ejecutar_proceso_compra(
+            usuario="Lector",
+            lista_productos=[self.libro] * 5 + [otro],
+            direccion="EAFIT",
+        )
+
+        self.assertEqual(stock_de(self.libro.id), 5)
+        self.assertEqual(Inventario.objects.get(libro=otro).cantidad, 1)
+        self.assertEqual(Orden.objects.get().estado, Orden.Estado.CONFIRMADA)
+        with self.assertRaisesMessage(ValueError, "No hay existencias para 'Lanzamiento'."):
+            CompraService(procesador_pago=ProcesadorPagoExitoso()).ejecutar_proceso_compra(
+                usuario="Lector",
+                lista_productos=[self.libro] * 6,
+                direccion="EAFIT",
+            )
+
+    def test_pago_rechazado_devuelve_el_stock_a_la_fila_principal(self):
+        rebalancear(self.libro.id, 2)
+
+        self.assertIsNone(CompraRapidaService(procesador_pago=ProcesadorPagoFallido()).procesar(self.libro.id))
+
+        self.assertEqual(self._principal(), 1)
+        self.assertEqual(stock_de(self.libro.id), 10)
+
+    def test_catalogo_y_api_suman_los_fragmentos(self):
+        rebalancear(self.libro.id, 4)
+        Inventario.objects.filter(pk=self.inventario.pk).update(cantidad=1)
+        invalidar_catalogo()
+
+        self.assertEqual(obtener_catalogo()[0].stock_actual, 11)
+        productos = self.client.get(reverse("api_productos"), {"en_stock": "true"}).json()
+        self.assertEqual([producto["stock_actual"] for producto in productos], [11])
+        self.assertEqual(self.client.get(reverse("api_productos"), {"en_stock": "false"}).json(), [])
+        self.assertEqual(LibroSerializer(con_stock(Libro.objects.all()), many=True).data[0]["stock_actual"], 11)
+
+    def test_importar_catalogo_reparte_el_stock_del_archivo(self):
+        self.libro.sku = "LANZ-1"
+        self.libro.save()
+        rebalancear(self.libro.id, 2)
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ruta = Path(directorio.name) / "catalogo.csv"
+        ruta.write_text("sku,titulo,precio,cantidad\nLANZ-1,Lanzamiento,20.00,7\n", encoding="utf-8")
+
+        call_command("importar_catalogo", str(ruta), stdout=StringIO())
+
+        self.assertEqual(self._cantidades(), [4, 3])
+        self.assertEqual(self._principal(), 0)
+
+    def test_comando_rebalancear_inventario(self):
+        salida = StringIO()
+
+        call_command("rebalancear_inventario", self.libro.id, fragmentos=5, stdout=salida)
+        call_command("rebalancear_inventario", todos=True, stdout=salida)
+
+        self.assertEqual(self._cantidades(), [2] * 5)
+        self.assertIn(f"Libro {self.libro.id}: 10 unidades en 5 fragmentos", salida.getvalue())
+        with self.assertRaisesMessage(CommandError, "no tiene inventario"):
+            call_command("rebalancear_inventario", self.libro.id + 1, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "--fragmentos debe estar entre 0 y 64"):
+            call_command("rebalancear_inventario", self.libro.id, fragmentos=65, stdout=StringIO())
+
+
+class PaymentFactoryTestCase(TestCase):
+    def setUp(self):
+        PaymentFactory.reset()
+        self.addCleanup(PaymentFactory.reset)
+
+    def test_factory_retorna_mock_si_variable_de_entorno_es_mock(self):
+        with patch.dict(os.environ, {"PAYMENT_PROVIDER": "MOCK"}, clear=False):
+            procesador = PaymentFactory.get_processor()
+            self.assertIsInstance(procesador, MockPaymentProcessor)
+
+    def test_factory_retorna_banco_por_defecto(self):
+        with patch.dict(os.environ, {}, clear=False):
+            os.environ.pop("PAYMENT_PROVIDER", None)
+            procesador = PaymentFactory.get_processor()
+            self.assertIsInstance(procesador, BancoNacionalProcesador)
+
+
+    def test_factory_retorna_cliente_http_si_variable_de_entorno_es_http(self):
+        entorno = {"PAYMENT_PROVIDER": "HTTP", "PAGOS_API_URL": "http://pagos.local:5000"}
+        with patch.dict(os.environ, entorno, clear=False):
+            procesador = PaymentFactory.get_processor()
+
+        self.assertIsInstance(procesador, MicroservicioPagosProcesador)
+        self.assertEqual(procesador.pool.host, "pagos.local")
+        self.assertEqual(procesador.pool.puerto, 5000)
+
+
+    def test_compra_rapida_service_usa_el_proveedor_configurado(self):
+        with patch.dict(os.environ, {"PAYMENT_PROVIDER": "MOCK"}, clear=False):
+            servicio = CompraRapidaServiceView().setup_service()
+
+        self.assertIsInstance(servicio.procesador_pago, MockPaymentProcessor)
+
+    def test_factory_reutiliza_la_instancia_del_proveedor(self):
+        with patch.dict(os.environ, {"PAYMENT_PROVIDER": "MOCK"}, clear=False):
+            primero = PaymentFactory.get_processor()
+            segundo = PaymentFactory.get_processor()
+
+        self.assertIs(primero, segundo)
+
+    def test_factory_lee_el_entorno_una_sola_vez_hasta_reset(self):
+        with patch.dict(os.environ, {"PAYMENT_PROVIDER": "MOCK"}, clear=False):
+            PaymentFactory.get_processor()
+        with patch.dict(os.environ, {"PAYMENT_PROVIDER": "BANCO"}, clear=False):
+            self.assertIsInstance(PaymentFactory.get_processor(), MockPaymentProcessor)
+            PaymentFactory.reset()
+            self.assertIsInstance(PaymentFactory.get_processor(), BancoNacionalProcesador)
+
+    def test_factory_permite_registrar_nuevos_proveedores(self):
+        PaymentFactory.register_processor("PRUEBA", ProcesadorPagoExitoso)
+        self.addCleanup(PaymentFactory._constructores.pop, "PRUEBA")
+
+        with patch.dict(os.environ, {"PAYMENT_PROVIDER": "PRUEBA"}, clear=False):
+            procesador = PaymentFactory.get_processor()
+
+        self.assertIsInstance(procesador, ProcesadorPagoExitoso)
+        self.assertIs(PaymentFactory.get_processor("PRUEBA"), procesador)
+
+    def test_factory_construye_una_sola_instancia_entre_hilos(self):
+        construidos = []
+
+        def constructor():
+            construidos.append(1)
+            return ProcesadorPagoExitoso()
+
+        PaymentFactory.register_processor("CONCURRENTE", constructor)
+        self.addCleanup(PaymentFactory._constructores.pop, "CONCURRENTE")
+        resultados = []
+        hilos = [
+            threading.Thread(target=lambda: resultados.append(PaymentFactory.get_processor("CONCURRENTE")))
+            for _ in range(8)
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(len(construidos), 1)
+        self.assertEqual(len({id(procesador) for procesador in resultados}), 1)
+
+
+def _cargar_app_flask():
+    ruta = Path(__file__).resolve().parent.parent / "microservicio_pagos" / "app.py"
+    spec = importlib.util.spec_from_file_location("microservicio_pagos_app", ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo.app
+
+
+def _servidor_flask_local(app):
+    # El servidor de desarrollo de Werkzeug cierra cada conexion; este puente
+    # HTTP/1.1 mantiene keep-alive y delega cada request al cliente de Flask.
+    cliente = app.test_client()
+
+    class Puente(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            cuerpo = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            respuesta = cliente.post(self.path, data=cuerpo, headers=dict(self.headers))
+            contenido = respuesta.get_data()
+            self.send_response(respuesta.status_code)
+            self.send_header("Content-Type", respuesta.content_type)
+            self.send_header("Content-Length", str(len(contenido)))
+            self.end_headers()
+            self.wfile.write(contenido)
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", 0), Puente)
+
+
+@skipUnless(importlib.util.find_spec("flask"), "Flask no esta instalado en este entorno.")
+class MicroservicioPagosProcesadorTestCase(SimpleTestCase):
+    """Usa la app Flask real, servida en un hilo local, como pasarela de pagos."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = _servidor_flask_local(_cargar_app_flask())
+        cls.hilo = threading.Thread(target=cls.servidor.serve_forever, daemon=True)
+        cls.hilo.start()
+        cls.base_url = f"http://127.0.0.1:{cls.servidor.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.servidor.shutdown()
+        cls.servidor.server_close()
+        cls.hilo.join()
+        super().tearDownClass()
+
+    def test_pago_aprobado_por_el_microservicio(self):
+        procesador = MicroservicioPagosProcesador(base_url=self.base_url)
+
+        self.assertTrue(procesador.pagar(Decimal("119.00")))
+        self.assertEqual(procesador.circuit_breaker.estado, CircuitBreaker.CERRADO)
+
+    def test_reutiliza_la_conexion_keep_alive(self):
+        procesador = MicroservicioPagosProcesador(base_url=self.base_url)
+
+        for _ in range(3):
+            self.assertTrue(procesador.pagar(Decimal("10.00")))
+
+        self.assertEqual(procesador.pool.conexiones_creadas, 1)
+        procesador.pool.cerrar()
+
+    def test_ruta_inexistente_se_reporta_como_pago_rechazado(self):
+        procesador = MicroservicioPagosProcesador(base_url=f"{self.base_url}/no-existe", reintentos=0)
+
+        self.assertFalse(procesador.pagar(Decimal("10.00")))
+        self.assertEqual(procesador.circuit_breaker.estado, CircuitBreaker.CERRADO)
+
+
+class PoolQueFalla:
+    def __init__(self, respuestas):
+        self.respuestas = list(respuestas)
+        self.llamadas = 0
+        self.solicitudes = []
+
+    def solicitar(self, metodo, ruta, cuerpo=None, headers=None):
+        self.llamadas += 1
+        self.solicitudes.append((json.loads(cuerpo), headers))
+        respuesta = self.respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.ahora = 0.0
+        self.circuito = CircuitBreaker(umbral_fallos=2, tiempo_reapertura=10, reloj=lambda: self.ahora)
+
+    def _procesador(self, respuestas, reintentos=0):
+        return MicroservicioPagosProcesador(
+            base_url="http://pagos.local",
+            reintentos=reintentos,
+            espera_base=0,
+            pool=PoolQueFalla(respuestas),
+            circuit_breaker=self.circuito,
+        )
+
+    def test_reintenta_errores_de_red_y_5xx(self):
+        procesador = self._procesador(
+            [ConnectionRefusedError(), (503, b""), (200, b'{"status": "Aprobado"}')],
+            reintentos=2,
+        )
+
+        self.assertTrue(procesador.pagar(Decimal("10.00"), {7: 2}))
+        self.assertEqual(procesador.pool.llamadas, 3)
+        cuerpos = [cuerpo for cuerpo, _ in procesador.pool.solicitudes]
+        self.assertEqual(cuerpos[0], {"monto": "10.00", "producto_id": 7, "cantidad": 2})
+        # Los reintentos repiten la misma llave de idempotencia.
+        self.assertEqual(len({headers["Idempotency-Key"] for _, headers in procesador.pool.solicitudes}), 1)
+
+    def test_carrito_con_varios_titulos_se_cobra_por_monto(self):
+        procesador = self._procesador([(200, b'{"status": "Aprobado"}'), (200, b'{"status": "Aprobado"}')])
+
+        self.assertTrue(procesador.pagar(Decimal("30.00"), {7: 1, 8: 3}))
+        self.assertTrue(procesador.pagar(Decimal("30.00"), {7: 1, 8: 3}))
+
+        (primero, llave_1), (_, llave_2) = procesador.pool.solicitudes
+        self.assertEqual(primero, {"monto": "30.00"})
+        self.assertNotEqual(llave_1["Idempotency-Key"], llave_2["Idempotency-Key"])
+
+    def test_no_reintenta_rechazos_4xx(self):
+        procesador = self._procesador([(400, b'{"error": "x"}')], reintentos=2)
+
+        self.assertFalse(procesador.pagar(Decimal("10.00")))
+        self.assertEqual(procesador.pool.llamadas, 1)
+
+    def test_la_referencia_del_cobro_es_la_llave_de_idempotencia(self):
+        procesador = self._procesador([TimeoutError(), (200, b'{"status": "Aprobado"}')])
+
+        with self.assertRaises(PagoIndeterminado):
+            procesador.pagar(Decimal("10.00"), {7: 1}, "orden-42")
+        # La conciliacion repite el cobro con la misma llave y el servicio lo reconoce.
+        self.assertTrue(procesador.pagar(Decimal("10.00"), {7: 1}, "orden-42"))
+
+        self.assertEqual([headers["Idempotency-Key"] for _, headers in procesador.pool.solicitudes], ["orden-42"] * 2)
+
+    def test_sin_respuesta_tras_los_reintentos_el_cobro_queda_indeterminado(self):
+        procesador = self._procesador([TimeoutError(), (502, b""), ConnectionResetError()], reintentos=2)
+
+        with self.assertRaisesMessage(PagoIndeterminado, "tras 3 intentos"):
+            procesador.pagar(Decimal("10.00"))
+        self.assertEqual(procesador.pool.llamadas, 3)
+
+    def test_abre_el_circuito_tras_fallos_consecutivos(self):
+        procesador = self._procesador([TimeoutError(), TimeoutError()])
+
+        with self.assertRaises(PagoIndeterminado):
+            procesador.pagar(Decimal("10.00"))
+        with self.assertRaises(PagoIndeterminado):
+            procesador.pagar(Decimal("10.00"))
+        self.assertEqual(self.circuito.estado, CircuitBreaker.ABIERTO)
+
+        self.assertFalse(procesador.pagar(Decimal("10.00")))
+        self.assertEqual(procesador.pool.llamadas, 2)
+
+    def test_semiabierto_permite_una_prueba_y_cierra_si_funciona(self):
+        self.circuito.registrar_fallo()
+        self.circuito.registrar_fallo()
+        self.ahora = 10
+
+        self.assertEqual(self.circuito.estado, CircuitBreaker.SEMIABIERTO)
+        self.assertTrue(self.circuito.permitir())
+        self.assertFalse(self.circuito.permitir())
+
+        self.circuito.registrar_exito()
+        self.assertEqual(self.circuito.estado, CircuitBreaker.CERRADO)
+
+    def test_semiabierto_vuelve_a_abrir_si_la_prueba_falla(self):
+        self.circuito.registrar_fallo()
+        self.circuito.registrar_fallo()
+        self.ahora = 10
+        self.circuito.permitir()
+
+        self.circuito.registrar_fallo()
+
+        self.assertEqual(self.circuito.estado, CircuitBreaker.ABIERTO)
+
+
+class RegistroAuditoriaTestCase(SimpleTestCase):
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.ruta = Path(directorio.name) / "pagos.log"
+
+    def _lineas(self, ruta=None):
+        return [json.loads(linea) for linea in (ruta or self.ruta).read_text().splitlines()]
+
+    def test_escribe_eventos_como_json_lines(self):
+        registro = RegistroAuditoria(self.ruta)
+        self.addCleanup(registro.cerrar)
+
+        registro.registrar("transaccion_exitosa", monto=Decimal("119.00"))
+        registro.registrar("pago_fbv", libro_id=7, total=Decimal("50.00"))
+        registro.flush()
+
+        lineas = self._lineas()
+        self.assertEqual([linea["evento"] for linea in lineas], ["transaccion_exitosa", "pago_fbv"])
+        self.assertEqual(lineas[0]["monto"], "119.00")
+        self.assertEqual(lineas[1]["libro_id"], 7)
+        self.assertEqual(lineas[1]["pid"], os.getpid())
+
+    def test_escrituras_concurrentes_no_pierden_ni_mezclan_lineas(self):
+        registro = RegistroAuditoria(self.ruta)
+        self.addCleanup(registro.cerrar)
+
+        def escribir(hilo):
+            for indice in range(200):
+                registro.registrar("pago", hilo=hilo, indice=indice)
+
+        hilos = [threading.Thread(target=escribir, args=(numero,)) for numero in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        registro.flush()
+
+        self.assertEqual(len(self._lineas()), 800)
+
+    def test_rota_por_tamano(self):
+        registro = RegistroAuditoria(self.ruta, max_bytes=300, respaldos=2, tamano_lote=1)
+        self.addCleanup(registro.cerrar)
+
+        for indice in range(20):
+            registro.registrar("pago", indice=indice)
+        registro.flush()
+
+        self.assertLessEqual(self.ruta.stat().st_size, 300)
+        self.assertTrue(Path(f"{self.ruta}.1").exists())
+        self.assertTrue(Path(f"{self.ruta}.2").exists())
+        self.assertFalse(Path(f"{self.ruta}.3").exists())
+        self.assertEqual(self._lineas()[-1]["indice"], 19)
+
+    def test_workers_que_rotan_a_la_vez_no_pierden_el_archivo(self):
+        # Varias instancias sobre la misma ruta se comportan como varios workers.
+        registros = [RegistroAuditoria(self.ruta, max_bytes=400, respaldos=3, tamano_lote=1) for _ in range(4)]
+        for registro in registros:
+            self.addCleanup(registro.cerrar)
+
+        with self.assertNoLogs("tienda_app.infra.auditoria", "ERROR"):
+            for indice in range(200):
+                for numero, registro in enumerate(registros):
+                    registro.registrar("pago", worker=numero, indice=indice)
+            for registro in registros:
+                registro.flush()
+
+        for ruta in [self.ruta] + [Path(f"{self.ruta}.{indice}") for indice in range(1, 4)]:
+            self.assertLessEqual(ruta.stat().st_size, 400)
+            self._lineas(ruta)
+
+    def test_un_lote_fallido_no_detiene_el_hilo(self):
+        registro = RegistroAuditoria(self.ruta, tamano_lote=1)
+        self.addCleanup(registro.cerrar)
+        escribir = registro._escribir
+        fallos = [OSError("disco lleno")]
+
+        def escribir_fallando(registros):
+            if fallos:
+                raise fallos.pop()
+            escribir(registros)
+
+        with patch.object(registro, "_escribir", side_effect=escribir_fallando):
+            with self.assertLogs("tienda_app.infra.auditoria", "ERROR"):
+                registro.registrar("pago", indice=1)
+                registro.flush()
+            registro.registrar("pago", indice=2)
+            registro.flush()
+
+        self.assertEqual([linea["indice"] for linea in self._lineas()], [2])
+
+    def test_cola_llena_descarta_y_cuenta(self):
+        registro = RegistroAuditoria(self.ruta, tamano_lote=1, max_pendientes=2)
+        self.addCleanup(registro.cerrar)
+        escribir = registro._escribir
+        ocupado, liberar = threading.Event(), threading.Event()
+
+        def escribir_lento(registros):
+            ocupado.set()
+            liberar.wait(5)
+            escribir(registros)
+
+        with patch.object(registro, "_escribir", side_effect=escribir_lento):
+            registro.registrar("pago", indice=0)
+            self.assertTrue(ocupado.wait(5))
+            for indice in range(1, 4):
+                registro.registrar("pago", indice=indice)
+            self.assertEqual(registro.descartados, 1)
+
+            with self.assertLogs("tienda_app.infra.auditoria", "WARNING"):
+                liberar.set()
+                registro.flush()
+
+        self.assertEqual([linea["indice"] for linea in self._lineas()], [0, 1, 2])
+
+    def test_cerrar_vacia_la_cola(self):
+        registro = RegistroAuditoria(self.ruta)
+
+        for indice in range(50):
+            registro.registrar("pago", indice=indice)
+        registro.cerrar()
+
+        self.assertEqual(len(self._lineas()), 50)
+
+    def test_obtener_registro_comparte_la_instancia_por_ruta(self):
+        self.assertIs(obtener_registro(self.ruta), obtener_registro(str(self.ruta)))
+
+    def test_banco_registra_el_pago_en_la_bitacora(self):
+        registro = RegistroAuditoria(self.ruta)
+        self.addCleanup(registro.cerrar)
+
+        with patch("tienda_app.infra.gateways.obtener_registro", return_value=registro):
+            self.assertTrue(BancoNacionalProcesador().pagar(Decimal("10.00")))
+        registro.flush()
+
+        self.assertEqual(self._lineas()[0]["evento"], "transaccion_exitosa")
+
+
+class IndicesOrdenesTestCase(TestCase):
+    def _indices(self, modelo):
+        with connection.cursor() as cursor:
+            restricciones = connection.introspection.get_constraints(cursor, modelo._meta.db_table)
+        return {nombre: datos["columns"] for nombre, datos in restricciones.items() if datos["index"]}
+
+    def test_indices_de_rutas_calientes_existen(self):
+        self.assertEqual(self._indices(Orden)["orden_usuario_fecha_idx"], ["usuario", "fecha_creacion"])
+        self.assertEqual(self._indices(Orden)["orden_fecha_idx"], ["fecha_creacion"])
+        self.assertEqual(self._indices(OrdenItem)["ordenitem_libro_orden_idx"], ["libro_id", "orden_id"])
+        self.assertEqual(self._indices(Inventario)["inventario_disponible_idx"], ["libro_id"])
+
+    @skipUnless(connection.vendor == "postgresql", "EXPLAIN con nombres de indice requiere PostgreSQL.")
+    def test_planes_de_rutas_calientes_usan_indices(self):
+        libro = Libro.objects.create(titulo="Libro Plan", precio=Decimal("10.00"))
+        Inventario.objects.create(libro=libro, cantidad=3)
+        orden = Orden.objects.create(libro=libro, usuario="lector", total=Decimal("11.90"))
+        OrdenItem.objects.create(orden=orden, libro=libro, cantidad=1, precio_unitario=Decimal("10.00"))
+        desde = timezone.now() - timedelta(days=1)
+
+        with connection.cursor() as cursor:
+            # Con tablas casi vacias el planner prefiere seq scan; se desactiva solo en esta transaccion.
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        planes = [
+            (Orden.objects.filter(usuario="lector", fecha_creacion__gte=desde), {"orden_usuario_fecha_idx"}),
+            (Orden.objects.filter(fecha_creacion__gte=desde), {"orden_fecha_idx"}),
+            (OrdenItem.objects.filter(libro=libro), {"ordenitem_libro_orden_idx"}),
+            # Ambos indices cubren cantidad > 0; el planner elige segun el tamano de cada uno.
+            (
+                Inventario.objects.filter(cantidad__gt=0).values_list("libro_id", flat=True),
+                {"inventario_disponible_idx", "inventario_stock_idx"},
+            ),
+        ]
+
+        for queryset, indices in planes:
+            with self.subTest(indices=sorted(indices)):
+                plan = queryset.explain()
+                self.assertNotIn("Seq Scan", plan)
+                self.assertTrue(any(indice in plan for indice in indices), plan)
+
+
+class CompraAPITestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="API Libro", precio=Decimal("80.00"))
+        Inventario.objects.create(libro=self.libro, cantidad=1)
+        self.url = reverse("api_comprar")
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_api_compra_exitosa_descuenta_stock(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+
+        response = self.client.post(
+            self.url,
+            data=json.dumps(
+                {
+                    "libro_id": self.libro.id,
+                    "direccion_envio": "Calle 123",
+                }
+            ),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["estado"], "exito")
+        self.assertEqual(Orden.objects.count(), 1)
+        self.assertEqual(Orden.objects.get().items.count(), 1)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 0)
+        mock_get_processor.assert_called_once()
+
+    def test_api_valida_payload(self):
+        response = self.client.post(
+            self.url,
+            data=json.dumps({"direccion_envio": "Sin libro"}),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("libro_id", response.json())
+
+    def test_api_retorna_404_si_libro_no_existe(self):
+        response = self.client.post(
+            self.url,
+            data=json.dumps(
+                {
+                    "libro_id": 99999,
+                    "direccion_envio": "Calle 404",
+                }
+            ),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["error"], "Libro no encontrado.")
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_api_retorna_409_si_no_hay_stock(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+        inventario = Inventario.objects.get(libro=self.libro)
+        inventario.cantidad = 0
+        inventario.save(update_fields=["cantidad"])
+
+        response = self.client.post(
+            self.url,
+            data=json.dumps(
+                {
+                    "libro_id": self.libro.id,
+                    "direccion_envio": "Calle sin stock",
+                }
+            ),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("No hay existencias", response.json()["error"])
+
+    @override_settings(CATALOGO_STOCK_STALENESS=0)
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_api_compra_refleja_cambio_en_vista_html_inventario(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+        inventario_url = reverse("inventario")
+
+        before_response = self.client.get(inventario_url)
+        before_stock = next(
+            item["stock_actual"]
+            for item in before_response.context["items"]
+            if item["libro"].id == self.libro.id
+        )
+
+        self.client.post(
+            self.url,
+            data=json.dumps(
+                {
+                    "libro_id": self.libro.id,
+                    "direccion_envio": "Calle HTML",
+                }
+            ),
+            content_type="application/json",
+        )
+
+        after_response = self.client.get(inventario_url)
+        after_stock = next(
+            item["stock_actual"]
+            for item in after_response.context["items"]
+            if item["libro"].id == self.libro.id
+        )
+
+        self.assertEqual(before_stock, 1)
+        self.assertEqual(after_stock, 0)
+
+
+class CompraLoteAPITestCase(TestCase):
+    def setUp(self):
+        self.libro_a = Libro.objects.create(titulo="Lote A", precio=Decimal("100.00"))
+        self.libro_b = Libro.objects.create(titulo="Lote B", precio=Decimal("50.00"))
+        Inventario.objects.create(libro=self.libro_a, cantidad=3)
+        Inventario.objects.create(libro=self.libro_b, cantidad=1)
+        self.url = reverse("api_comprar_lote")
+
+    def _post(self, payload):
+        return self.client.post(self.url, data=json.dumps(payload), content_type="application/json")
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_api_lote_crea_una_orden_con_un_solo_pago(self, mock_get_processor):
+        procesador = ProcesadorPagoExitoso()
+        mock_get_processor.return_value = procesador
+
+        response = self._post(
+            {
+                "lineas": [
+                    {"libro_id": self.libro_a.id, "cantidad": 2},
+                    {"libro_id": self.libro_b.id, "cantidad": 1},
+                ],
+                "direccion_envio": "Calle Lote",
+            }
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["estado"], "exito")
+        self.assertEqual(Orden.objects.count(), 1)
+        orden = Orden.objects.get()
+        self.assertEqual(orden.total, Decimal("297.50"))
+        self.assertEqual(orden.direccion_envio, "Calle Lote")
+        self.assertEqual(procesador.montos, [Decimal("297.50")])
+        self.assertEqual(orden.items.get(libro=self.libro_a).cantidad, 2)
+        self.assertEqual(orden.items.get(libro=self.libro_b).cantidad, 1)
+        self.assertEqual(Inventario.objects.get(libro=self.libro_a).cantidad, 1)
+        self.assertEqual(Inventario.objects.get(libro=self.libro_b).cantidad, 0)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_api_lote_acumula_lineas_repetidas(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+
+        response = self._post(
+            {
+                "lineas": [
+                    {"libro_id": self.libro_a.id, "cantidad": 1},
+                    {"libro_id": self.libro_a.id, "cantidad": 2},
+                ],
+                "direccion_envio": "Calle Lote",
+            }
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Orden.objects.get().items.get().cantidad, 3)
+        self.assertEqual(Inventario.objects.get(libro=self.libro_a).cantidad, 0)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_api_lote_carga_libros_en_una_sola_consulta(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+        payload = {
+            "lineas": [{"libro_id": self.libro_a.id, "cantidad": 1}, {"libro_id": self.libro_b.id, "cantidad": 1}],
+            "direccion_envio": "Calle Lote",
+        }
+
+        with CaptureQueriesContext(connection) as consultas:
+            response = self._post(payload)
+
+        self.assertEqual(response.status_code, 201)
+        consultas_libro = [
+            consulta["sql"]
+            for consulta in consultas.captured_queries
+            if 'FROM "tienda_app_libro"' in consulta["sql"]
+        ]
+        self.assertEqual(len(consultas_libro), 1)
+
+    def test_api_lote_retorna_404_con_ids_faltantes(self):
+        response = self._post(
+            {
+                "lineas": [
+                    {"libro_id": self.libro_a.id, "cantidad": 1},
+                    {"libro_id": 99999, "cantidad": 1},
+                ],
+                "direccion_envio": "Calle Lote",
+            }
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()["libro_ids"], [99999])
+        self.assertEqual(Orden.objects.count(), 0)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_api_lote_retorna_409_y_no_descuenta_si_falta_stock(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+
+        response = self._post(
+            {
+                "lineas": [
+                    {"libro_id": self.libro_a.id, "cantidad": 1},
+                    {"libro_id": self.libro_b.id, "cantidad": 2},
+                ],
+                "direccion_envio": "Calle Lote",
+            }
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("No hay existencias", response.json()["error"])
+        self.assertEqual(Orden.objects.count(), 0)
+        self.assertEqual(Inventario.objects.get(libro=self.libro_a).cantidad, 3)
+
+    def test_api_lote_valida_lineas(self):
+        response = self._post({"lineas": [], "direccion_envio": "Calle Lote"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("lineas", response.json())
+
+
+class IdempotenciaAPITestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="Libro Idempotente", precio=Decimal("100.00"))
+        Inventario.objects.create(libro=self.libro, cantidad=5)
+        self.url = reverse("api_comprar")
+        respuestas_recientes.limpiar()
+        self.addCleanup(respuestas_recientes.limpiar)
+
+    def _post(self, clave, payload=None, url=None, ip="127.0.0.1"):
+        payload = payload or {"libro_id": self.libro.id, "direccion_envio": "Calle Reintento"}
+        return self.client.post(
+            url or self.url,
+            data=json.dumps(payload),
+            content_type="application/json",
+            headers={"Idempotency-Key": clave},
+            REMOTE_ADDR=ip,
+        )
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_reintento_repite_respuesta_sin_cobrar_ni_descontar(self, mock_get_processor):
+        procesador = ProcesadorPagoExitoso()
+        mock_get_processor.return_value = procesador
+
+        primera = self._post("clave-1")
+        with CaptureQueriesContext(connection) as consultas:
+            segunda = self._post("clave-1")
+
+        self.assertEqual(primera.status_code, 201)
+        self.assertEqual(segunda.status_code, 201)
+        self.assertEqual(segunda.json(), primera.json())
+        self.assertEqual(segunda["Idempotent-Replayed"], "true")
+        self.assertEqual(len(consultas), 0)
+        self.assertEqual(len(procesador.montos), 1)
+        self.assertEqual(Orden.objects.count(), 1)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 4)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_reintento_se_resuelve_desde_la_tabla_si_el_cache_no_lo_tiene(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+
+        primera = self._post("clave-2")
+        respuestas_recientes.limpiar()
+        with CaptureQueriesContext(connection) as consultas:
+            segunda = self._post("clave-2")
+
+        self.assertEqual(segunda.json(), primera.json())
+        self.assertFalse(any("tienda_app_inventario" in consulta["sql"] for consulta in consultas.captured_queries))
+        self.assertEqual(Orden.objects.count(), 1)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_misma_clave_con_otro_payload_retorna_422(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+
+        self._post("clave-3")
+        response = self._post("clave-3", {"libro_id": self.libro.id, "direccion_envio": "Otra calle"})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Orden.objects.count(), 1)
+
+    def test_solicitud_en_curso_retorna_409(self):
+        SolicitudIdempotente.objects.create(cliente="ip:127.0.0.1", ruta=self.url, clave="clave-4", huella="x")
+
+        response = self._post("clave-4")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Orden.objects.count(), 0)
+
+    @override_settings(IDEMPOTENCIA_RESERVA_SEGUNDOS=60)
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_solicitud_en_curso_que_no_respondio_se_reclama_al_vencer_la_reserva(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+        colgada = SolicitudIdempotente.objects.create(cliente="ip:127.0.0.1", ruta=self.url, clave="clave-7", huella="x")
+        SolicitudIdempotente.objects.filter(pk=colgada.pk).update(creada=timezone.now() - timedelta(seconds=61))
+
+        response = self._post("clave-7")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(SolicitudIdempotente.objects.get(clave="clave-7").estado, SolicitudIdempotente.Estado.COMPLETADA)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_la_clave_es_propia_de_cada_cliente_y_ruta(self, mock_get_processor):
+        procesador = ProcesadorPagoExitoso()
+        mock_get_processor.return_value = procesador
+        lote = {"lineas": [{"libro_id": self.libro.id, "cantidad": 1}], "direccion_envio": "Calle Reintento"}
+
+        primera = self._post("compartida", ip="10.0.0.1")
+        otro_cliente = self._post("compartida", ip="10.0.0.2")
+        otra_ruta = self._post("compartida", lote, reverse("api_comprar_lote"), ip="10.0.0.1")
+        User.objects.create_user("lector", password="clave-segura")
+        self.client.login(username="lector", password="clave-segura")
+        autenticado = self._post("compartida", ip="10.0.0.1")
+
+        respuestas = (primera, otro_cliente, otra_ruta, autenticado)
+        self.assertEqual([response.status_code for response in respuestas], [201] * 4)
+        self.assertEqual(len({response.json()["orden_id"] for response in respuestas}), 4)
+        self.assertEqual(len(procesador.montos), 4)
+
+    def test_detras_de_nginx_el_cliente_es_la_ip_que_agrega_el_proxy(self):
+        with patch("tienda_app.api.idempotencia._reservar_clave", side_effect=AssertionError) as reservar:
+            with self.assertRaises(AssertionError):
+                self.client.post(
+                    self.url,
+                    data="{}",
+                    content_type="application/json",
+                    headers={"Idempotency-Key": "clave-8", "X-Forwarded-For": "1.1.1.1, 203.0.113.7"},
+                    REMOTE_ADDR="172.18.0.5",
+                )
+
+        self.assertEqual(reservar.call_args.args[0], ("ip:203.0.113.7", self.url, "clave-8"))
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_error_5xx_no_se_guarda_y_permite_reintentar(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoConError()
+        with self.assertLogs("tienda_app.services", "ERROR"):
+            fallida = self._post("clave-5")
+
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+        reintento = self._post("clave-5")
+
+        self.assertEqual(fallida.status_code, 500)
+        self.assertEqual(reintento.status_code, 201)
+        self.assertEqual(Orden.objects.filter(estado=Orden.Estado.CONFIRMADA).count(), 1)
+        self.assertEqual(Orden.objects.filter(estado=Orden.Estado.POR_VERIFICAR).count(), 1)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_lote_tambien_es_idempotente(self, mock_get_processor):
+        procesador = ProcesadorPagoExitoso()
+        mock_get_processor.return_value = procesador
+        payload = {"lineas": [{"libro_id": self.libro.id, "cantidad": 2}], "direccion_envio": "Calle Lote"}
+
+        self._post("clave-6", payload, reverse("api_comprar_lote"))
+        segunda = self._post("clave-6", payload, reverse("api_comprar_lote"))
+
+        self.assertEqual(segunda.status_code, 201)
+        self.assertEqual(len(procesador.montos), 1)
+        self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 3)
+
+    @override_settings(IDEMPOTENCIA_TTL_HORAS=1)
+    def test_purgar_idempotencia_elimina_claves_vencidas(self):
+        vieja = SolicitudIdempotente.objects.create(clave="vieja", huella="x")
+        SolicitudIdempotente.objects.filter(pk=vieja.pk).update(creada=timezone.now() - timedelta(hours=2))
+        SolicitudIdempotente.objects.create(clave="nueva", huella="x")
+        salida = StringIO()
+
+        call_command("purgar_idempotencia", stdout=salida)
+
+        self.assertIn("eliminadas: 1", salida.getvalue())
+        self.assertEqual(list(SolicitudIdempotente.objects.values_list("clave", flat=True)), ["nueva"])
+
+
+class ReporteVentasTestCase(TestCase):
+    def setUp(self):
+        self.libro_a = Libro.objects.create(titulo="Reporte A", precio=Decimal("10.00"))
+        self.libro_b = Libro.objects.create(titulo="Reporte B", precio=Decimal("25.00"))
+        self.hoy = timezone.now()
+        self.ayer = self.hoy - timedelta(days=1)
+        self.url = reverse("api_reporte_ventas")
+
+    def _orden(self, lineas, fecha, estado=Orden.Estado.CONFIRMADA):
+        confirmada_en = fecha if estado == Orden.Estado.CONFIRMADA else None
+        orden = Orden.objects.create(usuario="lector", total=Decimal("0.00"), estado=estado, confirmada_en=confirmada_en)
+        Orden.objects.filter(pk=orden.pk).update(fecha_creacion=fecha)
+        for libro, cantidad in lineas:
+            OrdenItem.objects.create(orden=orden, libro=libro, cantidad=cantidad, precio_unitario=libro.precio)
+        return orden
+
+    def _datos_base(self):
+        self._orden([(self.libro_a, 2), (self.libro_b, 1)], self.ayer)
+        self._orden([(self.libro_a, 1)], self.hoy)
+        self._orden([(self.libro_b, 4)], self.hoy, estado=Orden.Estado.PENDIENTE)
+
+    def test_reporte_vivo_agrega_solo_ordenes_confirmadas(self):
+        self._datos_base()
+
+        reporte = reporte_ventas(fuente="vivo")
+
+        self.assertEqual(
+            reporte["por_libro"],
+            [
+                {"libro_id": self.libro_a.id, "titulo": "Reporte A", "unidades": 3, "ingresos": "30.00", "ingresos_con_iva": "35.70"},
+                {"libro_id": self.libro_b.id, "titulo": "Reporte B", "unidades": 1, "ingresos": "25.00", "ingresos_con_iva": "29.75"},
+            ],
+        )
+        self.assertEqual(
+            reporte["por_dia"],
+            [
+                {"fecha": self.ayer.date().isoformat(), "unidades": 3, "ingresos": "45.00", "ingresos_con_iva": "53.55"},
+                {"fecha": self.hoy.date().isoformat(), "unidades": 1, "ingresos": "10.00", "ingresos_con_iva": "11.90"},
+            ],
+        )
+        self.assertEqual(reporte["total"], {"unidades": 4, "ingresos": "55.00", "ingresos_con_iva": "65.45"})
+
+    def test_reporte_no_carga_filas_en_python(self):
+        self._datos_base()
+
+        with CaptureQueriesContext(connection) as consultas:
+            reporte_ventas(fuente="vivo")
+
+        self.assertLessEqual(len(consultas), 3)
+        self.assertTrue(all("SUM(" in consulta["sql"] for consulta in consultas.captured_queries[:2]))
+
+    @override_settings(REPORTES_VENTAS_MARGEN_SEGUNDOS=60)
+    def test_refresco_consolida_y_resumen_coincide_con_vivo(self):
+        self._datos_base()
+        self._orden([(self.libro_b, 2)], self.ayer - timedelta(days=1))
+        pendiente = Orden.objects.get(estado=Orden.Estado.PENDIENTE)
+
+        # Con lote=1 cada ventana toma los items de una confirmacion; la orden de
+        # hoy todavia esta dentro del margen.
+        consolidados = refrescar_ventas_diarias(lote=1)
+        venta = VentaDiaria.objects.get(fecha=self.ayer.date(), libro=self.libro_a)
+
+        self.assertEqual(consolidados, 3)
+        self.assertEqual((venta.unidades, venta.ingresos), (2, Decimal("20.00")))
+        self.assertEqual(reporte_ventas(fuente="resumen"), {**reporte_ventas(fuente="vivo"), "fuente": "resumen"})
+
+        # Confirmada despues de que la marca paso por su dia: cuenta en su dia igual.
+        Orden.objects.filter(pk=pendiente.pk).update(estado=Orden.Estado.CONFIRMADA, confirmada_en=timezone.now())
+        self.assertEqual(reporte_ventas(fuente="resumen"), {**reporte_ventas(fuente="vivo"), "fuente": "resumen"})
+        despues_del_margen = timezone.now() + timedelta(minutes=2)
+        self.assertEqual(refrescar_ventas_diarias(ahora=despues_del_margen), 2)
+        self.assertEqual(refrescar_ventas_diarias(ahora=despues_del_margen), 0)
+        self.assertEqual(VentaDiaria.objects.get(fecha=self.hoy.date(), libro=self.libro_b).unidades, 4)
+        self.assertEqual(reporte_ventas(fuente="resumen")["total"], {"unidades": 10, "ingresos": "205.00", "ingresos_con_iva": "243.95"})
+
+    @override_settings(REPORTES_VENTAS_MARGEN_SEGUNDOS=60)
+    def test_orden_cobrada_tarde_tras_liberar_la_reserva_entra_al_resumen(self):
+        Inventario.objects.create(libro=self.libro_a, cantidad=5)
+        orden = self._orden([(self.libro_a, 1)], self.ayer, estado=Orden.Estado.PENDIENTE)
+        Orden.objects.filter(pk=orden.pk).update(reservada_hasta=timezone.now() - timedelta(minutes=10))
+        self._orden([(self.libro_b, 1)], self.ayer)
+        self.assertEqual(liberar_reservas_expiradas(), 1)
+        self.assertEqual(refrescar_ventas_diarias(), 1)
+
+        # El cobro aprobado llega tarde: la orden liberada se retoma y se confirma ahora.
+        _confirmar_orden(orden, {self.libro_a.id: 1})
+        self.assertEqual(refrescar_ventas_diarias(ahora=timezone.now() + timedelta(minutes=2)), 1)
+
+        venta = VentaDiaria.objects.get(fecha=self.ayer.date(), libro=self.libro_a)
+        self.assertEqual(venta.unidades, 1)
+        self.assertEqual(reporte_ventas(fuente="resumen"), {**reporte_ventas(fuente="vivo"), "fuente": "resumen"})
+
+    @override_settings(REPORTES_VENTAS_MARGEN_SEGUNDOS=3600)
+    def test_refresco_respeta_el_margen_de_ordenes_recientes(self):
+        self._orden([(self.libro_a, 1)], self.ayer)
+        self._orden([(self.libro_a, 5)], self.hoy)
+
+        self.assertEqual(refrescar_ventas_diarias(), 1)
+        self.assertEqual(reporte_ventas()["total"]["unidades"], 6)
+
+    def _login_staff(self):
+        self.client.force_login(User.objects.create_user("finanzas", password="clave-segura", is_staff=True))
+
+    def test_api_reporte_solo_para_staff(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        self.client.force_login(User.objects.create_user("lector", password="clave-segura"))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_api_reporte_filtra_por_fecha_y_libro(self):
+        self._datos_base()
+        self._login_staff()
+
+        response = self.client.get(
+            self.url,
+            {"desde": self.hoy.date().isoformat(), "hasta": self.hoy.date().isoformat(), "libro_id": self.libro_a.id},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total"], {"unidades": 1, "ingresos": "10.00", "ingresos_con_iva": "11.90"})
+
+    def test_api_reporte_valida_rango(self):
+        self._login_staff()
+        response = self.client.get(self.url, {"desde": "2026-02-01", "hasta": "2026-01-01"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_refrescar_ventas_command(self):
+        self._orden([(self.libro_a, 1)], self.ayer)
+        salida = StringIO()
+
+        call_command("refrescar_ventas", stdout=salida)
+
+        self.assertIn("Items consolidados: 1", salida.getvalue())
+
+
+class ExportacionOrdenesTestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="Libro Export", precio=Decimal("12.50"))
+        self.ayer = timezone.now() - timedelta(days=1)
+        self.url = reverse("api_exportar_ordenes")
+
+    def _orden(self, cantidades, fecha=None, estado=Orden.Estado.CONFIRMADA):
+        orden = Orden.objects.create(usuario="finanzas", total=Decimal("10.00"), estado=estado)
+        Orden.objects.filter(pk=orden.pk).update(fecha_creacion=fecha or self.ayer)
+        for indice, cantidad in enumerate(cantidades):
+            libro = self.libro if indice == 0 else Libro.objects.create(titulo=f"Extra {indice}", precio=Decimal("1.00"))
+            OrdenItem.objects.create(orden=orden, libro=libro, cantidad=cantidad, precio_unitario=libro.precio)
+        return orden
+
+    def _exportar(self, *args):
+        salida = StringIO()
+        call_command("exportar_ordenes", *args, stdout=salida, stderr=StringIO())
+        return salida.getvalue()
+
+    def test_csv_tiene_una_fila_por_item(self):
+        con_items = self._orden([2, 1])
+        sin_items = self._orden([])
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = Path(directorio) / "ordenes.csv"
+            call_command("exportar_ordenes", "--salida", str(ruta), stderr=StringIO())
+            with ruta.open(newline="", encoding="utf-8") as archivo:
+                filas = list(csv.DictReader(archivo))
+
+        self.assertEqual([int(fila["orden_id"]) for fila in filas], [con_items.id, con_items.id, sin_items.id])
+        self.assertEqual(filas[0]["cantidad"], "2")
+        self.assertEqual(filas[0]["precio_unitario"], "12.50")
+        self.assertEqual(filas[2]["item_id"], "")
+
+    def test_ndjson_anida_items_y_filtra_por_fecha(self):
+        self._orden([1], fecha=self.ayer - timedelta(days=10))
+        reciente = self._orden([3])
+
+        lineas = self._exportar("--formato", "ndjson", "--desde", self.ayer.date().isoformat()).splitlines()
+        registros = [json.loads(linea) for linea in lineas]
+
+        self.assertEqual([registro["orden_id"] for registro in registros], [reciente.id])
+        self.assertEqual(registros[0]["items"][0]["cantidad"], 3)
+
+    def test_iterador_lee_items_por_bloques(self):
+        for _ in range(5):
+            self._orden([1])
+
+        with CaptureQueriesContext(connection) as consultas:
+            ordenes = list(ordenes_para_exportar(chunk_size=2))
+
+        consultas_items = [c for c in consultas.captured_queries if 'FROM "tienda_app_ordenitem"' in c["sql"]]
+        self.assertEqual(len(ordenes), 5)
+        self.assertEqual(len(consultas_items), 3)
+
+    @override_settings(REPORTES_VENTAS_MARGEN_SEGUNDOS=60)
+    def test_modo_incremental_continua_desde_la_marca(self):
+        primera = self._orden([1])
+        pendiente = self._orden([1], estado=Orden.Estado.PENDIENTE)
+
+        lineas = self._exportar("--formato", "ndjson", "--incremental").splitlines()
+        self.assertEqual([json.loads(linea)["orden_id"] for linea in lineas], [primera.id])
+        self.assertEqual(self._exportar("--formato", "ndjson", "--incremental"), "")
+
+        Orden.objects.filter(pk=pendiente.pk).update(estado=Orden.Estado.CONFIRMADA)
+        lineas = self._exportar("--formato", "ndjson", "--incremental").splitlines()
+        self.assertEqual([json.loads(linea)["orden_id"] for linea in lineas], [pendiente.id])
+
+    def test_api_exporta_en_streaming_solo_para_staff(self):
+        self._orden([1])
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        staff = User.objects.create_user("finanzas", password="clave-segura", is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(self.url, {"formato": "ndjson", "desde_id": 0})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        contenido = b"".join(response.streaming_content).decode()
+        self.assertEqual(len(contenido.splitlines()), 1)
+
+    async def test_api_bajo_asgi_escribe_con_el_cursor_async(self):
+        for cantidad in (1, 2):
+            await sync_to_async(self._orden)([cantidad, 1])
+        staff = await sync_to_async(User.objects.create_user)("finanzas", password="clave-segura", is_staff=True)
+        await self.async_client.aforce_login(staff)
+
+        response = await self.async_client.get(self.url, {"formato": "csv"})
+
+        self.assertEqual(response.status_code, 200)
+        # Un iterador sync se juntaria entero con sync_to_async(list) antes de enviarse.
+        self.assertTrue(response.is_async)
+        filas = [fila async for fila in response.streaming_content]
+        self.assertEqual(len(filas), 5)
+        self.assertTrue(filas[0].startswith(b"orden_id,"))
+        self.assertEqual([fila.split(b",")[8] for fila in filas[1:]], [b"1", b"1", b"2", b"1"])
+
+
+class ImportarCatalogoTestCase(TestCase):
+    def _archivo(self, nombre, contenido):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        ruta = Path(directorio.name) / nombre
+        ruta.write_text(contenido, encoding="utf-8")
+        return str(ruta)
+
+    def _importar(self, ruta, *args):
+        salida, errores = StringIO(), StringIO()
+        call_command("importar_catalogo", ruta, *args, stdout=salida, stderr=errores)
+        return salida.getvalue(), errores.getvalue()
+
+    def test_csv_crea_y_actualiza_por_sku_en_lotes(self):
+        existente = Libro.objects.create(sku="SKU-1", titulo="Titulo viejo", precio=Decimal("1.00"))
+        Inventario.objects.create(libro=existente, cantidad=1)
+        ruta = self._archivo(
+            "catalogo.csv",
+            "sku,titulo,precio,cantidad\n"
+            "SKU-1,Titulo nuevo,20.5,7\n"
+            "SKU-2,Segundo,10.00,3\n"
+            "SKU-3,Sin stock informado,5.00,\n",
+        )
+
+        with CaptureQueriesContext(connection) as consultas:
+            salida, _ = self._importar(ruta, "--lote", "2")
+
+        existente.refresh_from_db()
+        self.assertEqual((existente.titulo, existente.precio), ("Titulo nuevo", Decimal("20.50")))
+        self.assertEqual(existente.inventario.cantidad, 7)
+        self.assertEqual(Inventario.objects.get(libro__sku="SKU-2").cantidad, 3)
+        self.assertFalse(Inventario.objects.filter(libro__sku="SKU-3").exists())
+        self.assertEqual(Libro.objects.count(), 3)
+        self.assertIn("3 filas en 2 lotes", salida)
+        self.assertLessEqual(len(consultas), 12)
+
+    def test_ndjson_salta_filas_invalidas_y_las_reporta(self):
+        ruta = self._archivo(
+            "catalogo.ndjson",
+            '{"sku": "A", "titulo": "Valido", "precio": "9.99", "cantidad": 2}\n'
+            '{"sku": "B", "titulo": "Precio malo", "precio": "abc"}\n'
+            "no es json\n"
+            '{"sku": "C", "titulo": "Stock negativo", "precio": "1", "cantidad": -1}\n'
+            '{"sku": "D", "titulo": "Precio NaN", "precio": "NaN", "cantidad": 1}\n'
+            '{"sku": "E", "titulo": "Despues del NaN", "precio": "3.00"}\n',
+        )
+
+        salida, errores = self._importar(ruta)
+
+        self.assertEqual(list(Libro.objects.order_by("sku").values_list("sku", flat=True)), ["A", "E"])
+        self.assertIn("4 invalidas", salida)
+        self.assertIn("linea 2: precio invalido", errores)
+        self.assertIn("linea 3:", errores)
+        self.assertIn("linea 4: cantidad negativa", errores)
+        self.assertIn("linea 5: precio invalido: 'NaN'", errores)
+
+    def test_sku_repetido_en_un_lote_gana_la_ultima_fila(self):
+        ruta = self._archivo(
+            "catalogo.json",
+            json.dumps(
+                [
+                    {"sku": "R", "titulo": "Primera", "precio": "1.00", "cantidad": 1},
+                    {"sku": "R", "titulo": "Ultima", "precio": "2.00", "cantidad": 5},
+                ]
+            ),
+        )
+
+        self._importar(ruta)
+
+        libro = Libro.objects.get(sku="R")
+        self.assertEqual((libro.titulo, libro.inventario.cantidad), ("Ultima", 5))
+
+    def test_importacion_invalida_el_catalogo_en_cache(self):
+        Libro.objects.create(titulo="Previo", precio=Decimal("3.00"))
+        self.client.get(reverse("home"))
+        ruta = self._archivo("catalogo.csv", "sku,titulo,precio,cantidad\nN-1,Recien importado,4.00,2\n")
+
+        self._importar(ruta)
+
+        self.assertContains(self.client.get(reverse("home")), "Recien importado")
+
+    def test_formato_no_soportado(self):
+        with self.assertRaisesMessage(CommandError, "Formato no soportado"):
+            self._importar(self._archivo("catalogo.xml", "<libros/>"))
 
-    def test_compra_rapida_fbv_get_usa_calculo_canonico(self):
-        response = self.client.get(reverse("compra_rapida_fbv", args=[self.libro.id]))
+
+class ProductosAPITestCase(TestCase):
+    def setUp(self):
+        self.libro_b = Libro.objects.create(titulo="Libro B", precio=Decimal("55.00"))
+        self.libro_a = Libro.objects.create(titulo="Libro A", precio=Decimal("40.00"))
+        Inventario.objects.create(libro=self.libro_b, cantidad=2)
+        Inventario.objects.create(libro=self.libro_a, cantidad=5)
+        self.url = reverse("api_productos")
+
+    def test_api_productos_lista_libros_y_stock(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            [
+                {
+                    "id": self.libro_b.id,
+                    "titulo": "Libro B",
+                    "precio": "55.00",
+                    "categoria": "",
+                    "stock_actual": 2,
+                },
+                {
+                    "id": self.libro_a.id,
+                    "titulo": "Libro A",
+                    "precio": "40.00",
+                    "categoria": "",
+                    "stock_actual": 5,
+                },
+            ],
+        )
+
+    def test_api_productos_mantiene_orden_estable_por_id(self):
+        response = self.client.get(self.url)
+
+        ids = [item["id"] for item in response.json()]
+        self.assertEqual(ids, sorted(ids))
+
+
+class CatalogoCacheTestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="Libro Cache", precio=Decimal("30.00"))
+        self.inventario = Inventario.objects.create(libro=self.libro, cantidad=4)
+        self.url = reverse("api_productos")
+
+    def _stock_api(self):
+        return self.client.get(self.url).json()[0]["stock_actual"]
+
+    def test_segunda_lectura_no_consulta_la_base_de_datos(self):
+        self.client.get(self.url)
+        self.client.get(reverse("home"))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(reverse("home"))
+
+        self.assertEqual(response.json()[0]["titulo"], "Libro Cache")
+
+    def test_cambio_de_libro_invalida_de_inmediato(self):
+        self.client.get(self.url)
+        self.libro.titulo = "Libro Renombrado"
+        self.libro.save()
+
+        self.assertEqual(self.client.get(self.url).json()[0]["titulo"], "Libro Renombrado")
+
+    @override_settings(CATALOGO_STOCK_STALENESS=3600)
+    def test_cambios_de_stock_respetan_la_ventana_de_desactualizacion(self):
+        self.assertEqual(self._stock_api(), 4)
+
+        CompraRapidaService(procesador_pago=ProcesadorPagoExitoso()).procesar(self.libro.id)
+
+        self.assertEqual(self._stock_api(), 4)
+        with override_settings(CATALOGO_STOCK_STALENESS=0):
+            self.assertEqual(self._stock_api(), 3)
+
+    @override_settings(CATALOGO_STOCK_STALENESS=0)
+    def test_descuento_por_servicio_marca_el_stock_como_modificado(self):
+        self.assertEqual(self._stock_api(), 4)
+
+        CompraService(procesador_pago=ProcesadorPagoExitoso()).ejecutar_proceso_compra(
+            usuario="Estudiante",
+            lista_productos=[self.libro, self.libro],
+            direccion="EAFIT",
+        )
+
+        self.assertEqual(self._stock_api(), 2)
+
+    def test_edicion_completa_de_inventario_invalida_de_inmediato(self):
+        self.assertEqual(self._stock_api(), 4)
+        self.inventario.cantidad = 10
+        self.inventario.save()
+
+        self.assertEqual(self._stock_api(), 10)
+
+    def test_catalogo_usa_registros_compactos_y_comparte_la_copia_del_proceso(self):
+        productos = obtener_catalogo()
+
+        self.assertIsInstance(productos[0], ProductoCatalogo)
+        self.assertFalse(hasattr(productos[0], "__dict__"))
+        self.assertEqual(productos[0].stock_actual, 4)
+        self.assertEqual(productos[0].total_con_iva, CalculadorImpuestos.obtener_total_con_iva(Decimal("30.00")))
+        self.assertEqual(productos[0].a_dict(), self.client.get(self.url).json()[0])
+        with self.assertNumQueries(0):
+            self.assertIs(obtener_catalogo(), productos)
+
+    def test_copia_del_proceso_vence_aunque_otro_worker_suba_la_version_en_su_cache(self):
+        self.assertEqual(obtener_catalogo()[0].stock_actual, 4)
+
+        # Otro worker con su propia LocMem: cambia el stock y sube la version solo en su cache.
+        otro_worker = LocMemCache("catalogo-otro-worker", {})
+        with patch("tienda_app.catalogo.cache", otro_worker):
+            Inventario.objects.filter(pk=self.inventario.pk).update(cantidad=9)
+            invalidar_catalogo()
+
+        self.assertEqual(obtener_catalogo()[0].stock_actual, 4)
+        # Pasado CATALOGO_CACHE_TIMEOUT vencen la copia del proceso y la entrada de la cache local.
+        espera = settings.CATALOGO_CACHE_TIMEOUT + 1
+        monotonic, ahora = time.monotonic() + espera, time.time() + espera
+        with patch("time.monotonic", return_value=monotonic), patch("time.time", return_value=ahora):
+            self.assertEqual(obtener_catalogo()[0].stock_actual, 9)
+
+    def test_producto_catalogo_acepta_el_acceso_anterior_por_clave(self):
+        producto = ProductoCatalogo(7, "Libro", Decimal("10.00"), "", None)
+
+        self.assertIs(producto["libro"], producto)
+        self.assertEqual(producto["stock_actual"], 0)
+        with self.assertRaises(KeyError):
+            producto["autor"]
+
+
+class ProductosPaginacionAPITestCase(TestCase):
+    def setUp(self):
+        self.libros = [
+            Libro.objects.create(titulo=f"Libro {indice}", precio=Decimal(10 * (indice + 1)))
+            for indice in range(5)
+        ]
+        for indice, libro in enumerate(self.libros):
+            Inventario.objects.create(libro=libro, cantidad=indice % 2)
+        self.url = reverse("api_productos")
+
+    def test_pagina_por_cursor_y_anuncia_siguiente_en_link(self):
+        response = self.client.get(self.url, {"limite": 2})
+
+        self.assertEqual([item["id"] for item in response.json()], [self.libros[0].id, self.libros[1].id])
+        self.assertIn(f"cursor={self.libros[1].id}", response["Link"])
+        self.assertIn('rel="next"', response["Link"])
+
+        response = self.client.get(self.url, {"limite": 2, "cursor": self.libros[3].id})
+
+        self.assertEqual([item["id"] for item in response.json()], [self.libros[4].id])
+        self.assertFalse(response.has_header("Link"))
+
+    def test_recorrer_todas_las_paginas_devuelve_el_catalogo_completo(self):
+        ids = []
+        parametros = {"limite": 2}
+        while True:
+            response = self.client.get(self.url, parametros)
+            ids.extend(item["id"] for item in response.json())
+            if not response.has_header("Link"):
+                break
+            parametros["cursor"] = ids[-1]
+
+        self.assertEqual(ids, [libro.id for libro in self.libros])
+
+    def test_filtra_por_stock_y_rango_de_precio(self):
+        en_stock = self.client.get(self.url, {"en_stock": "true"}).json()
+        agotados = self.client.get(self.url, {"en_stock": "false"}).json()
+        por_precio = self.client.get(self.url, {"precio_min": "20", "precio_max": "40"}).json()
+
+        self.assertEqual([item["id"] for item in en_stock], [self.libros[1].id, self.libros[3].id])
+        self.assertEqual(
+            [item["id"] for item in agotados],
+            [self.libros[0].id, self.libros[2].id, self.libros[4].id],
+        )
+        self.assertEqual(
+            [item["precio"] for item in por_precio],
+            ["20.00", "30.00", "40.00"],
+        )
+
+    def test_valida_parametros(self):
+        response = self.client.get(self.url, {"limite": 0})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("limite", response.json())
+
+    def test_responde_304_si_el_etag_no_cambio(self):
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+
+        no_modificado = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(no_modificado.status_code, 304)
+        self.assertEqual(no_modificado["ETag"], etag)
+        self.assertEqual(no_modificado.content, b"")
+
+    def test_etag_cambia_cuando_cambia_el_catalogo(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.libros[0].precio = Decimal("99.00")
+        self.libros[0].save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class CargaUtilidadesTestCase(SimpleTestCase):
+    def test_percentil_por_rango_mas_cercano(self):
+        valores = [float(valor) for valor in range(1, 101)]
+
+        self.assertEqual(percentil(valores, 50), 50.0)
+        self.assertEqual(percentil(valores, 95), 95.0)
+        self.assertEqual(percentil(valores, 99), 99.0)
+        self.assertEqual(percentil([], 99), 0.0)
+
+    def test_resumen_detecta_sobreventa_e_inconsistencia(self):
+        resultados = [("exito", 0.01)] * 4 + [("rechazo", 0.02), ("lock", 0.5)]
+
+        resumen = resumir(resultados, 2.0, stock_inicial=3, stock_final=0, unidades_vendidas=4)
+
+        self.assertEqual(resumen["requests"], 6)
+        self.assertEqual(resumen["requests_por_segundo"], 3.0)
+        self.assertEqual(resumen["sobreventa"], 1)
+        self.assertEqual(resumen["errores_lock"], 1)
+        self.assertFalse(resumen["stock_consistente"])
+
+
+class SimularCargaCommandTestCase(TransactionTestCase):
+    def test_simulacion_reporta_cada_ruta_y_limpia_los_datos(self):
+        salida = StringIO()
+
+        call_command(
+            "simular_carga",
+            rutas="fbv,api",
+            compradores=1,
+            compras=3,
+            stock=2,
+            stdout=salida,
+        )
+
+        reporte = salida.getvalue()
+        self.assertIn("Ruta fbv", reporte)
+        self.assertIn("Ruta api", reporte)
+        self.assertEqual(reporte.count("sobreventa=0"), 2)
+        self.assertEqual(reporte.count("consistente=True"), 2)
+        self.assertIn("exitos=2 rechazos=1", reporte)
+        self.assertFalse(Libro.objects.exists())
+        self.assertFalse(Orden.objects.exists())
+
+    def test_simulacion_con_inventario_fragmentado(self):
+        salida = StringIO()
+
+        call_command("simular_carga", rutas="service", compradores=1, compras=5, stock=4, fragmentos="0,2", stdout=salida)
+
+        reporte = salida.getvalue()
+        self.assertIn("Ruta service\n", reporte)
+        self.assertIn("Ruta service con 2 fragmentos", reporte)
+        self.assertEqual(reporte.count("sobreventa=0"), 2)
+        self.assertEqual(reporte.count("consistente=True"), 2)
+        self.assertEqual(reporte.count("exitos=4 rechazos=1"), 2)
+        self.assertFalse(InventarioFragmento.objects.exists())
+
+    def test_exitos_en_hilos_coinciden_con_las_ordenes_confirmadas(self):
+        libro = Libro.objects.create(titulo="Carga en hilos", precio=Decimal("10.00"))
+        Inventario.objects.create(libro=libro, cantidad=5)
+        procesar = CompraRapidaService.procesar
+        fallos = []
+        candado = threading.Lock()
+
+        def procesar_con_un_lock(servicio, libro_id):
+            # El primer request falla con un error de lock no capturado por la vista.
+            with candado:
+                primero = not fallos
+                fallos.append(primero)
+            if primero:
+                raise OperationalError("database is locked")
+            return procesar(servicio, libro_id)
+
+        # Con SQLite otros hilos tambien chocan con locks y dejan ordenes por verificar en el log.
+        with patch.object(CompraRapidaService, "procesar", procesar_con_un_lock), patch("tienda_app.services.logger"):
+            resultados, duracion = ejecutar_compradores("service", libro.id, 4, 3, "testserver", modo="hilos")
+
+        confirmadas = Orden.objects.filter(items__libro=libro, estado=Orden.Estado.CONFIRMADA).count()
+        resumen = resumir(resultados, duracion, 5, stock_de(libro.id), confirmadas)
+        self.assertEqual(resumen["requests"], 12)
+        self.assertEqual(resumen["exitos"], confirmadas)
+        self.assertEqual(resumen["exitos"] + resumen["rechazos"] + resumen["errores"] + resumen["errores_lock"], 12)
+        self.assertGreaterEqual(resumen["errores_lock"], 1)
+        self.assertEqual(resumen["sobreventa"], 0)
+
+    def test_rechaza_rutas_desconocidas(self):
+        with self.assertRaisesMessage(CommandError, "Rutas desconocidas: otra"):
+            call_command("simular_carga", rutas="otra", stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, "--workers debe ser mayor que 0."):
+            call_command("simular_carga", rutas="api", workers=0, stdout=StringIO())
+
+    def test_simulacion_compara_la_ruta_sync_con_la_async(self):
+        salida = StringIO()
+
+        call_command(
+            "simular_carga",
+            rutas="api,api_async",
+            compradores=2,
+            compras=2,
+            stock=3,
+            workers=1,
+            stdout=salida,
+        )
+
+        reporte = salida.getvalue()
+        self.assertIn("Ruta api\n", reporte)
+        self.assertIn("Ruta api_async\n", reporte)
+        self.assertEqual(reporte.count("sobreventa=0"), 2)
+        self.assertEqual(reporte.count("consistente=True"), 2)
+        self.assertEqual(reporte.count("exitos=3 rechazos=1"), 2)
+        self.assertFalse(Orden.objects.exists())
+
+
+def _cargar_settings(**entorno):
+    entorno = {
+        "SECRET_KEY": "clave",
+        "ALLOWED_HOSTS": "localhost",
+        "DB_NAME": "tienda",
+        "DB_USER": "tienda",
+        "DB_PASSWORD": "clave",
+        "DB_HOST": "db",
+        **entorno,
+    }
+    ruta = Path(settings.BASE_DIR) / "Tienda" / "settings.py"
+    with patch.dict(os.environ, entorno, clear=True):
+        spec = importlib.util.spec_from_file_location("tienda_settings_prueba", ruta)
+        modulo = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(modulo)
+    return modulo.DATABASES["default"]
+
+
+class ConexionesBaseDatosTestCase(TransactionTestCase):
+    def test_por_defecto_una_conexion_por_request_sin_pool(self):
+        base = _cargar_settings()
+
+        self.assertEqual((base["CONN_MAX_AGE"], base["CONN_HEALTH_CHECKS"]), (0, False))
+        self.assertEqual(base["OPTIONS"], {"connect_timeout": 10})
+
+    def test_conexiones_persistentes_y_pool_desde_el_entorno(self):
+        persistente = _cargar_settings(DB_CONN_MAX_AGE="60", DB_CONN_HEALTH_CHECKS="true")
+        con_pool = _cargar_settings(DB_POOL="true", DB_POOL_MAX_SIZE="20", DB_POOL_TIMEOUT="5")
+
+        self.assertEqual((persistente["CONN_MAX_AGE"], persistente["CONN_HEALTH_CHECKS"]), (60, True))
+        self.assertNotIn("pool", persistente["OPTIONS"])
+        self.assertEqual(con_pool["CONN_MAX_AGE"], 0)
+        self.assertEqual(
+            con_pool["OPTIONS"]["pool"],
+            {"min_size": 2, "max_size": 20, "timeout": 5, "max_idle": 300, "max_lifetime": 3600},
+        )
+
+    def test_health_checks_del_pool_los_configura_el_backend(self):
+        con_pool = _cargar_settings(DB_POOL="true", DB_CONN_HEALTH_CHECKS="true")
+
+        self.assertTrue(con_pool["CONN_HEALTH_CHECKS"])
+        # El backend ya pasa check=ConnectionPool.check_connection; repetirlo en las
+        # opciones del pool duplicaria el argumento al crear el ConnectionPool.
+        self.assertNotIn("check", con_pool["OPTIONS"]["pool"])
+
+    def test_pool_con_conexiones_persistentes_o_valores_invalidos(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, "DB_POOL requires DB_CONN_MAX_AGE=0"):
+            _cargar_settings(DB_POOL="true", DB_CONN_MAX_AGE="60")
+        with self.assertRaisesMessage(ImproperlyConfigured, "DB_POOL_MAX_SIZE must be an integer"):
+            _cargar_settings(DB_POOL="true", DB_POOL_MAX_SIZE="diez")
+
+    def test_medir_conexiones_compara_los_modos_y_restaura_la_configuracion(self):
+        max_age = connection.settings_dict["CONN_MAX_AGE"]
+        salida = StringIO()
+
+        call_command("medir_conexiones", requests=5, stdout=salida)
+
+        reporte = salida.getvalue()
+        self.assertIn("Modo sin_persistencia (CONN_MAX_AGE=0)", reporte)
+        self.assertIn("Modo persistente (CONN_MAX_AGE=60)", reporte)
+        self.assertEqual(reporte.count("requests=5 "), 2)
+        self.assertIn("persistente: ", reporte)
+        self.assertEqual(connection.settings_dict["CONN_MAX_AGE"], max_age)
+        self.assertNotIn("pool", connection.settings_dict["OPTIONS"])
+        with self.assertRaisesMessage(CommandError, "--requests debe ser mayor que 0."):
+            call_command("medir_conexiones", requests=0, stdout=StringIO())
+
+
+class BenchmarkTestCase(TestCase):
+    ESCENARIOS_RAPIDOS = [
+        ("compra_service", 1),
+        ("compra_service", 50),
+        ("compra_rapida_pesimista", 1),
+        ("compra_rapida_optimista", 1),
+        ("compra_rapida_fragmentada", 4),
+        ("compra_rapida_encolada", 1),
+        ("procesar_compras_encoladas", 10),
+        ("catalogo_sin_cache", 10),
+        ("catalogo_con_cache", 10),
+        ("catalogo_modelos", 10),
+        ("libro_serializer", 10),
+        ("importar_catalogo", 1000),
+    ]
+
+    def test_consultas_no_superan_la_linea_base(self):
+        linea_base = cargar_linea_base()
+
+        for nombre, tamano in self.ESCENARIOS_RAPIDOS:
+            with self.subTest(escenario=nombre, tamano=tamano):
+                medicion = medir(nombre, tamano, repeticiones=1)
+                self.assertLessEqual(medicion["consultas"], linea_base[f"{nombre}[{tamano}]"]["consultas"])
+
+    def test_medir_con_memoria_reporta_el_pico(self):
+        medicion = medir("catalogo_sin_cache", 10, repeticiones=1, memoria=True)
+
+        self.assertGreater(medicion["pico_kb"], 0)
+        self.assertNotIn("pico_kb", medir("catalogo_sin_cache", 10, repeticiones=1))
+
+    def test_medir_revierte_los_datos_del_escenario(self):
+        medir("compra_service", 10, repeticiones=1)
+
+        self.assertFalse(Libro.objects.exists())
+        self.assertFalse(Orden.objects.exists())
+
+    def test_comparar_detecta_regresiones_de_consultas_y_tiempo(self):
+        linea_base = {"a[1]": {"consultas": 3}, "b[1]": {"consultas": 3}}
+        tiempos_locales = {"a[1]": 10.0, "b[1]": 10.0}
+        resultados = {
+            "a[1]": {"consultas": 4, "mediana_ms": 10.0},
+            "b[1]": {"consultas": 3, "mediana_ms": 16.0},
+            "nuevo[1]": {"consultas": 99, "mediana_ms": 99.0},
+        }
+
+        regresiones = comparar(resultados, linea_base, tiempos_locales, tolerancia=0.5)
+
+        self.assertEqual(len(regresiones), 2)
+        self.assertIn("a[1]: 4 consultas", regresiones[0])
+        self.assertIn("b[1]: 16.00 ms", regresiones[1])
+        # Sin tiempos locales solo se comparan las consultas.
+        self.assertEqual(len(comparar(resultados, linea_base)), 1)
+
+    def test_la_linea_base_versionada_no_guarda_tiempos(self):
+        self.assertTrue(all(set(base) == {"consultas"} for base in cargar_linea_base().values()))
+
+    def test_comando_compara_tiempos_solo_contra_los_locales(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        tiempos = Path(directorio.name) / "tiempos.json"
+        opciones = {"repeticiones": 1, "tiempos_locales": str(tiempos), "stdout": StringIO()}
+
+        with self.assertRaisesMessage(CommandError, "grabelos antes con --guardar-tiempos"):
+            call_command("benchmark", "catalogo_sin_cache", tiempos=True, **opciones)
+
+        call_command("benchmark", "catalogo_sin_cache", guardar_tiempos=True, **opciones)
+        self.assertEqual(len(json.loads(tiempos.read_text())), 3)
+
+        # Por defecto los tiempos no se comparan; con --tiempos si.
+        tiempos.write_text(json.dumps({"catalogo_sin_cache[1000]": 0.0}))
+        call_command("benchmark", "catalogo_sin_cache", **opciones)
+        with self.assertRaisesMessage(CommandError, "catalogo_sin_cache[1000]"):
+            call_command("benchmark", "catalogo_sin_cache", tiempos=True, **opciones)
+
+
+class MetricasMiddlewareTestCase(TestCase):
+    def setUp(self):
+        registro_metricas.reiniciar()
+        self.addCleanup(registro_metricas.reiniciar)
+        self.libro = Libro.objects.create(titulo="Libro Metricas", precio=Decimal("25.00"))
+        Inventario.objects.create(libro=self.libro, cantidad=5)
+
+    def _server_timing(self, response):
+        return dict(
+            (parte.split(";")[0].strip(), parte)
+            for parte in response["Server-Timing"].split(",")
+        )
+
+    def test_agrega_server_timing_con_consultas_y_tiempos(self):
+        response = self.client.post(reverse("compra_rapida_cbv", args=[self.libro.id]))
+
+        timing = self._server_timing(response)
+        self.assertEqual(set(timing), {"db", "lock", "view"})
+        self.assertRegex(timing["db"], r'desc="[1-9]\d* consultas"')
+        self.assertRegex(timing["lock"], r"dur=\d+\.\d{2}")
+
+    def test_metrics_agrega_por_nombre_de_url(self):
+        self.client.get(reverse("home"))
+        self.client.get(reverse("home"))
+        self.client.post(reverse("compra_rapida_fbv", args=[self.libro.id]))
+
+        response = self.client.get(reverse("metricas"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        contenido = response.content.decode()
+        self.assertIn('tienda_http_request_duration_seconds_count{url_name="home"} 2', contenido)
+        self.assertIn('tienda_http_request_duration_seconds_count{url_name="compra_rapida_fbv"} 1', contenido)
+        self.assertIn('tienda_http_request_duration_seconds_bucket{url_name="home",le="+Inf"} 2', contenido)
+        self.assertRegex(contenido, r'tienda_db_queries_total\{url_name="compra_rapida_fbv"\} [1-9]')
+        self.assertIn('tienda_db_lock_time_seconds_total{url_name="compra_rapida_fbv"}', contenido)
+
+    def test_rutas_inexistentes_se_agrupan(self):
+        self.client.get("/no-existe/")
+
+        self.assertIn('url_name="sin_ruta"', registro_metricas.exportar())
+
+    def test_consultas_fuera_de_un_request_no_se_miden(self):
+        Libro.objects.count()
+
+        self.assertEqual(registro_metricas.exportar().count("url_name"), 0)
+
+    async def test_vistas_async_se_miden_sin_pasar_por_un_hilo(self):
+        self.assertTrue(iscoroutinefunction(MetricasMiddleware(self._respuesta_async)))
+        self.assertFalse(iscoroutinefunction(MetricasMiddleware(lambda request: HttpResponse())))
+
+        response = await self.async_client.get(reverse("api_orden", args=[999]))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('desc="1 consultas"', response["Server-Timing"])
+        self.assertIn('tienda_http_request_duration_seconds_count{url_name="api_orden"} 1', registro_metricas.exportar())
+
+    @staticmethod
+    async def _respuesta_async(request):
+        return HttpResponse()
+
+
+class OrdenAPITestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="Libro Orden", precio=Decimal("10.00"))
+        otro = Libro.objects.create(titulo="Otro Libro", precio=Decimal("5.00"))
+        self.orden = Orden.objects.create(
+            libro=self.libro,
+            total=Decimal("29.75"),
+            estado=Orden.Estado.PENDIENTE,
+            reservada_hasta=timezone.now() + timedelta(minutes=10),
+        )
+        OrdenItem.objects.create(orden=self.orden, libro=self.libro, cantidad=2, precio_unitario=Decimal("10.00"))
+        OrdenItem.objects.create(orden=self.orden, libro=otro, cantidad=1, precio_unitario=Decimal("5.00"))
+        self.url = reverse("api_orden", args=[self.orden.id])
+
+    def test_orden_con_items_en_dos_consultas(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        datos = response.json()
+        self.assertEqual((datos["id"], datos["estado"], datos["total"]), (self.orden.id, "pendiente", "29.75"))
+        self.assertEqual(
+            sorted((item["libro"], item["cantidad"]) for item in datos["items"]),
+            sorted([(self.libro.id, 2), (self.libro.id + 1, 1)]),
+        )
+        self.assertNotIn("direccion_envio", datos)
+        self.assertEqual(response["Cache-Control"], "no-store")
+
+    def test_orden_inexistente_y_parametros_invalidos(self):
+        self.assertEqual(self.client.get(reverse("api_orden", args=[self.orden.id + 1])).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {"wait": "-1"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"estado": "otro"}).status_code, 400)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    async def test_long_poll_responde_cuando_cambia_el_estado(self):
+        async def confirmar():
+            await asyncio.sleep(0.2)
+            await Orden.objects.filter(pk=self.orden.pk).aupdate(estado=Orden.Estado.CONFIRMADA)
+
+        inicio = time.monotonic()
+        response, _ = await asyncio.gather(self.async_client.get(self.url, {"wait": "10"}), confirmar())
+
+        self.assertEqual(response.json()["estado"], "confirmada")
+        self.assertLess(time.monotonic() - inicio, 5)
+
+    async def test_long_poll_con_estado_conocido_y_tiempo_agotado(self):
+        response = await self.async_client.get(self.url, {"wait": "5", "estado": "confirmada"})
+        self.assertEqual(response.json()["estado"], "pendiente")
+
+        inicio = time.monotonic()
+        response = await self.async_client.get(self.url, {"wait": "0.3"})
+        self.assertGreaterEqual(time.monotonic() - inicio, 0.3)
+        self.assertEqual(response.json()["estado"], "pendiente")
+
+    @override_settings(ORDENES_ESPERA_MAXIMA_SEGUNDOS=0)
+    async def test_wait_respeta_el_tope_configurado(self):
+        inicio = time.monotonic()
+        response = await self.async_client.get(self.url, {"wait": "30"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - inicio, 1)
+
+    async def test_long_poll_de_una_orden_liberada_y_borrada(self):
+        async def borrar():
+            await asyncio.sleep(0.2)
+            await Orden.objects.filter(pk=self.orden.pk).adelete()
+
+        response, _ = await asyncio.gather(self.async_client.get(self.url, {"wait": "10"}), borrar())
+
+        self.assertEqual(response.status_code, 404)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_compra_api_retorna_la_url_de_la_orden(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+        Inventario.objects.create(libro=self.libro, cantidad=1)
+
+        response = self.client.post(
+            reverse("api_comprar"),
+            data={"libro_id": self.libro.id, "direccion_envio": "Calle 1"},
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Location"], response.json()["orden_url"])
+        orden = self.client.get(response["Location"]).json()
+        self.assertEqual((orden["id"], orden["estado"]), (response.json()["orden_id"], "confirmada"))
+
+
+class VistasAsyncTestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="Libro Async", precio=Decimal("20.00"))
+        self.inventario = Inventario.objects.create(libro=self.libro, cantidad=2)
+        self.url = reverse("api_comprar_async")
+        respuestas_recientes.limpiar()
+        self.addCleanup(respuestas_recientes.limpiar)
+
+    def _payload(self, **cambios):
+        return json.dumps({"libro_id": self.libro.id, "direccion_envio": "Calle Async", **cambios})
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    async def test_compra_async_cobra_con_apagar_y_confirma(self, mock_get_processor):
+        procesador = ProcesadorPagoAsync()
+        mock_get_processor.return_value = procesador
+
+        response = await self.async_client.post(self.url, data=self._payload(), content_type="application/json")
+
+        self.assertEqual(response.status_code, 201)
+        datos = response.json()
+        self.assertEqual(datos["estado"], "exito")
+        self.assertEqual(response["Location"], datos["orden_url"])
+        orden = await Orden.objects.aget(pk=datos["orden_id"])
+        self.assertEqual((orden.estado, orden.usuario), (Orden.Estado.CONFIRMADA, "Invitado API"))
+        self.assertEqual(procesador.montos, [orden.total])
+        self.assertEqual((await Inventario.objects.aget(pk=self.inventario.pk)).cantidad, 1)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_procesador_solo_sync_cobra_en_un_hilo(self, mock_get_processor):
+        procesador = ProcesadorPagoExitoso()
+        mock_get_processor.return_value = procesador
+
+        response = self.client.post(self.url, data=self._payload(), content_type="application/json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(procesador.montos), 1)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_pago_rechazado_devuelve_la_reserva(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoFallido()
+
+        response = self.client.post(self.url, data=self._payload(), content_type="application/json")
+
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Orden.objects.exists())
+        self.assertEqual(Inventario.objects.get(pk=self.inventario.pk).cantidad, 2)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_errores_iguales_a_la_vista_sync(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoAsync()
+        Inventario.objects.filter(pk=self.inventario.pk).update(cantidad=0)
+
+        def comprar(data):
+            return self.client.post(self.url, data=data, content_type="application/json")
+
+        self.assertIn("libro_id", comprar(json.dumps({"direccion_envio": "Sin libro"})).json())
+        self.assertEqual(comprar("{no es json").status_code, 400)
+        self.assertEqual(comprar(self._payload(libro_id=99999)).json(), {"error": "Libro no encontrado."})
+        self.assertEqual(comprar(self._payload()).status_code, 409)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_idempotency_key_repite_la_primera_respuesta(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoAsync()
+
+        def comprar():
+            return self.client.post(
+                self.url,
+                data=self._payload(),
+                content_type="application/json",
+                HTTP_IDEMPOTENCY_KEY="async-1",
+            )
+
+        primera = comprar()
+        segunda = comprar()
+
+        self.assertEqual(primera.status_code, 201)
+        self.assertEqual((segunda.status_code, segunda.json()), (201, primera.json()))
+        self.assertEqual(segunda["Idempotent-Replayed"], "true")
+        self.assertEqual(Orden.objects.count(), 1)
+        self.assertEqual(Inventario.objects.get(pk=self.inventario.pk).cantidad, 1)
+
+    @patch("tienda_app.api.views.PaymentFactory.get_processor")
+    def test_con_sesion_exige_csrf_como_drf(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoAsync()
+        cliente = self.client_class(enforce_csrf_checks=True)
+
+        anonimo = cliente.post(self.url, data=self._payload(), content_type="application/json")
+        cliente.force_login(User.objects.create_user("lector", password="clave-segura"))
+        con_sesion = cliente.post(self.url, data=self._payload(), content_type="application/json")
+
+        self.assertEqual(anonimo.status_code, 201)
+        self.assertEqual(con_sesion.status_code, 403)
+        self.assertEqual(Orden.objects.count(), 1)
+
+    def test_productos_async_igual_que_la_vista_sync(self):
+        otro = Libro.objects.create(titulo="Otro Async", precio=Decimal("35.00"))
+        Inventario.objects.create(libro=otro, cantidad=0)
+
+        sync = self.client.get(reverse("api_productos"), {"limite": 1})
+        response = self.client.get(reverse("api_productos_async"), {"limite": 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), sync.json())
+        self.assertEqual(response["ETag"], sync["ETag"])
+        self.assertIn(f"/api/v1/async/productos/?limite=1&cursor={self.libro.id}", response["Link"])
+        self.assertEqual(
+            self.client.get(reverse("api_productos_async"), {"limite": 1}, HTTP_IF_NONE_MATCH=sync["ETag"]).status_code,
+            304,
+        )
+        self.assertEqual(self.client.get(reverse("api_productos_async"), {"limite": 0}).status_code, 400)
+
+    def test_productos_async_sin_consultas_con_cache(self):
+        self.client.get(reverse("api_productos_async"))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("api_productos_async"))
+
+        self.assertEqual(response.json()[0]["stock_actual"], 2)
+
+    def test_catalogo_e_inventario_async(self):
+        for nombre, plantilla in (("home_async", "catalogo.html"), ("inventario_async", "inventario.html")):
+            response = self.client.get(reverse(nombre))
+
+            self.assertEqual(response.status_code, 200)
+            self.assertTemplateUsed(response, f"tienda_app/{plantilla}")
+            self.assertContains(response, "Libro Async")
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse("home_async"))
+
+    def test_apagar_por_defecto_corre_pagar(self):
+        class ProcesadorSoloSync(ProcesadorPago):
+            def pagar(self, monto, productos=None, referencia=None):
+                return monto > 0
+
+        self.assertTrue(asyncio.run(ProcesadorSoloSync().apagar(10)))
+        self.assertFalse(asyncio.run(ProcesadorSoloSync().apagar(0)))
+        self.assertTrue(asyncio.run(BancoNacionalProcesador().apagar(10)))
+
+
+class CompraHTMLViewTestCase(TestCase):
+    def setUp(self):
+        self.libro = Libro.objects.create(titulo="Libro HTML", precio=Decimal("90.00"))
+        Inventario.objects.create(libro=self.libro, cantidad=2)
+
+    def test_home_renderiza_catalogo(self):
+        response = self.client.get(reverse("home"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "tienda_app/catalogo.html")
+        self.assertContains(response, "Catálogo")
+        self.assertContains(response, self.libro.titulo)
+
+    def test_compra_regular_get_usa_template_dedicado(self):
+        response = self.client.get(reverse("finalizar_compra", args=[self.libro.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "tienda_app/compra.html")
+        self.assertEqual(response.context["total"], CalculadorImpuestos.obtener_total_con_iva(self.libro.precio))
+
+    @patch("tienda_app.views.PaymentFactory.get_processor")
+    def test_compra_regular_post_renderiza_exito_en_template(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoExitoso()
+
+        response = self.client.post(reverse("finalizar_compra", args=[self.libro.id]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "tienda_app/compra.html")
+        self.assertIn("Orden", response.context["mensaje_exito"])
+        self.assertEqual(Orden.objects.count(), 1)
+        self.assertEqual(Orden.objects.get().items.count(), 1)
+
+    @patch("tienda_app.views.PaymentFactory.get_processor")
+    def test_compra_regular_post_renderiza_error_en_template(self, mock_get_processor):
+        mock_get_processor.return_value = ProcesadorPagoFallido()
+
+        response = self.client.post(reverse("finalizar_compra", args=[self.libro.id]))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTemplateUsed(response, "tienda_app/compra.html")
+        self.assertEqual(response.context["error"], "Error en la pasarela de pagos.")
+
+    def test_compra_rapida_fbv_get_usa_calculo_canonico(self):
+        response = self.client.get(reverse("compra_rapida_fbv", args=[self.libro.id]))
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context["total"], CalculadorImpuestos.obtener_total_con_iva(self.libro.precio))
@@ -393,6 +2984,20 @@ class CompraHTMLViewTestCase(TestCase):
         self.assertEqual(item.cantidad, 1)
         self.assertEqual(item.precio_unitario, self.libro.precio)
 
+    def test_rutas_legacy_compran_un_libro_fragmentado(self):
+        rebalancear(self.libro.id, 4)
+
+        for ruta in ("compra_rapida_fbv", "compra_rapida_cbv"):
+            with self.subTest(ruta=ruta):
+                response = self.client.post(reverse(ruta, args=[self.libro.id]))
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(Inventario.objects.get(libro=self.libro).cantidad, 0)
+
+        self.assertEqual(Orden.objects.count(), 2)
+        self.assertEqual(stock_de(self.libro.id), 0)
+        self.assertEqual(self.client.post(reverse("compra_rapida_fbv", args=[self.libro.id])).status_code, 400)
+
     def test_compra_rapida_cbv_post_crea_item_y_mantiene_libro_legacy(self):
         response = self.client.post(reverse("compra_rapida_cbv", args=[self.libro.id]))
 
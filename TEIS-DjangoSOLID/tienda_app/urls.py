@@ -1,22 +1,45 @@
 from django.urls import path
 
 from .views import (
+    catalogo_async_view,
     catalogo_view,
     compra_rapida_fbv,
     CompraRapidaView,
     CompraRapidaServiceView,
     CompraView,
+    inventario_async_view,
     inventario_view,
+    metricas_view,
+)
+from tienda_app.api.views import (
+    compra_async_view,
+    CompraAPIView,
+    CompraEncoladaAPIView,
+    CompraLoteAPIView,
+    ExportacionOrdenesAPIView,
+    orden_api_view,
+    productos_async_view,
+    ProductosAPIView,
+    ReporteVentasAPIView,
 )
-from tienda_app.api.views import CompraAPIView, ProductosAPIView
 
 urlpatterns = [
     path("", catalogo_view, name="home"),
     path("inventario/", inventario_view, name="inventario"),
+    path("catalogo-async/", catalogo_async_view, name="home_async"),
+    path("inventario-async/", inventario_async_view, name="inventario_async"),
+    path("metrics/", metricas_view, name="metricas"),
     path("compra-rapida-fbv/<int:libro_id>/", compra_rapida_fbv, name="compra_rapida_fbv"),
     path("compra-rapida-cbv/<int:libro_id>/", CompraRapidaView.as_view(), name="compra_rapida_cbv"),
     path("compra-rapida-service/<int:libro_id>/", CompraRapidaServiceView.as_view(), name="compra_rapida_service"),
     path('compra/<int:libro_id>/', CompraView.as_view(), name='finalizar_compra'),
     path("api/v1/productos/", ProductosAPIView.as_view(), name="api_productos"),
     path("api/v1/comprar/", CompraAPIView.as_view(), name="api_comprar"),
+    path("api/v1/async/productos/", productos_async_view, name="api_productos_async"),
+    path("api/v1/async/comprar/", compra_async_view, name="api_comprar_async"),
+    path("api/v1/comprar/lote/", CompraLoteAPIView.as_view(), name="api_comprar_lote"),
+    path("api/v1/ordenes/<int:orden_id>/", orden_api_view, name="api_orden"),
+    path("api/v1/compras/<uuid:token>/", CompraEncoladaAPIView.as_view(), name="api_compra_encolada"),
+    path("api/v1/reportes/ventas/", ReporteVentasAPIView.as_view(), name="api_reporte_ventas"),
+    path("api/v1/exportaciones/ordenes/", ExportacionOrdenesAPIView.as_view(), name="api_exportar_ordenes"),
 ]
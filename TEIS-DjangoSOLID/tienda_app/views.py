@@ -1,52 +1,67 @@
-import datetime
-
+from django.conf import settings
 from django.db import transaction
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils import timezone
 from django.views import View
 
-from .domain.logic import CalculadorImpuestos
+from .catalogo import aobtener_catalogo, obtener_catalogo
+from .domain.logic import motor_impuestos
+from .infra.auditoria import obtener_registro
 from .infra.factories import PaymentFactory
-from .infra.gateways import BancoNacionalProcesador
+from .metricas import registro_metricas
 from .models import Inventario, Libro, Orden, OrdenItem
-from .services import CompraRapidaService, CompraService
+from .services import CompraRapidaService, CompraService, _reservar_unidad, encolar_compra_rapida
 
 
 def _build_purchase_context(libro, **extra_context):
     context = {
         "libro": libro,
-        "total": CalculadorImpuestos.obtener_total_con_iva(libro.precio),
+        "total": motor_impuestos.total_libro(libro),
     }
     context.update(extra_context)
     return context
 
 
 def _build_catalog_items():
-    libros = Libro.objects.select_related("inventario").order_by("id")
-    items = []
-    for libro in libros:
-        stock_actual = libro.inventario.cantidad if hasattr(libro, "inventario") else 0
-        items.append(
-            {
-                "libro": libro,
-                "stock_actual": stock_actual,
-            }
-        )
-    return items
+    # Filas compactas compartidas por el proceso; ya traen stock y total con IVA.
+    return obtener_catalogo()
 
 
 def _crear_orden_legacy(libro, total):
     # Compatibilidad temporal: las rutas legacy siguen rellenando Orden.libro.
-    orden = Orden.objects.create(libro=libro, total=total)
+    orden = Orden.objects.create(libro=libro, total=total, confirmada_en=timezone.now())
     OrdenItem.objects.create(
         orden=orden,
         libro=libro,
         cantidad=1,
         precio_unitario=libro.precio,
+        tasa_iva=motor_impuestos.tasa_libro(libro),
     )
     return orden
 
 
+def _encolar_compra_rapida(request, libro_id):
+    # Modo COMPRA_RAPIDA_ENCOLADA: se reserva el stock, se encola y se responde 202.
+    try:
+        compra = encolar_compra_rapida(libro_id)
+    except (ValueError, Inventario.DoesNotExist):
+        return HttpResponse("Sin stock", status=400)
+
+    estado_url = request.build_absolute_uri(reverse("api_compra_encolada", args=[compra.token]))
+    response = JsonResponse(
+        {"estado": compra.estado, "compra": str(compra.token), "estado_url": estado_url},
+        status=202,
+    )
+    response["Location"] = estado_url
+    return response
+
+
+def metricas_view(request):
+    return HttpResponse(registro_metricas.exportar(), content_type="text/plain; version=0.0.4")
+
+
 def catalogo_view(request):
     return render(request, "tienda_app/catalogo.html", {"items": _build_catalog_items()})
 
@@ -55,26 +70,39 @@ def inventario_view(request):
     return render(request, "tienda_app/inventario.html", {"items": _build_catalog_items()})
 
 
+# Versiones async del catalogo: leen la version con cache.aget_many y, si hay que
+# reconstruir, iteran la consulta con el ORM async. En los backends de cache de
+# Django (LocMem incluido) y en el ORM esas llamadas siguen corriendo en un hilo
+# via sync_to_async; con la copia del proceso vigente solo se lee la version.
+async def catalogo_async_view(request):
+    return render(request, "tienda_app/catalogo.html", {"items": await aobtener_catalogo()})
+
+
+async def inventario_async_view(request):
+    return render(request, "tienda_app/inventario.html", {"items": await aobtener_catalogo()})
+
+
 def compra_rapida_fbv(request, libro_id):
     libro = get_object_or_404(Libro, id=libro_id)
 
     if request.method == "POST":
-        # VIOLACION SRP: Logica de inventario en la vista
-        inventario = Inventario.objects.get(libro=libro)
-        if inventario.cantidad > 0:
-            total = CalculadorImpuestos.obtener_total_con_iva(libro.precio)
-
-            # VIOLACION DIP: Proceso de pago acoplado al file system
-            with open("pagos_manuales.log", "a") as f:
-                f.write(f"[{datetime.datetime.now()}] Pago FBV: ${total}\n")
+        if settings.COMPRA_RAPIDA_ENCOLADA:
+            return _encolar_compra_rapida(request, libro.id)
 
+        # VIOLACION SRP: Logica de inventario en la vista
+        total = motor_impuestos.total_libro(libro)
+        try:
+            # La unidad sale de la fila principal o, si el libro esta fragmentado, de un fragmento.
             with transaction.atomic():
-                inventario.cantidad -= 1
-                inventario.save(update_fields=["cantidad"])
+                _reservar_unidad(libro.id)
                 _crear_orden_legacy(libro, total)
+        except ValueError:
+            return HttpResponse("Sin stock", status=400)
 
-            return HttpResponse(f"Compra exitosa: {libro.titulo}")
-        return HttpResponse("Sin stock", status=400)
+        # VIOLACION DIP: Proceso de pago acoplado a la bitacora local
+        obtener_registro("pagos_manuales.log").registrar("pago_fbv", libro_id=libro.id, total=total)
+
+        return HttpResponse(f"Compra exitosa: {libro.titulo}")
 
     return render(request, "tienda_app/compra_rapida.html", _build_purchase_context(libro))
 
@@ -89,29 +117,37 @@ class CompraRapidaView(View):
     def post(self, request, libro_id):
         # La logica de negocio aun reside aqui, pero separada del GET
         libro = get_object_or_404(Libro, id=libro_id)
-        inv = Inventario.objects.get(libro=libro)
-        if inv.cantidad > 0:
-            total = CalculadorImpuestos.obtener_total_con_iva(libro.precio)
+        if settings.COMPRA_RAPIDA_ENCOLADA:
+            return _encolar_compra_rapida(request, libro.id)
+        total = motor_impuestos.total_libro(libro)
+        try:
             with transaction.atomic():
-                inv.cantidad -= 1
-                inv.save(update_fields=["cantidad"])
+                _reservar_unidad(libro.id)
                 _crear_orden_legacy(libro, total)
-            return HttpResponse("Comprado via CBV")
-        return HttpResponse("Error", status=400)
+        except ValueError:
+            return HttpResponse("Error", status=400)
+        return HttpResponse("Comprado via CBV")
 
 
 class CompraRapidaServiceView(View):
     template_name = "tienda_app/compra_rapida.html"
 
     def setup_service(self):
-        gateway = BancoNacionalProcesador()
-        return CompraRapidaService(procesador_pago=gateway)
+        gateway = PaymentFactory.get_processor()
+        return CompraRapidaService(
+            procesador_pago=gateway,
+            estrategia=settings.COMPRA_RAPIDA_ESTRATEGIA,
+        )
 
     def get(self, request, libro_id):
         libro = get_object_or_404(Libro, id=libro_id)
         return render(request, self.template_name, _build_purchase_context(libro))
 
     def post(self, request, libro_id):
+        if settings.COMPRA_RAPIDA_ENCOLADA:
+            get_object_or_404(Libro, id=libro_id)
+            return _encolar_compra_rapida(request, libro_id)
+
         servicio = self.setup_service()
         try:
             total = servicio.procesar(libro_id)